@@ -0,0 +1,167 @@
+"""
+Micro-benchmarks of the DTOs in services/youtube/dtos.py and services/auth/dtos.py.
+
+For each DTO, it times validating a payload decoded from JSON (validate), validating the JSON bytes
+directly (parse_raw), serializing the DTO (bjson) and projecting the decoded payload onto the DTO (project).
+The first two are also run together with bjson (validate+bjson) as that is what a view would do.
+
+Run it with: python -m benchmarks.dtos
+"""
+import timeit
+from typing import Any, Callable, Dict, List, Tuple, Type
+
+import orjson
+
+from services.auth.dtos import LoginDetails, LoginStatusResponse, LoginPendingResponse, RefreshTokenRequest, \
+    RefreshTokenResponse
+from services.youtube.dtos import PlaylistItemListResponse, ChannelDetailsResponse, SubscriptionListResponse
+from utils.base_dto import BaseDto
+from utils.projection import project
+
+_ITEMS_PER_PAGE = 50
+_REPEAT = 5
+# the rough number of seconds each benchmark is run for in each repetition
+_DURATION = 0.2
+
+_THUMBNAIL = {"url": "https://i.ytimg.com/vi/abc/default.jpg", "width": 120, "height": 90}
+_THUMBNAILS = {size: _THUMBNAIL for size in ("default", "medium", "high", "standard", "maxres")}
+
+
+def _make_page(items: List[Dict[str, Any]], kind: str) -> Dict[str, Any]:
+    """Returns an upstream page of the given items"""
+    return {
+        "kind": kind,
+        "etag": "page-etag",
+        "nextPageToken": "next-page",
+        "items": items,
+        "pageInfo": {"totalResults": 1000, "resultsPerPage": len(items)},
+    }
+
+
+def _make_playlist_items() -> Dict[str, Any]:
+    """Returns the upstream JSON of a page of playlist items, with the extra fields YouTube sends"""
+    return _make_page([
+        {
+            "kind": "youtube#playlistItem",
+            "etag": f"etag-{i}",
+            "id": f"item-{i}",
+            "snippet": {
+                "publishedAt": "2022-01-01T00:00:00Z",
+                "channelId": "channel-id",
+                "title": f"Video {i}",
+                "description": "Some description " * 20,
+                "thumbnails": _THUMBNAILS,
+                "channelTitle": "Channel",
+                "playlistId": "playlist-id",
+                "position": i,
+                "resourceId": {"kind": "youtube#video", "videoId": f"video-{i}"},
+                "videoOwnerChannelTitle": "Channel",
+                "videoOwnerChannelId": "channel-id",
+            },
+        }
+        for i in range(_ITEMS_PER_PAGE)
+    ], kind="youtube#playlistItemListResponse")
+
+
+def _make_channels() -> Dict[str, Any]:
+    """Returns the upstream JSON of a page of channels, with the extra fields YouTube sends"""
+    return _make_page([
+        {
+            "kind": "youtube#channel",
+            "etag": f"etag-{i}",
+            "id": f"channel-{i}",
+            "snippet": {
+                "title": f"Channel {i}",
+                "description": "Some description " * 20,
+                "customUrl": f"@channel{i}",
+                "publishedAt": "2012-01-01T00:00:00Z",
+                "thumbnails": _THUMBNAILS,
+                "country": "UG",
+            },
+            "contentDetails": {"relatedPlaylists": {"likes": "", "uploads": f"uploads-{i}"}},
+        }
+        for i in range(_ITEMS_PER_PAGE)
+    ], kind="youtube#channelListResponse")
+
+
+def _make_subscriptions() -> Dict[str, Any]:
+    """Returns the upstream JSON of a page of subscriptions, with the extra fields YouTube sends"""
+    return _make_page([
+        {
+            "kind": "youtube#subscription",
+            "etag": f"etag-{i}",
+            "id": f"subscription-{i}",
+            "snippet": {
+                "publishedAt": "2022-01-01T00:00:00Z",
+                "title": f"Channel {i}",
+                "description": "Some description " * 20,
+                "resourceId": {"kind": "youtube#channel", "channelId": f"channel-{i}"},
+                "channelId": "my-channel-id",
+                "thumbnails": _THUMBNAILS,
+            },
+        }
+        for i in range(_ITEMS_PER_PAGE)
+    ], kind="youtube#subscriptionListResponse")
+
+
+_CASES: List[Tuple[Type[BaseDto], Dict[str, Any]]] = [
+    (PlaylistItemListResponse, _make_playlist_items()),
+    (ChannelDetailsResponse, _make_channels()),
+    (SubscriptionListResponse, _make_subscriptions()),
+    (LoginDetails, {
+        "device_code": "AH-1Ng3o-some-long-device-code",
+        "user_code": "GQVQ-JKEC",
+        "verification_url": "https://www.google.com/device",
+        "expires_in": 1800,
+        "interval": 5,
+    }),
+    (LoginStatusResponse, {
+        "access_token": "ya29.some-long-access-token",
+        "expires_in": 3599,
+        "refresh_token": "1//some-long-refresh-token",
+        "scope": "https://www.googleapis.com/auth/youtube.readonly",
+        "token_type": "Bearer",
+    }),
+    (LoginPendingResponse, {"status": "pending", "interval": 5}),
+    (RefreshTokenRequest, {"refresh_token": "1//some-long-refresh-token"}),
+    (RefreshTokenResponse, {
+        "access_token": "ya29.some-long-access-token",
+        "expires_in": 3599,
+        "scope": "https://www.googleapis.com/auth/youtube.readonly",
+        "token_type": "Bearer",
+    }),
+]
+
+
+def _get_benchmarks(model: Type[BaseDto], data: Dict[str, Any]) -> List[Tuple[str, Callable[[], Any]]]:
+    """Returns the named benchmarks of the given DTO over the given upstream payload"""
+    raw = orjson.dumps(data)
+    dto = model.validate(data)
+    return [
+        ("validate", lambda: model.validate(data)),
+        ("parse_raw", lambda: model.parse_raw(raw)),
+        ("bjson", dto.bjson),
+        ("validate+bjson", lambda: model.validate(orjson.loads(raw)).bjson()),
+        ("project", lambda: orjson.dumps(project(model, orjson.loads(raw)))),
+    ]
+
+
+def _time(func: Callable[[], Any]) -> float:
+    """Returns the best time, in seconds, of a single call of the given function"""
+    number, _ = timeit.Timer(func).autorange()
+    number = max(int(number * _DURATION / 0.2), 1)
+    return min(timeit.repeat(func, number=number, repeat=_REPEAT)) / number
+
+
+def main():
+    for model, data in _CASES:
+        # the projection should always give the same JSON as pydantic
+        assert model.validate(data).bjson() == orjson.dumps(project(model, data)), model
+
+        print(model.__name__)
+        for name, func in _get_benchmarks(model, data):
+            print(f"  {name:>15}: {_time(func) * 1e6:10.2f} us")
+
+
+if __name__ == '__main__':
+    main()
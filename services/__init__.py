@@ -1,3 +1,4 @@
+import functools
 import json
 import os
 from logging import Logger
@@ -6,10 +7,21 @@ from flask import Flask
 from flask_cors import CORS
 from pydantic import ValidationError
 
-from services import website, auth, youtube
-from utils.cache import Cache
+from services import website, auth, youtube, metrics
+from services.auth.poller import TvLoginPoller, create_tv_login_store
+from utils.assets import AssetManifest
+from utils.cache import Cache, EntityCache
+from utils.cache_backends import create_backend, CacheBackend
+from utils.compression import ResponseCompressor
 from utils.exc import APIException
+from utils.http import HttpClient
+from utils.instrumentation import RequestMetrics, RequestProfiler
 from utils.logging import initialize_logger
+from utils.metrics import MetricsRegistry, UpstreamMetrics
+from utils.quota import QuotaAccountant, create_quota_store
+from utils.resilience import RetryPolicy, CircuitBreakers
+from utils.singleflight import SingleFlight
+from utils.tokens import TokenStates
 
 _SERVICE_FOLDER = os.path.dirname(os.path.abspath(__file__))
 _ROOT_FOLDER = os.path.dirname(_SERVICE_FOLDER)
@@ -17,7 +29,6 @@ _ROOT_FOLDER = os.path.dirname(_SERVICE_FOLDER)
 
 def create_app(config_filename: str = "config.json", should_log_err_to_file: bool = True):
     """Application factory for creating the Flask app"""
-    err_logger = initialize_logger(name="error", should_log_to_file=should_log_err_to_file)
     app = Flask(
         __name__,
         instance_relative_config=True,
@@ -26,15 +37,102 @@ def create_app(config_filename: str = "config.json", should_log_err_to_file: boo
         template_folder=os.path.join(_SERVICE_FOLDER, "website", "templates"),
     )
     app.config.from_file(config_filename, load=json.load)
+    err_logger = initialize_logger(
+        name="error",
+        should_log_to_file=should_log_err_to_file,
+        queue_size=app.config.get("LOG_QUEUE_SIZE", 0),
+        batch_size=app.config.get("LOG_BATCH_SIZE", 100),
+        backup_count=app.config.get("LOG_BACKUP_COUNT", 0),
+        max_age=app.config.get("LOG_MAX_AGE_IN_DAYS", 0) * 24 * 60 * 60 or None,
+    )
+    metrics_registry = MetricsRegistry()
+    request_metrics = RequestMetrics(metrics_registry)
+    quota = _create_quota_accountant(app)
     app.config.from_mapping({
         "ERROR_LOGGER": err_logger,
-        "CACHE": Cache(ttl=app.config["CACHE_TTL_IN_SECONDS"]),
+        "CACHE": Cache(
+            ttl=app.config["CACHE_TTL_IN_SECONDS"],
+            stale_ttl=app.config.get("CACHE_STALE_TTL_IN_SECONDS", 0),
+            backend=_create_cache_backend(app),
+            ttl_factor=quota.ttl_factor,
+        ),
+        "ENTITY_CACHE": EntityCache(
+            cache=Cache(
+                ttl=app.config["CACHE_TTL_IN_SECONDS"],
+                stale_ttl=app.config.get("ENTITY_CACHE_STALE_TTL_IN_SECONDS", 0),
+                backend=_create_cache_backend(app, prefix="ENTITY_CACHE", table="entities"),
+                ttl_factor=quota.ttl_factor,
+            ),
+            ttls=app.config.get("ENTITY_CACHE_TTL_IN_SECONDS", {}),
+        ),
+        "COMPRESSION_CACHE": Cache(
+            ttl=app.config.get("COMPRESSION_CACHE_TTL_IN_SECONDS", 3600),
+            backend=_create_cache_backend(app, prefix="COMPRESSION_CACHE", table="compressed"),
+        ),
+        "METRICS": metrics_registry,
+        "QUOTA": quota,
+        "SINGLE_FLIGHT": SingleFlight(),
+        "TOKEN_STATES": TokenStates(
+            cache=Cache(
+                ttl=app.config.get("TOKEN_CACHE_RETENTION_IN_SECONDS", 3600),
+                backend=_create_cache_backend(app, prefix="TOKEN_CACHE", table="tokens"),
+            ),
+            retention=app.config.get("TOKEN_CACHE_RETENTION_IN_SECONDS", 3600),
+        ),
+        "HTTP_CLIENT": HttpClient(
+            pool_connections=app.config.get("HTTP_POOL_CONNECTIONS", 10),
+            pool_maxsize=app.config.get("HTTP_POOL_MAXSIZE", 100),
+            connect_timeout=app.config.get("HTTP_CONNECT_TIMEOUT_IN_SECONDS", 5),
+            read_timeout=app.config.get("HTTP_READ_TIMEOUT_IN_SECONDS", 30),
+            hooks=[UpstreamMetrics(metrics_registry), request_metrics.record_upstream, quota.record],
+            retry_policy=RetryPolicy(
+                max_retries=app.config.get("HTTP_MAX_RETRIES", 2),
+                backoff_base=app.config.get("HTTP_RETRY_BACKOFF_BASE_IN_SECONDS", 0.2),
+                backoff_max=app.config.get("HTTP_RETRY_BACKOFF_MAX_IN_SECONDS", 5),
+                max_retry_after=app.config.get("HTTP_MAX_RETRY_AFTER_IN_SECONDS", 10),
+            ),
+            circuit_breakers=CircuitBreakers(
+                failure_threshold=app.config.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5),
+                reset_timeout=app.config.get("CIRCUIT_BREAKER_RESET_TIMEOUT_IN_SECONDS", 30),
+            ),
+            logger=err_logger,
+        ),
     })
+    app.config["TV_LOGIN_POLLER"] = TvLoginPoller(
+        http_client=app.config["HTTP_CLIENT"],
+        client_id=app.config["GOOGLE_CLIENT_ID"],
+        client_secret=app.config["GOOGLE_CLIENT_SECRET"],
+        timeout=app.config["HTTP_REQUEST_TIMEOUT"],
+        store=create_tv_login_store(
+            name=app.config.get("CACHE_BACKEND", "memory"),
+            path=os.path.join(app.instance_path, app.config.get("CACHE_SQLITE_PATH", "cache.sqlite3")),
+        ),
+        concurrency=app.config.get("TV_LOGIN_POLL_CONCURRENCY", 20),
+        min_interval=app.config.get("TV_LOGIN_MIN_POLL_INTERVAL_IN_SECONDS", 5),
+        result_ttl=app.config.get("TV_LOGIN_RESULT_TTL_IN_SECONDS", 60),
+        idle_interval=app.config.get("TV_LOGIN_POLL_IDLE_INTERVAL_IN_SECONDS", 1),
+    )
+    metrics_registry.add_collector(functools.partial(metrics.collect_stats, app))
     CORS(app)
 
     app.register_blueprint(website.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(youtube.bp)
+    app.register_blueprint(metrics.bp)
+    AssetManifest(
+        source_path=app.static_folder,
+        build_path=os.path.join(app.instance_path, app.config.get("ASSETS_BUILD_PATH", "build/assets")),
+    ).init_app(app)
+    request_metrics.init_app(app)
+    ResponseCompressor(
+        min_size=app.config.get("COMPRESSION_MIN_SIZE_IN_BYTES", 1024),
+        levels=app.config.get("COMPRESSION_LEVELS", {}),
+        cache=app.config["COMPRESSION_CACHE"],
+    ).init_app(app)
+    RequestProfiler(
+        sample_rate=app.config.get("REQUEST_PROFILER_SAMPLE_RATE", 0),
+        path=os.path.join(app.instance_path, app.config.get("REQUEST_PROFILER_PATH", "profiles")),
+    ).init_app(app)
 
     @app.errorhandler(APIException)
     def api_exception(e: APIException):
@@ -49,3 +147,39 @@ def create_app(config_filename: str = "config.json", should_log_err_to_file: boo
         return app.response_class(e.json(), status=500)
 
     return app
+
+
+def _create_cache_backend(app: Flask, prefix: str = "CACHE", table: str = "cache") -> CacheBackend:
+    """
+    Creates the backend of the cache as configured by CACHE_BACKEND i.e. 'memory' for a store in
+    each worker's memory, or 'sqlite' for a store in the given table of the file at CACHE_SQLITE_PATH
+    shared by all workers. The bounds are read from the config keys starting with the given prefix
+    """
+    return create_backend(
+        name=app.config.get("CACHE_BACKEND", "memory"),
+        path=os.path.join(app.instance_path, app.config.get("CACHE_SQLITE_PATH", "cache.sqlite3")),
+        table=table,
+        max_entries=app.config.get(f"{prefix}_MAX_ENTRIES", 10000),
+        max_size_in_bytes=app.config.get(f"{prefix}_MAX_SIZE_IN_BYTES", 64 * 1024 * 1024),
+        sweep_interval=app.config.get("CACHE_SWEEP_INTERVAL_IN_SECONDS", 60),
+    )
+
+
+def _create_quota_accountant(app: Flask) -> QuotaAccountant:
+    """
+    Creates the accountant of the daily YouTube quota. Its usage is kept in the same kind of store as the cache
+    i.e. in each worker's memory for 'memory' or in the file at CACHE_SQLITE_PATH shared by all workers for 'sqlite'
+    """
+    return QuotaAccountant(
+        daily_budget=app.config.get("QUOTA_DAILY_BUDGET", 10000),
+        store=create_quota_store(
+            name=app.config.get("CACHE_BACKEND", "memory"),
+            path=os.path.join(app.instance_path, app.config.get("CACHE_SQLITE_PATH", "cache.sqlite3")),
+        ),
+        extend_ttl_below=app.config.get("QUOTA_EXTEND_TTL_BELOW", 0.5),
+        serve_stale_below=app.config.get("QUOTA_SERVE_STALE_BELOW", 0.25),
+        refuse_costly_below=app.config.get("QUOTA_REFUSE_COSTLY_BELOW", 0.1),
+        ttl_factor=app.config.get("QUOTA_TTL_FACTOR", 4),
+        max_cost_when_low=app.config.get("QUOTA_MAX_COST_WHEN_LOW", 1),
+        sync_interval=app.config.get("QUOTA_SYNC_INTERVAL_IN_SECONDS", 1),
+    )
@@ -1,9 +1,16 @@
 """Service for handling logins"""
+import math
+from http import HTTPStatus
+from typing import Union
+
 from flask import Blueprint, request, current_app
 
+from utils.exc import APIException
+from utils.tokens import TokenStates
 from utils.view_utils import body_required
 from . import client
-from .dtos import RefreshTokenRequest
+from .dtos import RefreshTokenRequest, LoginPendingResponse, LoginStatusResponse, RefreshTokenResponse
+from .poller import TvLoginPoller
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -15,6 +22,7 @@ def tv_login():
     and a User code for user to login with
     """
     response = client.initialize_tv_login(
+        http_client=current_app.config["HTTP_CLIENT"],
         client_id=current_app.config["GOOGLE_CLIENT_ID"])
     return response.jsonify(current_app)
 
@@ -25,16 +33,44 @@ def check_tv_login_status(device_id: str):
     Finalizes the logging in via TV after the user has visited
     the verification link on their mobile or desktop.
     It checks the Google endpoint at the given interval in seconds
-    passed as a query parameter to see the status of the login request
+    passed as a query parameter to see the status of the login request.
+    If the 'async' query parameter is passed, the checks are left to a shared background poller
+    and this responds right away, or after waiting at most 'wait' seconds, with a 202 LoginPendingResponse
+    if the user has not yet logged in.
+    The interval is never shorter than TV_LOGIN_MIN_POLL_INTERVAL_IN_SECONDS, and 'wait' is capped
+    at TV_LOGIN_MAX_WAIT_IN_SECONDS
     """
-    interval: int = request.args.get("interval", 5, int)
+    min_interval = current_app.config.get("TV_LOGIN_MIN_POLL_INTERVAL_IN_SECONDS", 5)
+    interval: int = max(request.args.get("interval", min_interval, int), min_interval)
+    if "async" in request.args:
+        wait = request.args.get("wait", 0, float)
+        if not math.isfinite(wait) or wait < 0:
+            raise APIException(message="'wait' should be a non-negative number of seconds", status_code=400)
+
+        wait = min(wait, current_app.config.get("TV_LOGIN_MAX_WAIT_IN_SECONDS", 30))
+        poller: TvLoginPoller = current_app.config["TV_LOGIN_POLLER"]
+        login = poller.wait(device_id=device_id, interval=interval, timeout=wait)
+        error = login.get_error()
+        if error is not None:
+            raise error
+
+        result = login.get_result()
+        if result is None:
+            pending = LoginPendingResponse(status="authorization_pending", interval=login.interval)
+            return pending.jsonify(current_app), HTTPStatus.ACCEPTED
+
+        _issue(result)
+        return result.jsonify(current_app)
+
     response = client.check_tv_login_status(
+        http_client=current_app.config["HTTP_CLIENT"],
         device_id=device_id,
         interval=interval,
         client_id=current_app.config["GOOGLE_CLIENT_ID"],
         client_secret=current_app.config["GOOGLE_CLIENT_SECRET"],
         timeout=current_app.config["HTTP_REQUEST_TIMEOUT"],
     )
+    _issue(response)
     return response.jsonify(current_app)
 
 
@@ -45,7 +81,15 @@ def refresh_token(body: RefreshTokenRequest):
     Refreshes the token associated with the passed refresh_token and responds with a new token
     """
     response = client.refresh_access_token(
+        http_client=current_app.config["HTTP_CLIENT"],
         request=body,
         client_id=current_app.config["GOOGLE_CLIENT_ID"],
         client_secret=current_app.config["GOOGLE_CLIENT_SECRET"], )
+    _issue(response)
     return response.jsonify(current_app)
+
+
+def _issue(response: Union[LoginStatusResponse, RefreshTokenResponse]):
+    """Records when the access token handed out in the given response expires"""
+    token_states: TokenStates = current_app.config["TOKEN_STATES"]
+    token_states.issue(response.access_token, expires_in=response.expires_in)
@@ -1,15 +1,16 @@
 """Module containing client code for authenticating with Google account via the TV flow"""
 import time
-from datetime import datetime, timedelta
 from http import HTTPStatus
+from typing import Optional, Tuple
 
 import requests
 
 from utils.exc import APIException
+from utils.http import HttpClient
 from .dtos import LoginDetails, LoginStatusResponse, RefreshTokenResponse, RefreshTokenRequest
 
 
-def initialize_tv_login(client_id) -> LoginDetails:
+def initialize_tv_login(http_client: HttpClient, client_id) -> LoginDetails:
     """
     Initializes the login with google via the TV device flow.
     It will return a url and a code for a user to login via a phone or desktop
@@ -21,7 +22,7 @@ def initialize_tv_login(client_id) -> LoginDetails:
         "client_id": client_id,
         "scope": "https://www.googleapis.com/auth/youtube.readonly"
     }
-    response = requests.post(url, data=data, headers=headers)
+    response = http_client.post(url, data=data, headers=headers)
     if not response.ok:
         raise APIException(message="unknown internal error", status_code=500, payload=response.json())
 
@@ -29,6 +30,7 @@ def initialize_tv_login(client_id) -> LoginDetails:
 
 
 def check_tv_login_status(
+        http_client: HttpClient,
         device_id: str,
         interval: int,
         client_id: str,
@@ -38,7 +40,42 @@ def check_tv_login_status(
     """
     Checks whether the user has logged in at the given verification url.
     It will poll until it gets something a response other than "error" : "authorization_pending".
-    If it gets "error" : "slow_down", it will double the interval and continue polling
+    If it gets "error" : "slow_down", it will double the interval and continue polling.
+    Polling stops at the timeout, and right away if Google is unavailable,
+    so that the request does not hang on to a worker during an outage
+    """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        response, error = poll_tv_login_status(
+            http_client=http_client,
+            device_id=device_id,
+            client_id=client_id,
+            client_secret=client_secret)
+        if response is not None:
+            return response
+        elif error == 'slow_down':
+            interval *= 2
+
+        remaining = deadline - time.monotonic()
+        if remaining <= interval:
+            break
+
+        time.sleep(interval)
+
+    raise APIException(message="timeout error", status_code=HTTPStatus.REQUEST_TIMEOUT)
+
+
+def poll_tv_login_status(
+        http_client: HttpClient,
+        device_id: str,
+        client_id: str,
+        client_secret: str,
+) -> Tuple[Optional[LoginStatusResponse], Optional[str]]:
+    """
+    Checks once whether the user has logged in at the given verification url.
+    It returns the LoginStatusResponse if the user has logged in, or else the error i.e.
+    "authorization_pending" or "slow_down". Any other error is raised as an APIException
     """
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     url = "https://oauth2.googleapis.com/token"
@@ -48,31 +85,25 @@ def check_tv_login_status(
         "code": device_id,
         "grant_type": "http://oauth.net/grant_type/device/1.0"
     }
-    timeout = timedelta(seconds=timeout)
-    start_time = datetime.now()
-
-    while datetime.now() - start_time < timeout:
-        response = requests.post(url, data=data, headers=headers)
-        if response.ok:
-            return LoginStatusResponse.validate(response.json())
-        else:
-            try:
-                parsed_data = response.json()
-                error = parsed_data.get("error", None)
-                if error == 'slow_down':
-                    interval *= 2
-                elif error == 'authorization_pending':
-                    time.sleep(interval)
-                else:
-                    raise APIException(message="unknown internal error", status_code=500, payload=parsed_data)
-
-            except requests.exceptions.JSONDecodeError as exp:
-                raise APIException(message="unexpected internal error", status_code=500, payload=exp)
 
-    raise APIException(message="timeout error", status_code=HTTPStatus.REQUEST_TIMEOUT)
+    response = http_client.post(url, data=data, headers=headers)
+    if response.ok:
+        return LoginStatusResponse.validate(response.json()), None
+
+    try:
+        parsed_data = response.json()
+    except requests.exceptions.JSONDecodeError as exp:
+        raise APIException(message="unexpected internal error", status_code=500, payload=exp)
+
+    error = parsed_data.get("error", None)
+    if error in ('slow_down', 'authorization_pending'):
+        return None, error
+
+    raise APIException(message="unknown internal error", status_code=500, payload=parsed_data)
 
 
 def refresh_access_token(
+        http_client: HttpClient,
         request: RefreshTokenRequest,
         client_id: str,
         client_secret: str) -> RefreshTokenResponse:
@@ -89,7 +120,7 @@ def refresh_access_token(
         "grant_type": "refresh_token"
     }
 
-    response = requests.post(url, data=data, headers=headers)
+    response = http_client.post(url, data=data, headers=headers)
     if not response.ok:
         raise APIException(message="unknown internal error", status_code=500, payload=response.json())
 
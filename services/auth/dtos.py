@@ -17,6 +17,11 @@ class LoginStatusResponse(BaseDto):
     refresh_token: str
 
 
+class LoginPendingResponse(BaseDto):
+    status: str
+    interval: int
+
+
 class RefreshTokenRequest(BaseDto):
     refresh_token: str
 
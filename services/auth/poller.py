@@ -0,0 +1,408 @@
+"""Module containing the scheduler that polls Google for the status of all pending TV logins"""
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, List, Optional, NamedTuple
+
+from utils.cache_backends import SqliteConnection
+from utils.exc import APIException
+from utils.http import HttpClient
+from . import client
+from .dtos import LoginStatusResponse
+
+
+class TvLogin(NamedTuple):
+    """
+    The state of a TV login whose status is being polled. Once it is done, it has either the JSON of its
+    LoginStatusResponse as result or the status code and message of its error
+    """
+    device_id: str
+    interval: int
+    next_poll_at: float
+    deadline: float
+    result: Optional[bytes] = None
+    error_status: Optional[int] = None
+    error_message: Optional[str] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the login has finished, with either a result or an error"""
+        return self.finished_at is not None
+
+    def get_result(self) -> Optional[LoginStatusResponse]:
+        """Returns the LoginStatusResponse of the login if it succeeded"""
+        return LoginStatusResponse.parse_raw(self.result) if self.result is not None else None
+
+    def get_error(self) -> Optional[APIException]:
+        """Returns the error of the login if it failed"""
+        if self.error_status is None:
+            return None
+
+        return APIException(message=self.error_message, status_code=self.error_status)
+
+
+class TvLoginStore(ABC):
+    """
+    The interface of the stores that hold the TV logins being polled. Each due login is claimed by a single poller
+    for lease seconds, so that pollers sharing the store, say in different uWSGI workers, never poll the same code
+    at the same time
+    """
+
+    @abstractmethod
+    def add(self, login: TvLogin) -> TvLogin:
+        """Saves the login unless there is one of the same device id already, and returns the saved one"""
+
+    @abstractmethod
+    def get(self, device_id: str) -> Optional[TvLogin]:
+        """Returns the login of the given device id if it exists"""
+
+    @abstractmethod
+    def claim_due(self, now: float, lease: float, limit: int) -> List[TvLogin]:
+        """Claims at most limit pending logins that are due by now and not claimed by anyone else, for lease seconds"""
+
+    @abstractmethod
+    def reschedule(self, device_id: str, interval: int, next_poll_at: float):
+        """Sets when the pending login is to be polled next, at the given interval, and releases its claim"""
+
+    @abstractmethod
+    def finish(self, device_id: str, now: float, result: Optional[bytes] = None, error: Optional[APIException] = None):
+        """Marks the login as complete, with either a result or an error"""
+
+    @abstractmethod
+    def next_due_at(self) -> Optional[float]:
+        """Returns the time the next pending login is due at, or None if there are no pending logins"""
+
+    @abstractmethod
+    def sweep(self, finished_before: float):
+        """Removes the logins that finished before the given time"""
+
+
+class _MemoryLogin:
+    """The mutable state of a login in a MemoryTvLoginStore"""
+    __slots__ = ("login", "claimed_until")
+
+    def __init__(self, login: TvLogin):
+        self.login = login
+        self.claimed_until = 0.0
+
+
+class MemoryTvLoginStore(TvLoginStore):
+    """A store in the memory of the current process"""
+
+    def __init__(self):
+        self._logins: Dict[str, _MemoryLogin] = {}
+        self._lock = threading.Lock()
+
+    def add(self, login: TvLogin) -> TvLogin:
+        with self._lock:
+            return self._logins.setdefault(login.device_id, _MemoryLogin(login)).login
+
+    def get(self, device_id: str) -> Optional[TvLogin]:
+        entry = self._logins.get(device_id, None)
+        return entry.login if entry is not None else None
+
+    def claim_due(self, now: float, lease: float, limit: int) -> List[TvLogin]:
+        claimed = []
+        with self._lock:
+            for entry in self._logins.values():
+                if len(claimed) >= limit:
+                    break
+
+                login = entry.login
+                if not login.done and login.next_poll_at <= now and entry.claimed_until <= now:
+                    entry.claimed_until = now + lease
+                    claimed.append(login)
+
+        return claimed
+
+    def reschedule(self, device_id: str, interval: int, next_poll_at: float):
+        with self._lock:
+            entry = self._logins.get(device_id, None)
+            if entry is not None:
+                entry.login = entry.login._replace(interval=interval, next_poll_at=next_poll_at)
+                entry.claimed_until = 0.0
+
+    def finish(self, device_id: str, now: float, result: Optional[bytes] = None, error: Optional[APIException] = None):
+        with self._lock:
+            entry = self._logins.get(device_id, None)
+            if entry is not None:
+                entry.login = entry.login._replace(
+                    result=result,
+                    error_status=int(error.status_code) if error is not None else None,
+                    error_message=error.message if error is not None else None,
+                    finished_at=now)
+                entry.claimed_until = 0.0
+
+    def next_due_at(self) -> Optional[float]:
+        pending = [max(e.login.next_poll_at, e.claimed_until) for e in self._logins.values() if not e.login.done]
+        return min(pending, default=None)
+
+    def sweep(self, finished_before: float):
+        with self._lock:
+            expired = [k for k, v in self._logins.items() if v.login.done and v.login.finished_at <= finished_before]
+            for device_id in expired:
+                del self._logins[device_id]
+
+
+class SqliteTvLoginStore(TvLoginStore):
+    """A store in a table of an SQLite file that is shared by all processes, say uWSGI workers, that point to it"""
+
+    _COLUMNS = "device_id, interval, next_poll_at, deadline, result, error_status, error_message, finished_at"
+
+    def __init__(self, path: str, table: str = "tv_logins"):
+        self._table = table
+        self._db = SqliteConnection(path, schema=(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "device_id TEXT PRIMARY KEY, interval INTEGER NOT NULL, next_poll_at REAL NOT NULL, "
+            "deadline REAL NOT NULL, result BLOB, error_status INTEGER, error_message TEXT, finished_at REAL, "
+            "claimed_until REAL NOT NULL DEFAULT 0)",
+            f"CREATE INDEX IF NOT EXISTS {table}_next_poll_at ON {table} (next_poll_at)",
+        ))
+        # the connection is shared by the request greenlets and the polling threads of the process
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection to the SQLite file of this process"""
+        return self._db.get()
+
+    def add(self, login: TvLogin) -> TvLogin:
+        with self._lock:
+            self.conn.execute(
+                f"INSERT OR IGNORE INTO {self._table} ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", login)
+            return self._get(login.device_id)
+
+    def get(self, device_id: str) -> Optional[TvLogin]:
+        with self._lock:
+            return self._get(device_id)
+
+    def claim_due(self, now: float, lease: float, limit: int) -> List[TvLogin]:
+        with self._lock:
+            conn = self.conn
+            # the write lock of the file is taken up front so that no other process claims the same logins
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT {self._COLUMNS} FROM {self._table} "
+                    "WHERE finished_at IS NULL AND next_poll_at <= ? AND claimed_until <= ? LIMIT ?",
+                    (now, now, limit)).fetchall()
+                conn.executemany(
+                    f"UPDATE {self._table} SET claimed_until = ? WHERE device_id = ?",
+                    [(now + lease, row[0]) for row in rows])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        return [TvLogin(*row) for row in rows]
+
+    def reschedule(self, device_id: str, interval: int, next_poll_at: float):
+        with self._lock:
+            self.conn.execute(
+                f"UPDATE {self._table} SET interval = ?, next_poll_at = ?, claimed_until = 0 WHERE device_id = ?",
+                (interval, next_poll_at, device_id))
+
+    def finish(self, device_id: str, now: float, result: Optional[bytes] = None, error: Optional[APIException] = None):
+        with self._lock:
+            self.conn.execute(
+                f"UPDATE {self._table} SET result = ?, error_status = ?, error_message = ?, finished_at = ?, "
+                "claimed_until = 0 WHERE device_id = ?",
+                (result,
+                 int(error.status_code) if error is not None else None,
+                 error.message if error is not None else None,
+                 now,
+                 device_id))
+
+    def next_due_at(self) -> Optional[float]:
+        with self._lock:
+            return self.conn.execute(
+                f"SELECT MIN(MAX(next_poll_at, claimed_until)) FROM {self._table} WHERE finished_at IS NULL"
+            ).fetchone()[0]
+
+    def sweep(self, finished_before: float):
+        with self._lock:
+            self.conn.execute(f"DELETE FROM {self._table} WHERE finished_at <= ?", (finished_before,))
+
+    def _get(self, device_id: str) -> Optional[TvLogin]:
+        row = self.conn.execute(
+            f"SELECT {self._COLUMNS} FROM {self._table} WHERE device_id = ?", (device_id,)).fetchone()
+        return TvLogin(*row) if row is not None else None
+
+
+def create_tv_login_store(name: str, path: str, table: str = "tv_logins") -> TvLoginStore:
+    """Creates the TV login store of the given name i.e. 'memory' or 'sqlite', just like the cache backends"""
+    if name == "memory":
+        return MemoryTvLoginStore()
+
+    if name == "sqlite":
+        return SqliteTvLoginStore(path=path, table=table)
+
+    raise ValueError(f"unknown TV login store '{name}'")
+
+
+class TvLoginPoller:
+    """
+    Polls Google's token endpoint for all pending TV logins from a background loop,
+    instead of each login holding a request open while it sleeps between polls.
+    The logins are kept in a store that, if shared by all uWSGI workers, makes up one schedule for all of them:
+    each due login is claimed by a single worker's loop, and its result can be picked up from any worker.
+    Each login is polled at its own interval, of at least min_interval seconds, which is doubled whenever Google
+    responds with "slow_down".
+    Due logins are polled concurrently by at most `concurrency` threads per worker.
+    Finished logins are kept for `result_ttl` seconds for their clients to pick them up.
+    Loops check the store for due logins at least once every `idle_interval` seconds, and clients waiting for
+    a login finished by another worker see it within `wait_interval` seconds
+    """
+
+    def __init__(
+            self,
+            http_client: HttpClient,
+            client_id: str,
+            client_secret: str,
+            timeout: int,
+            store: Optional[TvLoginStore] = None,
+            concurrency: int = 20,
+            min_interval: int = 5,
+            result_ttl: int = 60,
+            lease: float = 60,
+            idle_interval: float = 1,
+            wait_interval: float = 0.5,
+            run_in_background: bool = True):
+        self._http_client = http_client
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._timeout = timeout
+        self._store = store if store is not None else MemoryTvLoginStore()
+        self._min_interval = max(min_interval, 1)
+        self._result_ttl = result_ttl
+        self._lease = lease
+        self._idle_interval = idle_interval
+        self._wait_interval = wait_interval
+        self._run_in_background = run_in_background
+        self._concurrency = concurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # notified whenever this process finishes a login, so that its waiting clients need not wait for the next check
+        self._finished = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def get(self, device_id: str, interval: int) -> TvLogin:
+        """Returns the login of the given device id, scheduling it to be polled at the given interval if it is new"""
+        # the interval comes from the client, so it is clamped to keep Google from being flooded with polls
+        interval = max(interval, self._min_interval)
+        now = time.time()
+        new_login = TvLogin(device_id=device_id, interval=interval, next_poll_at=now + interval,
+                            deadline=now + self._timeout)
+        login = self._store.add(new_login)
+        if login is new_login or login == new_login:
+            self._wakeup.set()
+
+        if self._run_in_background:
+            self._start()
+
+        return login
+
+    def wait(self, device_id: str, interval: int, timeout: float) -> TvLogin:
+        """Returns the login of the given device id after waiting at most timeout seconds for it to finish"""
+        login = self.get(device_id=device_id, interval=interval)
+        deadline = time.monotonic() + timeout
+        while not login.done:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            with self._finished:
+                self._finished.wait(min(remaining, self._wait_interval))
+            login = self._store.get(device_id) or login
+
+        return login
+
+    def poll_due(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Polls all logins that are due and not claimed by another poller, and returns the number of seconds
+        until the next login is due or None if there are no pending logins
+        """
+        if now is None:
+            now = time.time()
+
+        self._store.sweep(finished_before=now - self._result_ttl)
+        due = self._store.claim_due(now, lease=self._lease, limit=self._concurrency)
+        if due:
+            list(self._get_executor().map(self._poll, due))
+
+        next_due_at = self._store.next_due_at()
+        if next_due_at is None:
+            return None
+
+        return max(next_due_at - time.time(), 0)
+
+    def run(self):
+        """
+        Polls the due logins forever, sleeping until the next login is due, a new login comes in
+        or idle_interval seconds have passed, so that logins added by other workers are not missed
+        """
+        while True:
+            delay = self.poll_due()
+            self._wakeup.wait(self._idle_interval if delay is None else min(delay, self._idle_interval))
+            self._wakeup.clear()
+
+    def _poll(self, login: TvLogin):
+        """Polls Google once for the status of the given login and updates the login in the store"""
+        now = time.time()
+        if now >= login.deadline:
+            self._finish(login, error=APIException(message="timeout error", status_code=HTTPStatus.REQUEST_TIMEOUT))
+            return
+
+        try:
+            response, error = client.poll_tv_login_status(
+                http_client=self._http_client,
+                device_id=login.device_id,
+                client_id=self._client_id,
+                client_secret=self._client_secret)
+        except APIException as exp:
+            self._finish(login, error=exp)
+            return
+        except Exception as exp:
+            self._finish(login, error=APIException(message="unexpected internal error", status_code=500, payload=exp))
+            return
+
+        if response is not None:
+            self._finish(login, result=response.bjson())
+            return
+
+        interval = max(login.interval, self._min_interval)
+        if error == 'slow_down':
+            interval *= 2
+        self._store.reschedule(login.device_id, interval=interval, next_poll_at=now + interval)
+
+    def _finish(self, login: TvLogin, result: Optional[bytes] = None, error: Optional[APIException] = None):
+        """Saves the outcome of the login and wakes up the clients of this process waiting for it"""
+        self._store.finish(login.device_id, now=time.time(), result=result, error=error)
+        with self._finished:
+            self._finished.notify_all()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Returns the pool of workers that poll Google, creating it in the current process if it does not exist"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="tv-login-poller")
+
+        return self._executor
+
+    def _start(self):
+        """Starts the background polling loop if it is not yet running in this process"""
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid != pid or self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, name="tv-login-poller", daemon=True)
+                self._thread.start()
+                self._pid = pid
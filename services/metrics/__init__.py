@@ -0,0 +1,52 @@
+"""Module containing the endpoint that exposes the metrics of the app to Prometheus"""
+from typing import List
+
+from flask import Blueprint, current_app, Flask
+
+from utils.logging import BoundedQueueHandler
+from utils.metrics import MetricsRegistry, stats_family
+
+bp = Blueprint("metrics", __name__)
+
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@bp.get("/metrics")
+def get_metrics():
+    """
+    Responds with the metrics of the worker that handles the request in the Prometheus text format.
+    Each uwsgi worker has its own metrics
+    """
+    registry: MetricsRegistry = current_app.config["METRICS"]
+    return current_app.response_class(registry.render(), content_type=_CONTENT_TYPE)
+
+
+def collect_stats(app: Flask, namespace: str = "youhedge") -> List:
+    """
+    Returns the stats of the caches, the token states, the single flight, the quota, the HTTP connection pools,
+    the circuit breakers and the error log queue as metric families
+    """
+    families = []
+    families.extend(stats_family(f"{namespace}_cache", "Response cache", app.config["CACHE"].stats()))
+    families.extend(stats_family(f"{namespace}_entity_cache", "Entity cache", app.config["ENTITY_CACHE"].stats()))
+    families.extend(stats_family(f"{namespace}_token_cache", "Token states", app.config["TOKEN_STATES"].stats()))
+    families.extend(stats_family(
+        f"{namespace}_compression_cache", "Compressed responses", app.config["COMPRESSION_CACHE"].stats()))
+    families.extend(stats_family(f"{namespace}_single_flight", "Single flight", app.config["SINGLE_FLIGHT"].stats()))
+    families.extend(stats_family(f"{namespace}_quota", "YouTube quota", app.config["QUOTA"].stats()))
+
+    pools = app.config["HTTP_CLIENT"].stats()
+    for key in ("connections_opened", "requests", "idle_connections"):
+        samples = [(dict(host=pool["host"]), pool[key]) for pool in pools]
+        families.append((f"{namespace}_http_pool_{key}", f"HTTP connection pool: {key}", samples))
+
+    breakers = app.config["HTTP_CLIENT"].circuit_breakers
+    if breakers is not None:
+        samples = [(dict(endpoint=endpoint), is_open) for endpoint, is_open in breakers.stats().items()]
+        families.append((f"{namespace}_circuit_breaker_open", "Whether the circuit of the endpoint is open", samples))
+
+    for handler in app.config["ERROR_LOGGER"].handlers:
+        if isinstance(handler, BoundedQueueHandler):
+            families.extend(stats_family(f"{namespace}_log_queue", "Error log queue", handler.stats()))
+
+    return families
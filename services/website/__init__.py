@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template
 
-from .utils import render_markdown
+from .utils import render_markdown, send_page
 
 bp = Blueprint("website", __name__)
 
@@ -14,10 +14,10 @@ def home():
 @bp.get("/privacy-policy")
 def privacy_policy():
     """Returns the privacy policy"""
-    return render_markdown("PRIVACY_POLICY.md")
+    return send_page(render_markdown("PRIVACY_POLICY.md"))
 
 
 @bp.get("/terms-of-service")
 def terms_of_service():
     """Returns the terms of service"""
-    return render_markdown("TERMS_OF_SERVICE.md")
+    return send_page(render_markdown("TERMS_OF_SERVICE.md"))
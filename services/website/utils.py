@@ -1,14 +1,67 @@
 """Module containing utility functions for the website service"""
 import os.path
+import threading
+from typing import Dict, NamedTuple
 
 import markdown
+from flask import current_app, request, Response
+
+from utils.compression import precompress, negotiate, strong_etag, IDENTITY, ENCODINGS
 
 _MARKDOWN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "markdown")
 
 
-def render_markdown(filename: str) -> str:
-    """Reads the content in the markdown file and returns its html format"""
+class RenderedPage(NamedTuple):
+    """The HTML of a page in each content encoding, as rendered from a file last modified at mtime"""
+    mtime: int
+    etag: str
+    variants: Dict[str, bytes]
+
+
+_pages: Dict[str, RenderedPage] = {}
+_lock = threading.Lock()
+
+
+def render_markdown(filename: str) -> RenderedPage:
+    """
+    Returns the html format of the content in the markdown file, with its compressed variants.
+    It is rendered once and kept in memory until the file is modified
+    """
     file_path = os.path.join(_MARKDOWN_FOLDER, filename)
+    mtime = os.stat(file_path).st_mtime_ns
+    page = _pages.get(file_path, None)
+    if page is not None and page.mtime == mtime:
+        return page
+
+    with _lock:
+        page = _pages.get(file_path, None)
+        if page is None or page.mtime != mtime:
+            with open(file_path, "r") as file:
+                html = markdown.markdown(file.read()).encode()
+
+            page = RenderedPage(mtime=mtime, etag=strong_etag(html), variants=precompress(html))
+            _pages[file_path] = page
+
+    return page
+
+
+def send_page(page: RenderedPage) -> Response:
+    """
+    Responds with the variant of the page in the best content encoding the client accepts,
+    or with a 304 if the client already has it, to be cached for WEBSITE_CACHE_MAX_AGE_IN_SECONDS
+    """
+    encoding = negotiate(request.accept_encodings, [e for e in ENCODINGS if e in page.variants])
+    etag = page.etag if encoding == IDENTITY else f"{page.etag}-{encoding}"
+
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(page.variants[encoding], content_type="text/html; charset=utf-8")
+        if encoding != IDENTITY:
+            response.headers["Content-Encoding"] = encoding
 
-    with open(file_path, "r") as file:
-        return markdown.markdown(file.read())
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get("WEBSITE_CACHE_MAX_AGE_IN_SECONDS", 86400)
+    return response
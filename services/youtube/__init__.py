@@ -1,52 +1,100 @@
 """Module containing functionality for getting Youtube data"""
 from flask import Blueprint, request, current_app
 
-from utils.view_utils import auth_token_required, cached
+from utils.exc import APIException
+from utils.view_utils import auth_token_required, cached, stream_ndjson
 from . import client
 
 bp = Blueprint("youtube", __name__, url_prefix="/youtube")
 
 
 @bp.get("/subscriptions")
-@cached
+@cached(query_args=["pageToken"])
 @auth_token_required
 def get_subscriptions(access_token: str):
     """Returns the subscriptions belonging to the logged-in user"""
     page_token = request.args.get("pageToken", None)
     response = client.get_subscriptions(
+        http_client=current_app.config["HTTP_CLIENT"],
         access_token=access_token,
         api_key=current_app.config["GOOGLE_API_KEY"],
         page_token=page_token,
+        quota=current_app.config["QUOTA"],
     )
     return response.jsonify(current_app)
 
 
+@bp.get("/channels")
+@auth_token_required
+def get_channels_details(access_token: str):
+    """
+    Responds with the details for the channels whose ids are passed as a comma-separated list
+    in the 'ids' query parameter, of at most YOUTUBE_MAX_CHANNEL_IDS ids
+    """
+    ids = request.args.get("ids", "")
+    channel_ids = [channel_id for channel_id in ids.split(",") if channel_id]
+    if not channel_ids:
+        raise APIException(message="Missing 'ids' query parameter", status_code=400)
+
+    max_channel_ids = current_app.config.get("YOUTUBE_MAX_CHANNEL_IDS", 200)
+    if len(channel_ids) > max_channel_ids:
+        raise APIException(message=f"At most {max_channel_ids} ids can be passed in 'ids'", status_code=400)
+
+    response = client.get_channels_details(
+        http_client=current_app.config["HTTP_CLIENT"],
+        channel_ids=channel_ids,
+        api_key=current_app.config["GOOGLE_API_KEY"],
+        access_token=access_token,
+        cache=current_app.config["ENTITY_CACHE"],
+        quota=current_app.config["QUOTA"])
+    return response.jsonify(current_app)
+
+
 @bp.get("/channels/<string:channel_id>")
-@cached
+@cached(query_args=["pageToken"])
 @auth_token_required
 def get_channel_details(channel_id: str, access_token: str):
     """Responds with the details for the given channel"""
     page_token = request.args.get("pageToken", None)
     response = client.get_channel_details(
+        http_client=current_app.config["HTTP_CLIENT"],
         channel_id=channel_id,
         api_key=current_app.config["GOOGLE_API_KEY"],
         access_token=access_token,
-        page_token=page_token)
+        page_token=page_token,
+        cache=current_app.config["ENTITY_CACHE"],
+        quota=current_app.config["QUOTA"])
     return response.jsonify(current_app)
 
 
 @bp.get("/playlist-items/<string:playlist_id>")
-@cached
+@cached(query_args=["pageToken"], unless=lambda req: "stream" in req.args)
 @auth_token_required
 def get_playlist_videos(playlist_id: str, access_token: str):
     """
     Gets the list of videos for the given playlist in a paginated fashion
-    A channel has at least one playlist
+    A channel has at least one playlist.
+    If the 'stream' query parameter is passed, all items, or at most 'maxItems' items, from 'pageToken' onwards
+    are streamed as newline-delimited JSON as the pages come in from YouTube
     """
     page_token = request.args.get("pageToken", None)
+    if "stream" in request.args:
+        items = client.iter_playlist_items(
+            http_client=current_app.config["HTTP_CLIENT"],
+            playlist_id=playlist_id,
+            api_key=current_app.config["GOOGLE_API_KEY"],
+            access_token=access_token,
+            page_token=page_token,
+            max_items=request.args.get("maxItems", None, int),
+            quota=current_app.config["QUOTA"])
+        return stream_ndjson(items)
+
     response = client.get_playlist_items(
+        http_client=current_app.config["HTTP_CLIENT"],
         playlist_id=playlist_id,
         api_key=current_app.config["GOOGLE_API_KEY"],
         access_token=access_token,
-        page_token=page_token)
+        page_token=page_token,
+        cache=current_app.config["ENTITY_CACHE"],
+        quota=current_app.config["QUOTA"])
     return response.jsonify(current_app)
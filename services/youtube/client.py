@@ -1,61 +1,329 @@
 """Module containing the client code for YouTube data v3 API"""
-from typing import Optional
+import math
+from http import HTTPStatus
+from typing import Any, Optional, Iterator, List, Dict, Tuple
+from urllib.parse import quote
 
+import orjson
 import requests
 
-from utils.exc import APIException
-from .dtos import SubscriptionListResponse, PlaylistItemListResponse, ChannelDetails, ChannelDetailsResponse
+from utils.base_dto import RawJson
+from utils.cache import EntityCache, CachedEntity
+from utils.exc import APIException, UpstreamUnavailable
+from utils.http import HttpClient, load_json
+from utils.instrumentation import phase, SERIALIZATION
+from utils.projection import project
+from utils.quota import QuotaAccountant, REFUSE_COSTLY
+from .dtos import SubscriptionListResponse, PlaylistItemListResponse, ChannelDetailsResponse
+
+# the maximum number of ids that can be passed in a single request to the channels endpoint
+MAX_CHANNEL_IDS_PER_REQUEST = 50
+# the prefix of the ids of the playlists of the uploads of channels, the only playlists known to be public
+UPLOADS_PLAYLIST_PREFIX = "UU"
+# the number of items requested in each page of streamed playlist items, the most YouTube allows
+PLAYLIST_ITEMS_PER_PAGE = 50
+# the types of resources kept in the entity cache, each with its own TTL in ENTITY_CACHE_TTL_IN_SECONDS
+CHANNEL = "channel"
+PLAYLIST_ITEMS = "playlist_items"
+# the units of the daily quota of YouTube data v3 spent by a request to each endpoint, whatever the number of parts
+# or items. See https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    "subscriptions": 1,
+    "channels": 1,
+    "playlistItems": 1,
+}
 
 
 def get_subscriptions(
+        http_client: HttpClient,
         api_key: str,
         access_token: str,
-        page_token: Optional[str] = None) -> SubscriptionListResponse:
-    """Gets the list of subscriptions for the given user"""
+        page_token: Optional[str] = None,
+        quota: Optional[QuotaAccountant] = None) -> RawJson:
+    """
+    Gets the list of subscriptions for the given user.
+    If the quota is given, the request is refused if it cannot be afforded
+    """
+    if quota is not None:
+        quota.admit(QUOTA_COSTS["subscriptions"])
+
     headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
     url = f"https://youtube.googleapis.com/youtube/v3/subscriptions?part=snippet&mine=true&key={api_key}"
     if page_token is not None:
-        url = f"{url}&pageToken={page_token}"
+        url = f"{url}&pageToken={quote(page_token, safe='')}"
 
-    response = requests.get(url, headers=headers)
+    response = http_client.get(url, headers=headers, quota_cost=QUOTA_COSTS["subscriptions"])
     if not response.ok:
-        raise APIException(message=f"unknown internal error", status_code=500, payload=response.json())
+        _raise_error(response)
 
-    return SubscriptionListResponse.validate(response.json())
+    return RawJson(_dumps(project(SubscriptionListResponse, load_json(response))))
 
 
 def get_channel_details(
+        http_client: HttpClient,
         channel_id: str,
         api_key: str,
         access_token: str,
-        page_token: Optional[str] = None) -> ChannelDetails:
-    """Gets the details of the channel of the given channel id"""
+        page_token: Optional[str] = None,
+        cache: Optional[EntityCache] = None,
+        quota: Optional[QuotaAccountant] = None) -> RawJson:
+    """
+    Gets the details of the channel of the given channel id.
+    If the cache is given, it is checked first and updated on a miss.
+    Stale channels in the cache are revalidated with their ETag, unless the quota is running low or YouTube
+    is unavailable, in which case they are served as they are.
+    Requests that cannot be afforded are refused
+    """
+    use_cache = cache is not None and page_token is None
+    entity: Optional[CachedEntity] = None
+    if use_cache:
+        entity, is_stale = cache.lookup(CHANNEL, channel_id)
+        if entity is not None and (not is_stale or (quota is not None and quota.should_serve_stale())):
+            return RawJson(entity.body)
+
+    if quota is not None:
+        quota.admit(QUOTA_COSTS["channels"])
+
     headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
-    url = f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails&id={channel_id}&key={api_key}"
+    # ids and page tokens come from the client so they are quoted like those of batches
+    url = (f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails"
+           f"&id={quote(channel_id, safe='')}&key={api_key}")
     if page_token is not None:
-        url = f"{url}&pageToken={page_token}"
+        url = f"{url}&pageToken={quote(page_token, safe='')}"
+    if entity is not None and entity.etag is not None:
+        headers["If-None-Match"] = entity.etag
+
+    try:
+        response = http_client.get(url, headers=headers, quota_cost=QUOTA_COSTS["channels"])
+    except UpstreamUnavailable:
+        if entity is None:
+            raise
+
+        return RawJson(entity.body)
+
+    if entity is not None and response.status_code == HTTPStatus.NOT_MODIFIED:
+        cache.set(CHANNEL, channel_id, value=entity)
+        return RawJson(entity.body)
 
-    response = requests.get(url, headers=headers)
     if not response.ok:
-        raise APIException(message="unknown internal error", status_code=500, payload=response.json())
+        _raise_error(response)
+
+    raw_response = load_json(response)
+    data = _dumps(project(ChannelDetailsResponse, raw_response)["items"][0])
+    if use_cache:
+        # the ETag is only kept for revalidation, so it is left out of the response
+        cache.set(CHANNEL, channel_id, value=CachedEntity(etag=raw_response.get("etag"), body=data))
+
+    return RawJson(data)
+
+
+def get_channels_details(
+        http_client: HttpClient,
+        channel_ids: List[str],
+        api_key: str,
+        access_token: str,
+        cache: EntityCache,
+        quota: Optional[QuotaAccountant] = None) -> RawJson:
+    """
+    Gets the details of the channels of the given channel ids as a list of items, in the order of the ids.
+    Channels found in the cache are not requested again, nor are stale ones if the quota is running low.
+    The rest are requested in batches of at most MAX_CHANNEL_IDS_PER_REQUEST ids and saved in the cache one by one,
+    if the quota can afford all the batches.
+    Channels that do not exist are left out
+    """
+    serve_stale = quota is not None and quota.should_serve_stale()
+    channel_ids = list(dict.fromkeys(channel_ids))
+    found: Dict[str, Optional[bytes]] = {}
+    for channel_id in channel_ids:
+        entity: Optional[CachedEntity]
+        entity, is_stale = cache.lookup(CHANNEL, channel_id)
+        found[channel_id] = entity.body if entity is not None and (not is_stale or serve_stale) else None
+
+    missing_ids = [channel_id for channel_id, data in found.items() if data is None]
+    if quota is not None and missing_ids:
+        quota.admit(math.ceil(len(missing_ids) / MAX_CHANNEL_IDS_PER_REQUEST) * QUOTA_COSTS["channels"])
+
+    headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
+    for start in range(0, len(missing_ids), MAX_CHANNEL_IDS_PER_REQUEST):
+        # ids come from the client so they are quoted to keep them from adding parameters, say '&key=...'
+        batch = missing_ids[start:start + MAX_CHANNEL_IDS_PER_REQUEST]
+        ids = "%2C".join(quote(channel_id, safe="") for channel_id in batch)
+        url = (f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails"
+               f"&id={ids}&maxResults={MAX_CHANNEL_IDS_PER_REQUEST}&key={api_key}")
+
+        response = http_client.get(url, headers=headers, quota_cost=QUOTA_COSTS["channels"])
+        if not response.ok:
+            _raise_error(response)
+
+        for item in project(ChannelDetailsResponse, load_json(response))["items"]:
+            data = _dumps(item)
+            # the ETag of a batch is of no use for revalidating a single channel
+            cache.set(CHANNEL, item["id"], value=CachedEntity(etag=None, body=data))
+            found[item["id"]] = data
 
-    parsed_response = ChannelDetailsResponse.validate(response.json())
-    return parsed_response.items[0]
+    items = b",".join(found[channel_id] for channel_id in channel_ids if found.get(channel_id) is not None)
+    return RawJson(b'{"items":[' + items + b']}')
 
 
 def get_playlist_items(
+        http_client: HttpClient,
+        playlist_id: str,
+        api_key: str,
+        access_token: str,
+        page_token: Optional[str] = None,
+        cache: Optional[EntityCache] = None,
+        quota: Optional[QuotaAccountant] = None) -> RawJson:
+    """
+    Gets the items in the playlist of the given playlist id.
+    If the cache is given and the playlist is public, that is the uploads of a channel, the cache is checked first
+    and updated on a miss. Other playlists, say likes ('LL') and watch later ('WL'), have the same ids for all users
+    so they are never put in the cache shared by all users.
+    Stale pages in the cache are revalidated with their ETag, unless the quota is running low or YouTube
+    is unavailable, in which case they are served as they are.
+    Requests that cannot be afforded are refused
+    """
+    if not is_public_playlist(playlist_id):
+        cache = None
+
+    entity: Optional[CachedEntity] = None
+    if cache is not None:
+        entity, is_stale = cache.lookup(PLAYLIST_ITEMS, playlist_id, page_token or "")
+        if entity is not None and (not is_stale or (quota is not None and quota.should_serve_stale())):
+            return RawJson(entity.body)
+
+    if quota is not None:
+        quota.admit(QUOTA_COSTS["playlistItems"])
+
+    etag = entity.etag if entity is not None else None
+    try:
+        fetched = _fetch_playlist_items(
+            http_client=http_client,
+            playlist_id=playlist_id,
+            api_key=api_key,
+            access_token=access_token,
+            page_token=page_token,
+            etag=etag)
+    except UpstreamUnavailable:
+        if entity is None:
+            raise
+
+        return RawJson(entity.body)
+
+    if fetched is None:
+        cache.set(PLAYLIST_ITEMS, playlist_id, page_token or "", value=entity)
+        return RawJson(entity.body)
+
+    playlist_items, etag = fetched
+    data = _dumps(playlist_items)
+    if cache is not None:
+        entity = CachedEntity(etag=etag, body=data)
+        cache.set(PLAYLIST_ITEMS, playlist_id, page_token or "", value=entity)
+
+    return RawJson(data)
+
+
+def is_public_playlist(playlist_id: str) -> bool:
+    """Returns whether the playlist is the same for all users, which is only known of the uploads of channels"""
+    return playlist_id.startswith(UPLOADS_PLAYLIST_PREFIX)
+
+
+def iter_playlist_items(
+        http_client: HttpClient,
+        playlist_id: str,
+        api_key: str,
+        access_token: str,
+        page_token: Optional[str] = None,
+        max_items: Optional[int] = None,
+        quota: Optional[QuotaAccountant] = None) -> Iterator[RawJson]:
+    """
+    Lazily yields the items in the playlist of the given playlist id, following the nextPageToken
+    of each page until there are no more pages or max_items items have been yielded.
+    Pages of PLAYLIST_ITEMS_PER_PAGE items are requested so that as few requests as possible are made.
+    Only one page is held in memory at a time.
+    If the quota is given, a stream of at most max_items items is refused up front if the pages it may need
+    cannot be afforded. A stream with no max_items is only refused up front once the quota is so low
+    that costly requests are refused; otherwise each of its pages is admitted as it is fetched
+    """
+    admit_each_page = False
+    if quota is not None:
+        if max_items is not None:
+            quota.admit(math.ceil(max_items / PLAYLIST_ITEMS_PER_PAGE) * QUOTA_COSTS["playlistItems"])
+        elif quota.level() >= REFUSE_COSTLY:
+            quota.admit(math.inf)
+        else:
+            admit_each_page = True
+
+    count = 0
+    while max_items is None or count < max_items:
+        if admit_each_page:
+            quota.admit(QUOTA_COSTS["playlistItems"])
+
+        page, _etag = _fetch_playlist_items(
+            http_client=http_client,
+            playlist_id=playlist_id,
+            api_key=api_key,
+            access_token=access_token,
+            page_token=page_token,
+            max_results=PLAYLIST_ITEMS_PER_PAGE)
+
+        for item in page["items"]:
+            if max_items is not None and count >= max_items:
+                return
+
+            yield RawJson(_dumps(item))
+            count += 1
+
+        page_token = page.get("nextPageToken")
+        if page_token is None:
+            return
+
+
+def _fetch_playlist_items(
+        http_client: HttpClient,
         playlist_id: str,
         api_key: str,
         access_token: str,
-        page_token: Optional[str] = None) -> PlaylistItemListResponse:
-    """Gets the items in the playlist of the given playlist id"""
+        page_token: Optional[str] = None,
+        etag: Optional[str] = None,
+        max_results: Optional[int] = None) -> Optional[Tuple[Dict[str, Any], Optional[str]]]:
+    """
+    Requests a page of the items in the playlist of the given playlist id, of max_results items if given
+    or else of YouTube's default of 5, and returns its projection onto PlaylistItemListResponse with its ETag.
+    If the etag is given and the page has not changed since, None is returned
+    """
     headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
-    url = f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&playlistId={playlist_id}&key={api_key}"
+    url = (f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet"
+           f"&playlistId={quote(playlist_id, safe='')}&key={api_key}")
+    if max_results is not None:
+        url = f"{url}&maxResults={max_results}"
     if page_token is not None:
-        url = f"{url}&pageToken={page_token}"
+        url = f"{url}&pageToken={quote(page_token, safe='')}"
+    if etag is not None:
+        headers["If-None-Match"] = etag
+
+    response = http_client.get(url, headers=headers, quota_cost=QUOTA_COSTS["playlistItems"])
+    if etag is not None and response.status_code == HTTPStatus.NOT_MODIFIED:
+        return None
 
-    response = requests.get(url, headers=headers)
     if not response.ok:
-        raise APIException(message="unknown internal error", status_code=500, payload=response.json())
+        _raise_error(response)
+
+    raw_response = load_json(response)
+    return project(PlaylistItemListResponse, raw_response), raw_response.get("etag")
+
+
+def _dumps(value: Any) -> bytes:
+    """Serializes the given projection to JSON, timed as the serialization phase of the current request"""
+    with phase(SERIALIZATION):
+        return orjson.dumps(value)
+
+
+def _raise_error(response: requests.Response):
+    """
+    Raises the APIException of the given failed response. Access tokens rejected by Google
+    are reported as such so that clients know to refresh them
+    """
+    if response.status_code == HTTPStatus.UNAUTHORIZED:
+        raise APIException(message="invalid or expired token", status_code=401, payload=load_json(response))
 
-    return PlaylistItemListResponse.validate(response.json())
+    raise APIException(message="unknown internal error", status_code=500, payload=load_json(response))
@@ -1,11 +1,16 @@
 """Tests for the auth service"""
+import os
+import tempfile
+import time
 from unittest import TestCase, main
 from unittest.mock import patch, MagicMock, call
 
 from services import create_app
+from services.auth.poller import TvLoginPoller, SqliteTvLoginStore
 from utils.testing import MockResponse
 
 _app = create_app(config_filename="test.config.json", should_log_err_to_file=False)
+_TIMEOUT = (_app.config["HTTP_CONNECT_TIMEOUT_IN_SECONDS"], _app.config["HTTP_READ_TIMEOUT_IN_SECONDS"])
 
 
 class TestAuth(TestCase):
@@ -15,7 +20,7 @@ class TestAuth(TestCase):
         """Create a few common variables"""
         self.client = _app.test_client()
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_tv_login(self, mock_post: MagicMock):
         """Should return the LoginDetails after making a call to the Google authentication endpoint"""
         mock_login_details = {
@@ -34,11 +39,11 @@ class TestAuth(TestCase):
         mock_post.return_value = MockResponse(data=mock_login_details, status_code=200)
 
         response = self.client.post("/auth/tv", json={})
-        mock_post.assert_called_with(expected_url, headers=expected_headers, data=expected_data)
+        mock_post.assert_called_with(expected_url, headers=expected_headers, data=expected_data, timeout=_TIMEOUT)
         self.assertEqual(200, response.status_code)
         self.assertEqual(mock_login_details, response.json)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_check_tv_login_status(self, mock_post: MagicMock):
         """Should return the LoginStatusResponse after polling Google token endpoint"""
         device_code = "random stuff"
@@ -76,13 +81,127 @@ class TestAuth(TestCase):
         mock_post.side_effect = mock_login_status_check
 
         response = self.client.get(f"/auth/tv/{device_code}", query_string={"interval": interval})
-        calls = [call(expected_url, headers=expected_headers, data=expected_data) for _ in expected_responses]
+        calls = [
+            call(expected_url, headers=expected_headers, data=expected_data, timeout=_TIMEOUT)
+            for _ in expected_responses
+        ]
 
         mock_post.assert_has_calls(calls=calls)
         self.assertEqual(200, response.status_code)
         self.assertEqual(mock_login_status, response.json)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
+    def test_check_tv_login_status_async(self, mock_post: MagicMock):
+        """Should respond right away with the pending status while the shared poller polls Google in the background"""
+        device_code = "some other random stuff"
+        interval = 2
+        mock_login_status = {
+            "access_token": "ya29.AHES6ZSuY8f6WFLswSv0HZLP2J4cCvFSj-8GiZM0Pr6cgXU",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "refresh_token": "1/551G1yXUqgkDGnkfFk6ZbjMMMDIMxo3JFc8lY8CAR-Q",
+        }
+        mock_post.side_effect = [
+            MockResponse(data={"error": "authorization_pending"}, status_code=428),
+            MockResponse(data=mock_login_status, status_code=200),
+        ]
+        poller = TvLoginPoller(
+            http_client=_app.config["HTTP_CLIENT"],
+            client_id=_app.config["GOOGLE_CLIENT_ID"],
+            client_secret=_app.config["GOOGLE_CLIENT_SECRET"],
+            timeout=_app.config["HTTP_REQUEST_TIMEOUT"],
+            min_interval=_app.config["TV_LOGIN_MIN_POLL_INTERVAL_IN_SECONDS"],
+            run_in_background=False)
+        query_string = {"interval": interval, "async": ""}
+
+        with patch.dict(_app.config, {"TV_LOGIN_POLLER": poller}):
+            first_response = self.client.get(f"/auth/tv/{device_code}", query_string=query_string)
+            # nothing is due before the interval elapses
+            poller.poll_due()
+            poller.poll_due(now=time.time() + interval)
+            second_response = self.client.get(f"/auth/tv/{device_code}", query_string=query_string)
+            poller.poll_due(now=time.time() + 2 * interval)
+            third_response = self.client.get(f"/auth/tv/{device_code}", query_string=query_string)
+
+        self.assertEqual(2, mock_post.call_count)
+        self.assertEqual(202, first_response.status_code)
+        self.assertEqual({"status": "authorization_pending", "interval": interval}, first_response.json)
+        self.assertEqual(202, second_response.status_code)
+        self.assertEqual(200, third_response.status_code)
+        self.assertEqual(mock_login_status, third_response.json)
+
+    @patch("requests.Session.post")
+    def test_check_tv_login_status_async_across_workers(self, mock_post: MagicMock):
+        """Should poll each login from a single worker and serve its result from any worker sharing the store"""
+        device_code = "yet another random stuff"
+        interval = 2
+        mock_login_status = {
+            "access_token": "ya29.AHES6ZSuY8f6WFLswSv0HZLP2J4cCvFSj-8GiZM0Pr6cgXU",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "refresh_token": "1/551G1yXUqgkDGnkfFk6ZbjMMMDIMxo3JFc8lY8CAR-Q",
+        }
+        mock_post.return_value = MockResponse(data=mock_login_status, status_code=200)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "cache.sqlite3")
+            first_poller, second_poller = [TvLoginPoller(
+                http_client=_app.config["HTTP_CLIENT"],
+                client_id=_app.config["GOOGLE_CLIENT_ID"],
+                client_secret=_app.config["GOOGLE_CLIENT_SECRET"],
+                timeout=_app.config["HTTP_REQUEST_TIMEOUT"],
+                store=SqliteTvLoginStore(path=path),
+                min_interval=_app.config["TV_LOGIN_MIN_POLL_INTERVAL_IN_SECONDS"],
+                run_in_background=False) for _ in range(2)]
+            query_string = {"interval": interval, "async": ""}
+
+            with patch.dict(_app.config, {"TV_LOGIN_POLLER": first_poller}):
+                first_response = self.client.get(f"/auth/tv/{device_code}", query_string=query_string)
+
+            # the poller of the other worker picks up the login, and that of the first has nothing left to poll
+            now = time.time() + interval
+            second_poller.poll_due(now=now)
+            first_poller.poll_due(now=now)
+
+            with patch.dict(_app.config, {"TV_LOGIN_POLLER": first_poller}):
+                second_response = self.client.get(f"/auth/tv/{device_code}", query_string=query_string)
+
+        self.assertEqual(1, mock_post.call_count)
+        self.assertEqual(202, first_response.status_code)
+        self.assertEqual(200, second_response.status_code)
+        self.assertEqual(mock_login_status, second_response.json)
+
+    @patch("requests.Session.post")
+    def test_check_tv_login_status_async_clamps_interval_and_wait(self, mock_post: MagicMock):
+        """Should poll no more often than the minimum interval, even on 'slow_down', and refuse invalid waits"""
+        device_code = "some fast random stuff"
+        min_interval = _app.config["TV_LOGIN_MIN_POLL_INTERVAL_IN_SECONDS"]
+        mock_post.return_value = MockResponse(data={"error": "slow_down"}, status_code=428)
+        poller = TvLoginPoller(
+            http_client=_app.config["HTTP_CLIENT"],
+            client_id=_app.config["GOOGLE_CLIENT_ID"],
+            client_secret=_app.config["GOOGLE_CLIENT_SECRET"],
+            timeout=_app.config["HTTP_REQUEST_TIMEOUT"],
+            min_interval=min_interval,
+            run_in_background=False)
+
+        with patch.dict(_app.config, {"TV_LOGIN_POLLER": poller}):
+            response = self.client.get(f"/auth/tv/{device_code}", query_string={"interval": -3, "async": ""})
+            poller.poll_due(now=time.time() + min_interval)
+            slowed_down_response = self.client.get(
+                f"/auth/tv/{device_code}", query_string={"interval": 0, "async": ""})
+            invalid_responses = [
+                self.client.get(f"/auth/tv/{device_code}", query_string={"async": "", "wait": wait})
+                for wait in ("nan", "inf", "-1")]
+
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(min_interval, response.json["interval"])
+        self.assertEqual(1, mock_post.call_count)
+        self.assertEqual(2 * min_interval, slowed_down_response.json["interval"])
+        for invalid_response in invalid_responses:
+            self.assertEqual(400, invalid_response.status_code)
+
+    @patch("requests.Session.post")
     def test_refresh_token(self, mock_post: MagicMock):
         """Should return the RefreshTokenResponse after making a call to the Google token refresh endpoint"""
         refresh_token = "some random token"
@@ -103,7 +222,7 @@ class TestAuth(TestCase):
         mock_post.return_value = MockResponse(data=mock_refresh_token_response, status_code=200)
 
         response = self.client.post("/auth/refresh-token", json={"refresh_token": refresh_token})
-        mock_post.assert_called_with(expected_url, headers=expected_headers, data=expected_data)
+        mock_post.assert_called_with(expected_url, headers=expected_headers, data=expected_data, timeout=_TIMEOUT)
         self.assertEqual(200, response.status_code)
         self.assertEqual(mock_refresh_token_response, response.json)
 
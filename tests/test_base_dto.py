@@ -0,0 +1,45 @@
+"""Tests for the base DTO"""
+from unittest import TestCase, main
+
+from services.auth.dtos import LoginDetails
+from services.youtube.dtos import ChannelDetails
+
+_CHANNEL = {
+    "id": "some-channel-id",
+    "kind": "youtube#channel",
+    "snippet": {
+        "title": "Café ☕",
+        "description": "a \"quoted\"\ndescription",
+        "thumbnails": {"default": {"url": "https://yt3.ggpht.com/ytc/gha", "width": 88}},
+    },
+    "contentDetails": {"relatedPlaylists": {}},
+}
+
+
+class TestBaseDto(TestCase):
+    """Tests for the BaseDto"""
+
+    def test_bjson(self):
+        """Should serialize only the fields that were set, in the order they are declared, as compact UTF-8 JSON"""
+        got = ChannelDetails.validate(_CHANNEL).bjson()
+
+        self.assertEqual(
+            '{"id":"some-channel-id","snippet":{"title":"Café ☕","description":"a \\"quoted\\"\\ndescription",'
+            '"thumbnails":{"default":{"url":"https://yt3.ggpht.com/ytc/gha","width":88}}},'
+            '"contentDetails":{"relatedPlaylists":{}}}'.encode(),
+            got)
+
+    def test_compatibility_methods(self):
+        """Should keep validate, parse_raw and dict as in pydantic v1"""
+        data = dict(device_code="a", user_code="b", verification_url="c", expires_in=1800, interval=5)
+
+        from_dict = LoginDetails.validate(data)
+        from_raw = LoginDetails.parse_raw(from_dict.bjson())
+
+        self.assertEqual(from_dict, from_raw)
+        self.assertEqual(data, from_raw.dict())
+        self.assertEqual({"id": "some-channel-id"}, ChannelDetails.validate(_CHANNEL).dict(include={"id"}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Tests for the cache utilities"""
+import os
+import pickle
+import tempfile
+import time
+from unittest import TestCase, main
+
+from flask import Response
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from utils.cache import Cache, get_req_id, CachedResponse
+from utils.cache_backends import MemoryBackend, SqliteBackend
+
+
+class TestCache(TestCase):
+    """Tests for the Cache"""
+
+    def test_evicts_least_recently_used(self):
+        """Should evict the least recently used entry when max_entries is exceeded"""
+        cache = Cache(ttl=60, backend=MemoryBackend(max_entries=2))
+        cache["a"] = b"1"
+        cache["b"] = b"2"
+        # touch 'a' so that 'b' becomes the least recently used
+        self.assertEqual(b"1", cache["a"])
+        cache["c"] = b"3"
+
+        self.assertIsNone(cache["b"])
+        self.assertEqual(b"1", cache["a"])
+        self.assertEqual(b"3", cache["c"])
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    def test_evicts_when_byte_budget_is_exceeded(self):
+        """Should evict the oldest entries to keep the total size within max_size_in_bytes"""
+        cache = Cache(ttl=60, backend=MemoryBackend(max_size_in_bytes=1000))
+        cache["a"] = b"x" * 500
+        cache["b"] = b"y" * 500
+
+        self.assertIsNone(cache["a"])
+        self.assertEqual(b"y" * 500, cache["b"])
+        self.assertLessEqual(cache.stats()["size_in_bytes"], 1000)
+
+    def test_ignores_values_bigger_than_byte_budget(self):
+        """Should not store values that can never fit in the cache"""
+        cache = Cache(ttl=60, backend=MemoryBackend(max_size_in_bytes=100))
+        cache["a"] = b"x" * 500
+        self.assertIsNone(cache["a"])
+        self.assertEqual(0, len(cache))
+
+    def test_expired_entries_are_swept(self):
+        """Should remove expired entries during the periodic sweep even if they are never read"""
+        cache = Cache(ttl=1, backend=MemoryBackend(sweep_interval=1))
+        cache["a"] = b"1"
+        cache["b"] = b"2"
+        time.sleep(1.1)
+        cache["c"] = b"3"
+
+        stats = cache.stats()
+        self.assertEqual(1, stats["entries"])
+        self.assertEqual(2, stats["expirations"])
+
+    def test_serves_stale_entries_until_stale_ttl_elapses(self):
+        """Should return entries older than ttl as stale until stale_ttl more seconds elapse"""
+        cache = Cache(ttl=1, stale_ttl=1)
+        cache["a"] = b"1"
+        self.assertEqual((b"1", False), cache.lookup("a"))
+
+        time.sleep(1.1)
+        self.assertEqual((b"1", True), cache.lookup("a"))
+        self.assertIsNone(cache["a"])
+
+        time.sleep(1)
+        self.assertEqual((None, False), cache.lookup("a"))
+
+    def test_counts_hits_and_misses(self):
+        """Should count the hits and misses"""
+        cache = Cache(ttl=60)
+        cache["a"] = b"1"
+        _ = cache["a"]
+        _ = cache["a"]
+        _ = cache["b"]
+
+        stats = cache.stats()
+        self.assertEqual(2, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+
+
+class TestSqliteBackend(TestCase):
+    """Tests for the SqliteBackend of the cache"""
+
+    def setUp(self) -> None:
+        """Create a temporary folder for the SQLite file"""
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "cache.sqlite3")
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def test_is_shared_by_caches_using_the_same_file(self):
+        """Should return values set by another cache, say in another worker, that uses the same file"""
+        first = Cache(ttl=60, backend=SqliteBackend(path=self.path))
+        second = Cache(ttl=60, backend=SqliteBackend(path=self.path))
+        first["a"] = {"b": b"c"}
+
+        self.assertEqual({"b": b"c"}, second["a"])
+
+    def test_expires_entries(self):
+        """Should not return entries older than the ttl"""
+        cache = Cache(ttl=1, backend=SqliteBackend(path=self.path))
+        cache["a"] = b"1"
+        time.sleep(1.1)
+
+        self.assertIsNone(cache["a"])
+
+    def test_evicts_oldest_entries(self):
+        """Should evict the oldest written entries once it has more than max_entries entries"""
+        cache = Cache(ttl=60, backend=SqliteBackend(path=self.path, max_entries=2, trim_interval=1))
+        cache["a"] = b"1"
+        cache["b"] = b"2"
+        cache["c"] = b"3"
+
+        self.assertIsNone(cache["a"])
+        self.assertEqual(b"3", cache["c"])
+        self.assertEqual(2, len(cache))
+
+
+class TestCachedResponse(TestCase):
+    """Tests for the CachedResponse record"""
+
+    def test_keeps_only_status_body_and_a_few_headers(self):
+        """Should keep the status, the body and the cacheable headers of the response, adding an ETag"""
+        response = Response(b'{"a":1}', status=201, mimetype="application/json", headers={"X-Other": "b"})
+        record = CachedResponse.from_response(response)
+
+        self.assertEqual(201, record.status)
+        self.assertEqual(b'{"a":1}', record.body)
+        self.assertEqual(("Content-Type", "application/json"), record.headers[0])
+        self.assertEqual("ETag", record.headers[1][0])
+        self.assertEqual(2, len(record.headers))
+
+    def test_round_trips_through_pickle(self):
+        """Should be picklable so that it can be stored in backends shared by many processes"""
+        record = CachedResponse(status=200, headers=(("Content-Type", "application/json"),), body=b"[]")
+        self.assertEqual(record, pickle.loads(pickle.dumps(record)))
+
+    def test_creates_new_responses(self):
+        """Should create a new response with the same status, headers and body each time"""
+        record = CachedResponse(status=200, headers=(("Content-Type", "application/json"),), body=b"[]")
+        first = record.to_response()
+        second = record.to_response()
+
+        self.assertIsNot(first, second)
+        self.assertEqual(b"[]", second.get_data())
+        self.assertEqual("application/json", second.mimetype)
+
+
+class TestGetReqId(TestCase):
+    """Tests for get_req_id"""
+
+    @staticmethod
+    def _request(**kwargs) -> Request:
+        return Request(EnvironBuilder(**kwargs).get_environ())
+
+    def test_is_a_fixed_size_digest(self):
+        """Should return a digest of the same size whatever the size of the request"""
+        short = get_req_id(self._request(path="/a"))
+        long = get_req_id(self._request(path=f"/{'a' * 1000}", query_string={"q": "b" * 1000}))
+        self.assertEqual(len(short), len(long))
+
+    def test_ignores_irrelevant_headers(self):
+        """Should return the same id for requests differing only by headers that are not part of the key"""
+        first = self._request(path="/a", headers={"X-YouHedge-Token": "t", "User-Agent": "x"})
+        second = self._request(path="/a", headers={"X-YouHedge-Token": "t", "User-Agent": "y", "Traceparent": "z"})
+        self.assertEqual(get_req_id(first), get_req_id(second))
+
+    def test_differs_by_token(self):
+        """Should return different ids for different X-YouHedge-Token headers"""
+        first = self._request(path="/a", headers={"X-YouHedge-Token": "t"})
+        second = self._request(path="/a", headers={"X-YouHedge-Token": "u"})
+        self.assertNotEqual(get_req_id(first), get_req_id(second))
+
+    def test_normalizes_query_args(self):
+        """Should return the same id whatever the order of the query args"""
+        first = self._request(path="/a", query_string="x=1&y=2")
+        second = self._request(path="/a", query_string="y=2&x=1")
+        self.assertEqual(get_req_id(first), get_req_id(second))
+
+    def test_only_uses_chosen_query_args(self):
+        """Should ignore the query args that are not in query_args if it is given"""
+        first = self._request(path="/a", query_string="pageToken=1&utm=2")
+        second = self._request(path="/a", query_string="pageToken=1&utm=3")
+        third = self._request(path="/a", query_string="pageToken=2&utm=3")
+        self.assertEqual(get_req_id(first, query_args=["pageToken"]), get_req_id(second, query_args=["pageToken"]))
+        self.assertNotEqual(get_req_id(first, query_args=["pageToken"]), get_req_id(third, query_args=["pageToken"]))
+
+    def test_uses_body_of_non_get_requests_without_consuming_it(self):
+        """Should use the body of say POST requests in the id and leave it readable for the view"""
+        first = self._request(path="/a", method="POST", data=b"1")
+        second = self._request(path="/a", method="POST", data=b"2")
+        self.assertNotEqual(get_req_id(first), get_req_id(second))
+        self.assertEqual(b"1", first.get_data())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Module containing tests for the compression of responses"""
+import gzip
+from unittest import TestCase, main, skipUnless
+from unittest.mock import patch, MagicMock
+
+import orjson
+from werkzeug.http import parse_accept_header
+
+from services import create_app
+from utils import compression
+from utils.testing import MockResponse
+
+_app = create_app(config_filename="test.config.json", should_log_err_to_file=False)
+
+
+def _get_subscriptions(count: int):
+    """Returns a SubscriptionListResponse of the given number of subscriptions as sent by YouTube"""
+    return {
+        "kind": "youtube#SubscriptionListResponse",
+        "etag": "Oqgkyuuyyb",
+        "pageInfo": {"totalResults": count, "resultsPerPage": count},
+        "items": [{
+            "kind": "youtube#subscription",
+            "etag": f"etag-{i}",
+            "id": f"id-{i}",
+            "snippet": {
+                "publishedAt": "2022-07-12T21:05:09.560563Z",
+                "title": f"Channel {i}",
+                "description": "Some stuff",
+                "resourceId": {"kind": "youtube#channel", "channelId": f"channel-{i}"},
+                "channelId": "ayueuwtwtehgj",
+                "thumbnails": {"default": {"url": f"https://yt3.ggpht.com/ytc/{i}"}},
+            },
+        } for i in range(count)],
+    }
+
+
+class TestCompression(TestCase):
+    """Tests for the compression helpers and the ResponseCompressor"""
+
+    def setUp(self) -> None:
+        """Initialize a few common variables"""
+        self.client = _app.test_client()
+        _app.config["CACHE"].clear()
+        _app.config["COMPRESSION_CACHE"].clear()
+        _app.config["TOKEN_STATES"].clear()
+
+    def test_negotiate(self):
+        """Should pick the best encoding the client accepts, in the order of preference of the server"""
+        self.assertEqual("gzip", compression.negotiate(parse_accept_header("gzip, deflate"), ("br", "gzip")))
+        self.assertEqual("br", compression.negotiate(parse_accept_header("gzip, br"), ("br", "gzip")))
+        self.assertEqual("gzip", compression.negotiate(parse_accept_header("gzip, br;q=0.5"), ("br", "gzip")))
+        self.assertEqual("identity", compression.negotiate(parse_accept_header("gzip;q=0"), ("gzip",)))
+        self.assertEqual("identity", compression.negotiate(parse_accept_header(""), ("gzip",)))
+
+    def test_precompress(self):
+        """Should leave out the variants that are no smaller than the body"""
+        body = b'{"key": "value"}' * 100
+        self.assertEqual(body, gzip.decompress(compression.precompress(body, ("gzip",))["gzip"]))
+        self.assertEqual({"identity": b"{}"}, compression.precompress(b"{}", ("gzip",)))
+
+    @patch("requests.Session.get")
+    def test_json_responses_are_compressed_once(self, mock_get: MagicMock):
+        """Should compress large JSON responses and keep the compressed bodies in the cache by ETag and encoding"""
+        mock_get.return_value = MockResponse(data=_get_subscriptions(20), status_code=200)
+        headers = {"X-YouHedge-Token": "some token", "Accept-Encoding": "gzip"}
+
+        plain_response = self.client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": "some token"})
+        with patch.object(compression, "compress", wraps=compression.compress) as mock_compress:
+            first_response = self.client.get("/youtube/subscriptions", headers=headers)
+            second_response = self.client.get("/youtube/subscriptions", headers=headers)
+            cached_response = self.client.get(
+                "/youtube/subscriptions", headers={**headers, "If-None-Match": first_response.headers["ETag"]})
+
+        self.assertEqual(1, mock_compress.call_count)
+        self.assertEqual(1, len(_app.config["COMPRESSION_CACHE"]))
+        self.assertEqual(1, len(_app.config["CACHE"]))
+        self.assertNotIn("Content-Encoding", plain_response.headers)
+        self.assertEqual("gzip", first_response.headers["Content-Encoding"])
+        self.assertIn("Accept-Encoding", first_response.headers["Vary"])
+        self.assertEqual(plain_response.data, gzip.decompress(first_response.data))
+        self.assertEqual(first_response.data, second_response.data)
+        self.assertEqual(plain_response.headers["ETag"][:-1] + '-gzip"', first_response.headers["ETag"])
+        self.assertEqual(304, cached_response.status_code)
+        self.assertEqual(b"", cached_response.data)
+
+    @skipUnless(compression.brotli, "the brotli package is not installed")
+    @patch("requests.Session.get")
+    def test_json_responses_are_compressed_with_brotli(self, mock_get: MagicMock):
+        """Should prefer brotli for clients that accept it along with gzip"""
+        mock_get.return_value = MockResponse(data=_get_subscriptions(20), status_code=200)
+        headers = {"X-YouHedge-Token": "some token"}
+
+        plain_response = self.client.get("/youtube/subscriptions", headers=headers)
+        response = self.client.get("/youtube/subscriptions", headers={**headers, "Accept-Encoding": "gzip, br"})
+
+        self.assertEqual("br", response.headers["Content-Encoding"])
+        self.assertEqual(plain_response.headers["ETag"][:-1] + '-br"', response.headers["ETag"])
+        self.assertEqual(plain_response.data, compression.brotli.decompress(response.data))
+
+    @skipUnless(compression.zstandard, "the zstandard package is not installed")
+    @patch("requests.Session.get")
+    def test_json_responses_are_compressed_with_zstd(self, mock_get: MagicMock):
+        """Should prefer zstd over gzip for clients that accept both"""
+        mock_get.return_value = MockResponse(data=_get_subscriptions(20), status_code=200)
+        headers = {"X-YouHedge-Token": "some token"}
+
+        plain_response = self.client.get("/youtube/subscriptions", headers=headers)
+        response = self.client.get("/youtube/subscriptions", headers={**headers, "Accept-Encoding": "gzip, zstd"})
+
+        self.assertEqual("zstd", response.headers["Content-Encoding"])
+        self.assertEqual(plain_response.headers["ETag"][:-1] + '-zstd"', response.headers["ETag"])
+        self.assertEqual(plain_response.data, compression.zstandard.ZstdDecompressor().decompress(response.data))
+
+    @patch("requests.Session.get")
+    def test_small_responses_are_not_compressed(self, mock_get: MagicMock):
+        """Should send JSON responses smaller than the minimum size as they are"""
+        mock_get.return_value = MockResponse(data=_get_subscriptions(1), status_code=200)
+
+        response = self.client.get(
+            "/youtube/subscriptions", headers={"X-YouHedge-Token": "some token", "Accept-Encoding": "gzip"})
+
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(1, len(orjson.loads(response.data)["items"]))
+
+
+if __name__ == '__main__':
+    main()
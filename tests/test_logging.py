@@ -0,0 +1,179 @@
+"""Module containing tests for the logging utilities"""
+import gzip
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from flask import Flask
+
+from utils import logging as logging_utils
+from utils.logging import BoundedQueueHandler, RequestFormatter, RotatingGzipFileHandler
+
+
+class _ListHandler(logging.Handler):
+    """A handler that keeps the formatted records, optionally waiting for an event before each"""
+
+    def __init__(self, event: threading.Event = None):
+        super().__init__()
+        self.event = event
+        self.messages = []
+        self.setFormatter(RequestFormatter("%(url)s %(levelname)s %(message)s"))
+
+    def emit(self, record):
+        if self.event is not None:
+            self.event.wait(timeout=5)
+        self.messages.append(self.format(record))
+
+
+class TestBoundedQueueHandler(TestCase):
+    """Tests for the BoundedQueueHandler"""
+
+    def setUp(self) -> None:
+        """Initialize a few common variables"""
+        self.logger = logging.getLogger(f"test-{self.id()}")
+        self.logger.propagate = False
+
+    def test_records_are_written_by_the_writer(self):
+        """Should write the records, with the details of their requests and exceptions, from the writer thread"""
+        target = _ListHandler()
+        handler = BoundedQueueHandler([target], max_size=10)
+        self.logger.addHandler(handler)
+        app = Flask(__name__)
+
+        with app.test_request_context("/some/path"):
+            self.logger.error("failed %s", "upstream")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("crashed")
+        handler.close()
+
+        self.assertEqual("http://localhost/some/path ERROR failed upstream", target.messages[0])
+        self.assertTrue(target.messages[1].startswith("None ERROR crashed\nTraceback"))
+        self.assertIn("ValueError: boom", target.messages[1])
+
+    def test_records_are_dropped_when_the_queue_is_full(self):
+        """Should drop and count the records that find the queue full instead of waiting"""
+        event = threading.Event()
+        target = _ListHandler(event=event)
+        handler = BoundedQueueHandler([target], max_size=2, batch_size=1)
+        self.logger.addHandler(handler)
+
+        for i in range(10):
+            self.logger.error("record %d", i)
+        stats = handler.stats()
+        event.set()
+        handler.close()
+
+        self.assertEqual(2, stats["queued"])
+        self.assertGreaterEqual(stats["dropped"], 7)
+        self.assertEqual(10, len(target.messages) + handler.dropped)
+
+    def test_writer_is_a_native_thread_under_gevent(self):
+        """Should write the records from a native thread, not a greenlet, when gevent has monkey-patched threading"""
+        script = textwrap.dedent("""
+            from gevent import monkey
+            monkey.patch_all()
+            import logging
+            from utils.logging import BoundedQueueHandler
+
+            get_ident = monkey.get_original("_thread", "get_ident")
+            writer_idents = []
+
+            class Target(logging.Handler):
+                def emit(self, record):
+                    writer_idents.append(get_ident())
+
+            handler = BoundedQueueHandler([Target()], max_size=10)
+            logger = logging.getLogger("native")
+            logger.addHandler(handler)
+            logger.error("first")
+            logger.error("second")
+            handler.close()
+            assert len(writer_idents) == 2, writer_idents
+            assert get_ident() not in writer_idents, writer_idents
+        """)
+
+        result = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.dirname(__file__)),
+                                capture_output=True, text=True, timeout=30)
+
+        self.assertEqual(0, result.returncode, result.stderr)
+
+
+class TestRotatingGzipFileHandler(TestCase):
+    """Tests for the RotatingGzipFileHandler"""
+
+    def setUp(self) -> None:
+        """Initialize a few common variables"""
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, "error.log")
+
+    def _wait_for(self, *filenames: str):
+        """Waits for the background compression to leave exactly the given files in the folder"""
+        deadline = time.monotonic() + 5
+        while sorted(os.listdir(self.folder)) != sorted(filenames) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(sorted(filenames), sorted(os.listdir(self.folder)))
+
+    def test_rollover(self):
+        """Should rename the log to the next back up and compress it in the background"""
+        handler = RotatingGzipFileHandler(self.path, maxBytes=25)
+        self.addCleanup(handler.close)
+        with patch.object(logging_utils, "_start_background_thread") as mock_start:
+            handler.emit(logging.makeLogRecord({"msg": "first record"}))
+            handler.emit(logging.makeLogRecord({"msg": "second record"}))
+
+        self.assertEqual(["error.log", "error.log.1"], sorted(os.listdir(self.folder)))
+        mock_start.assert_called_once_with(handler._compress, f"{self.path}.1")
+
+        handler._compress(f"{self.path}.1")
+        with gzip.open(f"{self.path}.1.gz", "rb") as file:
+            self.assertEqual(b"first record\n", file.read())
+        self._wait_for("error.log", "error.log.1.gz")
+
+    def test_next_backup_is_found_once(self):
+        """Should continue from the last back up, compressing any that were left uncompressed"""
+        for filename in ("error.log.1.gz", "error.log.2.gz", "error.log.3"):
+            with open(os.path.join(self.folder, filename), "wb") as file:
+                file.write(b"old")
+
+        handler = RotatingGzipFileHandler(self.path, maxBytes=25)
+        self.addCleanup(handler.close)
+        self._wait_for("error.log", "error.log.1.gz", "error.log.2.gz", "error.log.3.gz")
+
+        with patch.object(os, "listdir", wraps=os.listdir) as mock_listdir, \
+                patch.object(logging_utils, "_start_background_thread"):
+            handler.emit(logging.makeLogRecord({"msg": "a record long enough"}))
+            handler.emit(logging.makeLogRecord({"msg": "a record long enough"}))
+
+        mock_listdir.assert_not_called()
+        self.assertIn("error.log.4", os.listdir(self.folder))
+
+    def test_retention(self):
+        """Should keep only the most recent backupCount back ups, none older than max_age"""
+        for i in range(1, 5):
+            with open(os.path.join(self.folder, f"error.log.{i}.gz"), "wb") as file:
+                file.write(b"old")
+        old = time.time() - 100
+        os.utime(os.path.join(self.folder, "error.log.4.gz"), (old, old))
+
+        handler = RotatingGzipFileHandler(self.path, maxBytes=25, backupCount=3, max_age=50)
+        self.addCleanup(handler.close)
+        handler.emit(logging.makeLogRecord({"msg": "a record long enough"}))
+        handler.emit(logging.makeLogRecord({"msg": "a record long enough"}))
+
+        self._wait_for("error.log", "error.log.3.gz", "error.log.5.gz")
+
+
+if __name__ == '__main__':
+    main()
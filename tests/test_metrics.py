@@ -0,0 +1,141 @@
+"""Tests for the metrics"""
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch, MagicMock
+
+import requests
+from flask import Flask
+
+from services import create_app
+from utils.exc import UpstreamUnavailable
+from utils.http import HttpClient, UpstreamCall
+from utils.instrumentation import RequestProfiler
+from utils.metrics import MetricsRegistry
+from utils.testing import MockResponse
+
+_app = create_app(config_filename="test.config.json", should_log_err_to_file=False)
+
+
+class TestMetricsRegistry(TestCase):
+    """Tests for the MetricsRegistry"""
+
+    def test_render(self):
+        """Should render counters and cumulative histogram buckets in the Prometheus text format"""
+        registry = MetricsRegistry()
+        counter = registry.counter("calls_total", "Calls", ("status",))
+        histogram = registry.histogram("duration_seconds", "Duration", buckets=(0.1, 1))
+        registry.add_collector(lambda: [("entries", "Entries", [({"kind": 'a"b'}, 3)])])
+
+        counter.inc(status=200)
+        counter.inc(2, status=200)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+
+        self.assertEqual("\n".join([
+            "# HELP calls_total Calls",
+            "# TYPE calls_total counter",
+            'calls_total{status="200"} 3',
+            "# HELP duration_seconds Duration",
+            "# TYPE duration_seconds histogram",
+            'duration_seconds_bucket{le="0.1"} 1',
+            'duration_seconds_bucket{le="1"} 2',
+            'duration_seconds_bucket{le="+Inf"} 3',
+            "duration_seconds_sum 5.55",
+            "duration_seconds_count 3",
+            "# HELP entries Entries",
+            "# TYPE entries untyped",
+            'entries{kind="a\\"b"} 3',
+            "",
+        ]), registry.render())
+
+
+class TestHttpClientHooks(TestCase):
+    """Tests for the hooks of the HttpClient"""
+
+    @patch("requests.Session.get")
+    def test_hooks_get_each_call(self, mock_get: MagicMock):
+        """Should pass the record of every call, including failed ones, to the hooks without the query string"""
+        calls = []
+        client = HttpClient(hooks=[calls.append])
+        mock_get.side_effect = [MockResponse(data={"a": 1}, status_code=200), requests.exceptions.ConnectTimeout()]
+
+        client.get("https://example.com/v3/channels?key=secret", quota_cost=1)
+        self.assertRaises(UpstreamUnavailable, client.get, "https://example.com/v3/channels")
+
+        self.assertEqual(2, len(calls))
+        first: UpstreamCall = calls[0]
+        self.assertEqual(("GET", "example.com/v3/channels", 200, 7, 1), (
+            first.method, first.endpoint, first.status_code, first.bytes_received, first.quota_cost))
+        second: UpstreamCall = calls[1]
+        self.assertIsNone(second.status_code)
+        self.assertIsInstance(second.error, UpstreamUnavailable)
+        self.assertIsInstance(second.error.__cause__, requests.exceptions.ConnectTimeout)
+
+
+class TestMetricsEndpoint(TestCase):
+    """Tests for the /metrics endpoint"""
+
+    @patch("requests.Session.get")
+    def test_get_metrics(self, mock_get: MagicMock):
+        """Should expose the upstream calls and the stats of the app in the Prometheus text format"""
+        client = _app.test_client()
+        mock_get.return_value = MockResponse(data={"items": []}, status_code=200)
+
+        client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": "metrics-user"})
+        response = client.get("/metrics")
+        body = response.get_data(as_text=True)
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn('youhedge_upstream_requests_total{endpoint="youtube.googleapis.com/youtube/v3/subscriptions",'
+                      'method="GET",status="200"}', body)
+        self.assertIn('youhedge_upstream_quota_cost_total{endpoint="youtube.googleapis.com/youtube/v3/subscriptions"}',
+                      body)
+        self.assertIn("youhedge_cache_misses", body)
+        self.assertIn("youhedge_single_flight_calls", body)
+
+    @patch("requests.Session.get")
+    def test_get_request_phases(self, mock_get: MagicMock):
+        """Should expose the duration of the phases of each route split by the outcome of the cache"""
+        client = _app.test_client()
+        channel = {
+            "id": "a metrics channel id",
+            "snippet": {"title": "Yoooo Mahn", "description": "", "thumbnails": {}},
+            "contentDetails": {"relatedPlaylists": {}},
+        }
+        mock_get.return_value = MockResponse(data={"items": [channel]}, status_code=200)
+        headers = {"X-YouHedge-Token": "metrics-user"}
+
+        # the phases are recorded once the response is closed, after it is written
+        client.get("/youtube/channels/a metrics channel id", headers=headers).close()
+        client.get("/youtube/channels/a metrics channel id", headers=headers).close()
+        body = client.get("/metrics").get_data(as_text=True)
+
+        for phase, cache_status in [("upstream", "miss"), ("validation", "miss"), ("serialization", "miss"),
+                                    ("req_id", "hit"), ("cache_lookup", "hit"), ("write", "hit")]:
+            self.assertIn('youhedge_request_phase_duration_seconds_count{endpoint="youtube.get_channel_details",'
+                          f'phase="{phase}",cache="{cache_status}"}} 1', body)
+        self.assertNotIn('phase="upstream",cache="hit"', body)
+
+
+class TestRequestProfiler(TestCase):
+    """Tests for the RequestProfiler"""
+
+    def test_profiles_sampled_requests(self):
+        """Should dump the profile of each sampled request to the given folder"""
+        app = Flask(__name__)
+        app.get("/")(lambda: "ok")
+
+        with tempfile.TemporaryDirectory() as folder:
+            RequestProfiler(sample_rate=1, path=folder).init_app(app)
+            app.test_client().get("/")
+
+            files = os.listdir(folder)
+            self.assertEqual(1, len(files))
+            self.assertTrue(files[0].startswith("<lambda>-"))
+            self.assertTrue(files[0].endswith(".prof"))
+
+
+if __name__ == '__main__':
+    main()
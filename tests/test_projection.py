@@ -0,0 +1,63 @@
+"""Tests for the projection of payloads onto DTOs"""
+import copy
+from unittest import TestCase, main
+
+import orjson
+from pydantic import ValidationError
+
+from services.youtube.dtos import PlaylistItemListResponse
+from utils.projection import project, get_projector
+
+_PLAYLIST_ITEMS = {
+    "kind": "youtube#playlistItemListResponse",
+    "etag": "some-etag",
+    "nextPageToken": "next-page",
+    "pageInfo": {"totalResults": 2, "resultsPerPage": 5},
+    "items": [
+        {
+            "kind": "youtube#playlistItem",
+            "etag": "item-etag",
+            "id": "item-1",
+            "snippet": {
+                "publishedAt": "2022-01-01T00:00:00Z",
+                "title": "First",
+                "description": "",
+                "thumbnails": {"default": {"url": "https://i.ytimg.com/1.jpg", "width": 120, "height": 90}},
+                "position": 0,
+                "resourceId": {"kind": "youtube#video", "videoId": "video-1"},
+            },
+        },
+    ],
+}
+
+
+class TestProject(TestCase):
+    """Tests for project"""
+
+    def test_same_output_as_pydantic(self):
+        """Should give the same output as validating the payload and dumping the DTO"""
+        expected = PlaylistItemListResponse.validate(_PLAYLIST_ITEMS).bjson()
+        got = orjson.dumps(project(PlaylistItemListResponse, _PLAYLIST_ITEMS))
+
+        self.assertIsNotNone(get_projector(PlaylistItemListResponse))
+        self.assertEqual(expected, got)
+
+    def test_falls_back_to_pydantic_on_mismatched_types(self):
+        """Should hand payloads that pydantic would coerce over to pydantic"""
+        data = copy.deepcopy(_PLAYLIST_ITEMS)
+        data["items"][0]["snippet"]["position"] = "3"
+
+        got = project(PlaylistItemListResponse, data)
+
+        self.assertEqual(3, got["items"][0]["snippet"]["position"])
+
+    def test_raises_validation_error_on_invalid_payload(self):
+        """Should raise the same ValidationError as pydantic on payloads missing required fields"""
+        data = copy.deepcopy(_PLAYLIST_ITEMS)
+        del data["items"][0]["snippet"]["title"]
+
+        self.assertRaises(ValidationError, project, PlaylistItemListResponse, data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Tests for the accounting of the YouTube quota"""
+import os
+import tempfile
+import time
+from unittest import TestCase, main
+from unittest.mock import patch, MagicMock, call
+
+from services import create_app
+from utils.cache import Cache, EntityCache
+from utils.exc import APIException
+from utils.quota import QuotaAccountant, SqliteQuotaStore, NORMAL, EXTEND_TTL, SERVE_STALE, REFUSE_COSTLY
+from utils.testing import MockResponse
+
+_app = create_app(config_filename="test.config.json", should_log_err_to_file=False)
+
+
+class TestQuotaAccountant(TestCase):
+    """Tests for the QuotaAccountant"""
+
+    def test_degrades_in_steps(self):
+        """Should extend TTLs, then serve stale values, then refuse costly requests as the quota runs low"""
+        quota = QuotaAccountant(daily_budget=100, ttl_factor=4, max_cost_when_low=1, sync_interval=0)
+        steps = []
+        for units in (40, 20, 20, 15, 5):
+            quota.spend(units)
+            steps.append((quota.level(), quota.ttl_factor(), quota.should_serve_stale()))
+
+        self.assertEqual([
+            (NORMAL, 1, False),
+            (EXTEND_TTL, 4, False),
+            (SERVE_STALE, 4, True),
+            (REFUSE_COSTLY, 4, True),
+            (REFUSE_COSTLY, 4, True),
+        ], steps)
+
+    def test_admit(self):
+        """Should refuse costly requests when the quota is low and any request once it is spent"""
+        quota = QuotaAccountant(daily_budget=100, max_cost_when_low=1, sync_interval=0)
+        quota.admit(50)
+
+        quota.spend(95)
+        quota.admit(1)
+        self.assertRaises(APIException, quota.admit, 2)
+
+        quota.spend(5)
+        self.assertRaises(APIException, quota.admit, 1)
+        quota.admit(0)
+
+    def test_shared_across_workers(self):
+        """Should see the units spent by other workers sharing the same SQLite file"""
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "cache.sqlite3")
+            first = QuotaAccountant(daily_budget=100, store=SqliteQuotaStore(path), sync_interval=0)
+            second = QuotaAccountant(daily_budget=100, store=SqliteQuotaStore(path), sync_interval=0)
+
+            first.spend(30)
+            second.spend(30)
+
+            self.assertEqual(60, first.used())
+            self.assertEqual(60, second.used())
+
+    def test_extends_ttl_of_cache(self):
+        """Should make the cache keep values longer while the quota is running low"""
+        quota = QuotaAccountant(daily_budget=100, ttl_factor=10, sync_interval=0)
+        cache = Cache(ttl=1, ttl_factor=quota.ttl_factor)
+        cache["normal"] = b"1"
+        quota.spend(60)
+        cache["extended"] = b"2"
+
+        time.sleep(1.1)
+
+        self.assertIsNone(cache["normal"])
+        self.assertEqual(b"2", cache["extended"])
+
+
+class TestQuotaAdmission(TestCase):
+    """Tests for the cost-aware admission of requests to the YouTube service"""
+
+    def setUp(self) -> None:
+        """Initialize a few common variables"""
+        self.client = _app.test_client()
+        _app.config["CACHE"].clear()
+        _app.config["ENTITY_CACHE"].clear()
+
+    @patch("requests.Session.get")
+    def test_serves_stale_when_quota_is_low(self, mock_get: MagicMock):
+        """Should serve a stale channel without revalidating it upstream when the quota is running low"""
+        channel_id = "a quota channel id"
+        mock_get.return_value = MockResponse(data={"items": [{
+            "id": channel_id,
+            "snippet": {"title": "Yoooo Mahn", "description": "", "thumbnails": {}},
+            "contentDetails": {"relatedPlaylists": {}},
+        }]}, status_code=200)
+        quota = QuotaAccountant(daily_budget=100, sync_interval=0)
+        entity_cache = EntityCache(cache=Cache(ttl=60, stale_ttl=60), ttls={"channel": 1})
+
+        with patch.dict(_app.config, {"ENTITY_CACHE": entity_cache, "QUOTA": quota}):
+            first_response = self.client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": "user-1"})
+            quota.spend(80)
+            time.sleep(1.1)
+            second_response = self.client.get(f"/youtube/channels/{channel_id}",
+                                              headers={"X-YouHedge-Token": "user-2"})
+
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(200, second_response.status_code)
+        self.assertEqual(first_response.get_data(), second_response.get_data())
+
+    @patch("requests.Session.get")
+    def test_refuses_costly_requests_when_quota_is_low(self, mock_get: MagicMock):
+        """Should refuse uncached requests that cost more than allowed when the quota is low, without calling YouTube"""
+        quota = QuotaAccountant(daily_budget=100, max_cost_when_low=1, sync_interval=0)
+        quota.spend(95)
+        headers = {"X-YouHedge-Token": "user-1"}
+
+        with patch.dict(_app.config, {"QUOTA": quota}):
+            stream_response = self.client.get("/youtube/playlist-items/some-playlist?stream", headers=headers)
+            quota.spend(5)
+            channel_response = self.client.get("/youtube/channels/some-uncached-channel", headers=headers)
+
+        mock_get.assert_not_called()
+        self.assertEqual(503, stream_response.status_code)
+        self.assertEqual(503, channel_response.status_code)
+
+    @patch("requests.Session.get")
+    def test_streams_without_max_items_at_full_quota(self, mock_get: MagicMock):
+        """Should stream all pages when maxItems is not given and the quota is not low, admitting each page"""
+        def get_item(position: int):
+            return {"id": f"item-{position}", "snippet": {
+                "title": "Video", "description": "", "thumbnails": {}, "position": position,
+                "resourceId": {"videoId": f"video-{position}"}}}
+
+        pages = [
+            {"nextPageToken": "page-2", "items": [get_item(0)]},
+            {"items": [get_item(1)]},
+        ]
+        mock_get.side_effect = [MockResponse(data=page, status_code=200) for page in pages]
+        quota = QuotaAccountant(daily_budget=10000, sync_interval=0)
+
+        with patch.dict(_app.config, {"QUOTA": quota}), patch.object(quota, "admit", wraps=quota.admit) as mock_admit:
+            response = self.client.get(
+                "/youtube/playlist-items/some-playlist?stream", headers={"X-YouHedge-Token": "user-1"})
+            lines = response.get_data().splitlines()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(lines))
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual([call(1), call(1)], mock_admit.call_args_list)
+
+    @patch("requests.Session.get")
+    def test_admits_streams_by_pages_of_fifty_items(self, mock_get: MagicMock):
+        """Should admit a stream of maxItems items at the cost of the pages of 50 items it may need"""
+        mock_get.return_value = MockResponse(data={"items": []}, status_code=200)
+        quota = QuotaAccountant(daily_budget=10000, sync_interval=0)
+
+        with patch.dict(_app.config, {"QUOTA": quota}), patch.object(quota, "admit", wraps=quota.admit) as mock_admit:
+            response = self.client.get(
+                "/youtube/playlist-items/some-playlist?stream&maxItems=120", headers={"X-YouHedge-Token": "user-1"})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([call(3)], mock_admit.call_args_list)
+        self.assertIn("&maxResults=50", mock_get.call_args.args[0])
+
+
+if __name__ == '__main__':
+    main()
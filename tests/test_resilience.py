@@ -0,0 +1,180 @@
+"""Tests for the retries and circuit breakers of calls to upstream APIs"""
+import sqlite3
+import time
+from unittest import TestCase, main
+from unittest.mock import patch, MagicMock, call
+
+import requests
+
+from services import create_app
+from utils.cache import Cache, EntityCache
+from utils.exc import UpstreamUnavailable
+from utils.http import HttpClient
+from utils.resilience import RetryPolicy, CircuitBreaker, CircuitBreakers
+from utils.testing import MockResponse
+
+_app = create_app(config_filename="test.config.json", should_log_err_to_file=False)
+
+
+class TestRetryPolicy(TestCase):
+    """Tests for the RetryPolicy"""
+
+    def test_get_delay(self):
+        """Should back off exponentially with jitter, honor Retry-After, and stop after max_retries"""
+        policy = RetryPolicy(max_retries=3, backoff_base=1, backoff_max=3, max_retry_after=10)
+
+        for attempt, bound in ((0, 1), (1, 2), (2, 3)):
+            delay = policy.get_delay(attempt)
+            self.assertTrue(0 <= delay <= bound)
+
+        self.assertIsNone(policy.get_delay(3))
+        self.assertEqual(7, policy.get_delay(0, retry_after="7"))
+        self.assertIsNone(policy.get_delay(0, retry_after="60"))
+        self.assertEqual(0, policy.get_delay(0, retry_after="Wed, 21 Oct 2015 07:28:00 GMT"))
+
+
+class TestCircuitBreaker(TestCase):
+    """Tests for the CircuitBreaker"""
+
+    def test_opens_and_half_opens(self):
+        """Should fail fast after failure_threshold failures in a row and let a single trial through after reset_timeout"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.5)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.6)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.6)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+
+class TestHttpClientResilience(TestCase):
+    """Tests for the retries and circuit breakers of the HttpClient"""
+
+    @patch("time.sleep")
+    @patch("requests.Session.get")
+    def test_retries_get(self, mock_get: MagicMock, mock_sleep: MagicMock):
+        """Should retry GETs on transient statuses, waiting as long as Retry-After says"""
+        client = HttpClient(retry_policy=RetryPolicy(max_retries=2))
+        mock_get.side_effect = [
+            MockResponse(data={}, status_code=503, headers={"Retry-After": "2"}),
+            MockResponse(data={}, status_code=429, headers={"Retry-After": "1"}),
+            MockResponse(data={"ok": True}, status_code=200),
+        ]
+
+        response = client.get("https://example.com/v3/channels")
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, mock_get.call_count)
+        mock_sleep.assert_has_calls([call(2.0), call(1.0)])
+
+    @patch("time.sleep")
+    @patch("requests.Session.get")
+    def test_retries_only_the_statuses_of_the_policy(self, mock_get: MagicMock, mock_sleep: MagicMock):
+        """Should retry and report as unavailable only the statuses given to the retry policy"""
+        client = HttpClient(retry_policy=RetryPolicy(max_retries=1, statuses=(503,)))
+        mock_get.return_value = MockResponse(data={}, status_code=502)
+        self.assertEqual(502, client.get("https://example.com/v3/channels").status_code)
+        self.assertEqual(1, mock_get.call_count)
+
+        mock_get.return_value = MockResponse(data={}, status_code=503)
+        self.assertRaises(UpstreamUnavailable, client.get, "https://example.com/v3/channels")
+        self.assertEqual(3, mock_get.call_count)
+
+    @patch("requests.Session.post")
+    def test_does_not_retry_post(self, mock_post: MagicMock):
+        """Should not retry POSTs as they are not idempotent"""
+        client = HttpClient(retry_policy=RetryPolicy(max_retries=2))
+        mock_post.return_value = MockResponse(data={}, status_code=503)
+
+        self.assertRaises(UpstreamUnavailable, client.post, "https://example.com/token", data={"a": "b"})
+        self.assertEqual(1, mock_post.call_count)
+
+    @patch("requests.Session.get")
+    def test_fails_fast_when_circuit_is_open(self, mock_get: MagicMock):
+        """Should stop calling an endpoint that keeps failing, without affecting other endpoints"""
+        client = HttpClient(circuit_breakers=CircuitBreakers(failure_threshold=2, reset_timeout=60))
+        mock_get.return_value = MockResponse(data={}, status_code=500)
+
+        for _ in range(4):
+            self.assertRaises(UpstreamUnavailable, client.get, "https://example.com/v3/channels")
+        self.assertEqual(2, mock_get.call_count)
+
+        mock_get.return_value = MockResponse(data={}, status_code=200)
+        self.assertEqual(200, client.get("https://example.com/v3/playlistItems").status_code)
+
+    @patch("requests.Session.get")
+    def test_half_open_trial_that_errors_does_not_stick(self, mock_get: MagicMock):
+        """Should close the circuit once the endpoint recovers, even if a trial failed with any request error"""
+        breakers = CircuitBreakers(failure_threshold=1, reset_timeout=0)
+        client = HttpClient(circuit_breakers=breakers)
+        mock_get.side_effect = requests.exceptions.ConnectTimeout("timed out")
+        self.assertRaises(UpstreamUnavailable, client.get, "https://example.com/v3/channels")
+
+        mock_get.side_effect = requests.exceptions.ChunkedEncodingError("connection reset")
+        with self.assertRaises(UpstreamUnavailable) as ctx:
+            client.get("https://example.com/v3/channels")
+        self.assertIsInstance(ctx.exception.__cause__, requests.exceptions.ChunkedEncodingError)
+
+        mock_get.side_effect = None
+        mock_get.return_value = MockResponse(data={}, status_code=200)
+        self.assertEqual(200, client.get("https://example.com/v3/channels").status_code)
+        self.assertFalse(breakers.get("example.com/v3/channels").is_open)
+
+
+    @patch("requests.Session.get")
+    def test_failing_hook_does_not_fail_the_call(self, mock_get: MagicMock):
+        """Should log the errors of hooks and still return the response, and call the hooks after a failing one"""
+        failing_hook = MagicMock(side_effect=sqlite3.OperationalError("database is locked"))
+        other_hook = MagicMock()
+        logger = MagicMock()
+        client = HttpClient(hooks=[failing_hook, other_hook], logger=logger)
+        mock_get.return_value = MockResponse(data={}, status_code=200)
+
+        self.assertEqual(200, client.get("https://example.com/v3/channels").status_code)
+        self.assertEqual(1, other_hook.call_count)
+        self.assertEqual(1, logger.error.call_count)
+        self.assertIn("database is locked", logger.error.call_args.args[0])
+
+
+class TestServeStaleWhenUnavailable(TestCase):
+    """Tests for serving cached resources while YouTube is unavailable"""
+
+    @patch("requests.Session.get")
+    def test_serves_stale_channel(self, mock_get: MagicMock):
+        """Should serve a stale channel if YouTube keeps failing while revalidating it"""
+        channel_id = "an unavailable channel id"
+        mock_get.return_value = MockResponse(data={"items": [{
+            "id": channel_id,
+            "snippet": {"title": "Yoooo Mahn", "description": "", "thumbnails": {}},
+            "contentDetails": {"relatedPlaylists": {}},
+        }]}, status_code=200)
+        entity_cache = EntityCache(cache=Cache(ttl=60, stale_ttl=60), ttls={"channel": 1})
+        client = _app.test_client()
+
+        with patch.dict(_app.config, {"ENTITY_CACHE": entity_cache}):
+            first_response = client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": "user-1"})
+            time.sleep(1.1)
+            mock_get.return_value = MockResponse(data={}, status_code=503)
+            second_response = client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": "user-2"})
+            third_response = client.get("/youtube/channels/an uncached channel id",
+                                        headers={"X-YouHedge-Token": "user-2"})
+
+        # the first call, then 1 + HTTP_MAX_RETRIES calls for each of the last two requests
+        self.assertEqual(1 + 2 * (1 + _app.config["HTTP_MAX_RETRIES"]), mock_get.call_count)
+        self.assertEqual(200, second_response.status_code)
+        self.assertEqual(first_response.get_data(), second_response.get_data())
+        self.assertEqual(503, third_response.status_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Module containing tests for the cache of the states of access tokens"""
+from unittest import TestCase, main
+from unittest.mock import patch, MagicMock
+
+import orjson
+
+from services import create_app
+from utils.cache import Cache
+from utils.cache_backends import MemoryBackend
+from utils.testing import MockResponse
+from utils.tokens import TokenStates
+
+_app = create_app(config_filename="test.config.json", should_log_err_to_file=False)
+
+
+class TestTokenStates(TestCase):
+    """Tests for the TokenStates"""
+
+    def setUp(self) -> None:
+        """Initialize a few common variables"""
+        self.backend = MemoryBackend(max_entries=2)
+        self.token_states = TokenStates(cache=Cache(ttl=60, backend=self.backend), retention=60)
+
+    def test_unknown_tokens_are_valid(self):
+        """Tokens that were neither issued nor rejected should be assumed to be valid"""
+        self.assertTrue(self.token_states.is_valid("some token"))
+
+    def test_issue(self):
+        """Issued tokens should be valid until they expire"""
+        self.token_states.issue("fresh", expires_in=60)
+        self.token_states.issue("expired", expires_in=-1)
+        self.assertTrue(self.token_states.is_valid("fresh"))
+        self.assertFalse(self.token_states.is_valid("expired"))
+
+    def test_reject(self):
+        """Rejected tokens should be invalid even if they were issued with a later expiry"""
+        self.token_states.issue("token", expires_in=60)
+        self.token_states.reject("token")
+        self.assertFalse(self.token_states.is_valid("token"))
+
+    def test_tokens_are_hashed_and_bounded(self):
+        """Tokens should never be stored as they are and the least recently used should be evicted"""
+        for token in ("first", "second", "third"):
+            self.token_states.reject(token)
+
+        self.assertEqual(2, len(self.backend))
+        self.assertTrue(self.token_states.is_valid("first"))
+        self.assertFalse(self.token_states.is_valid("third"))
+        self.assertIsNone(self.backend.get("third"))
+
+
+class TestTokenRejection(TestCase):
+    """Tests for the refusal of rejected and expired tokens by the app"""
+
+    def setUp(self) -> None:
+        """Initialize a few common variables"""
+        self.client = _app.test_client()
+        _app.config["CACHE"].clear()
+        _app.config["TOKEN_STATES"].clear()
+
+    @patch("requests.Session.get")
+    def test_rejected_token(self, mock_get: MagicMock):
+        """Should respond with 401 when Google rejects the token, and refuse it locally afterwards"""
+        mock_get.return_value = MockResponse(
+            data={"error": {"code": 401, "message": "Request had invalid authentication credentials."}},
+            status_code=401)
+
+        first_response = self.client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": "bad token"})
+        second_response = self.client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": "bad token"})
+
+        self.assertEqual(401, first_response.status_code)
+        self.assertEqual(401, second_response.status_code)
+        self.assertEqual({"error": "invalid or expired token"}, orjson.loads(second_response.data))
+        self.assertEqual(1, mock_get.call_count)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.post")
+    def test_expired_token(self, mock_post: MagicMock, mock_get: MagicMock):
+        """Should refuse tokens handed out by the app once they have expired, without calling Google"""
+        mock_post.return_value = MockResponse(data={
+            "access_token": "short-lived token",
+            "expires_in": -1,
+            "scope": "https://www.googleapis.com/auth/youtube.readonly",
+            "token_type": "Bearer"
+        }, status_code=200)
+
+        self.client.post("/auth/refresh-token", json={"refresh_token": "some refresh token"})
+        response = self.client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": "short-lived token"})
+
+        self.assertEqual(401, response.status_code)
+        mock_get.assert_not_called()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Module containing tests for the website service"""
+import gzip
+import os
+import re
+import shutil
+import tempfile
+from unittest import TestCase, main, skipUnless
+from unittest.mock import patch
+
+from services import create_app
+from services.website import utils
+from utils import compression
+from utils.assets import AssetManifest
+
+_app = create_app(config_filename="test.config.json", should_log_err_to_file=False)
+
+
+class TestWebsite(TestCase):
+    """Tests for the website service"""
+
+    def setUp(self) -> None:
+        """Initialize a few common variables"""
+        self.client = _app.test_client()
+
+    def test_privacy_policy(self):
+        """Should respond with the html of the privacy policy, compressed if the client accepts it"""
+        plain_response = self.client.get("/privacy-policy")
+        gzip_response = self.client.get("/privacy-policy", headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(200, plain_response.status_code)
+        self.assertEqual("text/html; charset=utf-8", plain_response.content_type)
+        self.assertIn(b"<h1>", plain_response.data)
+        self.assertEqual("gzip", gzip_response.headers["Content-Encoding"])
+        self.assertEqual(plain_response.data, gzip.decompress(gzip_response.data))
+        self.assertNotEqual(plain_response.headers["ETag"], gzip_response.headers["ETag"])
+        self.assertIn("Accept-Encoding", gzip_response.headers["Vary"])
+        self.assertEqual("public, max-age=86400", gzip_response.headers["Cache-Control"])
+
+    def test_not_modified(self):
+        """Should respond with a 304 if the client already has the current version of the page"""
+        response = self.client.get("/terms-of-service", headers={"Accept-Encoding": "gzip"})
+        etag = response.headers["ETag"]
+
+        cached_response = self.client.get(
+            "/terms-of-service", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        plain_response = self.client.get("/terms-of-service", headers={"If-None-Match": etag})
+
+        self.assertEqual(304, cached_response.status_code)
+        self.assertEqual(b"", cached_response.data)
+        self.assertEqual(etag, cached_response.headers["ETag"])
+        self.assertEqual(200, plain_response.status_code)
+
+    def test_render_markdown_is_invalidated_by_mtime(self):
+        """Should render the markdown once and again only after the file is modified"""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        file_path = os.path.join(folder, "PAGE.md")
+        with open(file_path, "w") as file:
+            file.write("# First")
+
+        with patch.object(utils, "_MARKDOWN_FOLDER", folder), \
+                patch.object(utils.markdown, "markdown", wraps=utils.markdown.markdown) as mock_markdown:
+            first = utils.render_markdown("PAGE.md")
+            self.assertIs(first, utils.render_markdown("PAGE.md"))
+
+            with open(file_path, "w") as file:
+                file.write("# Second")
+            os.utime(file_path, ns=(first.mtime + 1, first.mtime + 1))
+            second = utils.render_markdown("PAGE.md")
+
+        self.assertEqual(2, mock_markdown.call_count)
+        self.assertEqual(b"<h1>First</h1>", first.variants["identity"])
+        self.assertEqual(b"<h1>Second</h1>", second.variants["identity"])
+        self.assertNotEqual(first.etag, second.etag)
+
+    def test_assets(self):
+        """Should reference fingerprinted assets in pages and serve them precompressed with immutable caching"""
+        home_response = self.client.get("/")
+        css_url = re.search(r'href="(/assets/css/red\.[0-9a-f]+\.css)"', home_response.text).group(1)
+        logo_url = re.search(r'src="(/assets/img/logo\.[0-9a-f]+\.png)"', home_response.text).group(1)
+
+        css_response = self.client.get(css_url, headers={"Accept-Encoding": "gzip"})
+        logo_response = self.client.get(logo_url, headers={"Accept-Encoding": "gzip"})
+        cached_response = self.client.get(
+            css_url, headers={"Accept-Encoding": "gzip", "If-None-Match": css_response.headers["ETag"]})
+        missing_response = self.client.get("/assets/css/red.0000.css")
+
+        with open(os.path.join(_app.static_folder, "css", "red.css"), "rb") as file:
+            self.assertEqual(file.read(), gzip.decompress(css_response.get_data()))
+        self.assertEqual("gzip", css_response.headers["Content-Encoding"])
+        self.assertEqual("text/css; charset=utf-8", css_response.content_type)
+        self.assertEqual("public, max-age=31536000, immutable", css_response.headers["Cache-Control"])
+        self.assertNotIn("Content-Encoding", logo_response.headers)
+        self.assertEqual("image/png", logo_response.content_type)
+        self.assertEqual(304, cached_response.status_code)
+        self.assertEqual(404, missing_response.status_code)
+        self.assertIn("background-image: url(/assets/img/parallex.", home_response.text)
+        self.assertNotIn("static/", home_response.text)
+        for response in (home_response, css_response, logo_response, cached_response):
+            response.close()
+
+    def test_asset_manifest_is_rebuilt_when_stale(self):
+        """Should rebuild the manifest only if the static files or the content encodings available have changed"""
+        source = tempfile.mkdtemp()
+        build = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, build)
+        with open(os.path.join(source, "app.js"), "w") as file:
+            file.write("console.log('hi');" * 100)
+
+        manifest = AssetManifest(source_path=source, build_path=build)
+        manifest.build()
+        loaded = AssetManifest(source_path=source, build_path=build)
+        loaded.load()
+        self.assertEqual(manifest.assets, loaded.assets)
+        self.assertFalse(loaded.is_stale())
+        self.assertTrue(os.path.isfile(os.path.join(build, loaded.assets["app.js"].path + ".gz")))
+
+        with patch("utils.assets.ENCODINGS", ("gzip",)):
+            self.assertTrue(loaded.is_stale())
+
+        with open(os.path.join(source, "app.css"), "w") as file:
+            file.write("body {}")
+        self.assertTrue(loaded.is_stale())
+
+    @skipUnless(compression.brotli, "the brotli package is not installed")
+    def test_brotli_variants(self):
+        """Should serve the brotli variants of pages and assets to clients that prefer them"""
+        home_response = self.client.get("/")
+        css_url = re.search(r'href="(/assets/css/red\.[0-9a-f]+\.css)"', home_response.text).group(1)
+        plain_page_response = self.client.get("/privacy-policy")
+        page_response = self.client.get("/privacy-policy", headers={"Accept-Encoding": "gzip, br"})
+        css_response = self.client.get(css_url, headers={"Accept-Encoding": "gzip, br"})
+
+        self.assertEqual("br", page_response.headers["Content-Encoding"])
+        self.assertEqual(plain_page_response.data, compression.brotli.decompress(page_response.data))
+        self.assertEqual("br", css_response.headers["Content-Encoding"])
+        with open(os.path.join(_app.static_folder, "css", "red.css"), "rb") as file:
+            self.assertEqual(file.read(), compression.brotli.decompress(css_response.get_data()))
+        for response in (home_response, plain_page_response, page_response, css_response):
+            response.close()
+
+
+if __name__ == '__main__':
+    main()
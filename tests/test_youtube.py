@@ -1,13 +1,19 @@
 """Module containing tests for the youtube service"""
 import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase, main
 from unittest.mock import patch, MagicMock, call
+from urllib.parse import quote
+
+import orjson
 
 from services import create_app
 from services.youtube.dtos import SubscriptionListResponse, ChannelDetails, PlaylistItemListResponse
+from utils.cache import Cache, EntityCache
 from utils.testing import MockResponse
 
 _app = create_app(config_filename="test.config.json", should_log_err_to_file=False)
+_TIMEOUT = (_app.config["HTTP_CONNECT_TIMEOUT_IN_SECONDS"], _app.config["HTTP_READ_TIMEOUT_IN_SECONDS"])
 
 
 class TestYoutube(TestCase):
@@ -16,8 +22,10 @@ class TestYoutube(TestCase):
     def setUp(self) -> None:
         """Initialize a few common variables"""
         self.client = _app.test_client()
+        _app.config["CACHE"].clear()
+        _app.config["ENTITY_CACHE"].clear()
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_get_subscriptions(self, mock_get: MagicMock):
         """Should return the SubscriptionListResponse response after querying the YouTube data v3 endpoint"""
         access_token = "some dummy stuff-1"
@@ -91,11 +99,11 @@ class TestYoutube(TestCase):
         mock_get.return_value = MockResponse(data=mock_response, status_code=200)
 
         response = self.client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": access_token})
-        mock_get.assert_called_with(expected_url, headers=expected_headers)
+        mock_get.assert_called_with(expected_url, headers=expected_headers, timeout=_TIMEOUT)
         self.assertEqual(200, response.status_code)
         self.assertEqual(expected_response, response.json)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_cached_get_subscriptions(self, mock_get: MagicMock):
         """Should return the cached response as long as TTL is not exceeded"""
         access_token = "some dummy stuff-2"
@@ -199,9 +207,9 @@ class TestYoutube(TestCase):
                                                            headers={"X-YouHedge-Token": access_token})
 
         calls = [
-            call(expected_url, headers=expected_headers),
-            call(expected_url, headers=other_headers),
-            call(expected_url, headers=expected_headers),
+            call(expected_url, headers=expected_headers, timeout=_TIMEOUT),
+            call(expected_url, headers=other_headers, timeout=_TIMEOUT),
+            call(expected_url, headers=expected_headers, timeout=_TIMEOUT),
         ]
         mock_get.assert_has_calls(calls=calls)
         self.assertEqual(200, old_headers_response.status_code)
@@ -211,7 +219,32 @@ class TestYoutube(TestCase):
         self.assertEqual(expected_old_response, old_headers_response.json)
         self.assertEqual(expected_updated_response, old_headers_after_sleep_response.json)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
+    def test_stale_get_subscriptions(self, mock_get: MagicMock):
+        """Should serve the stale response right away while it is being refreshed in the background"""
+        access_token = "some dummy stuff-4"
+        first_mock_response = {"items": [], "nextPageToken": "first"}
+        second_mock_response = {"items": [], "nextPageToken": "second"}
+
+        with patch.dict(_app.config, {"CACHE": Cache(ttl=1, stale_ttl=60)}):
+            mock_get.return_value = MockResponse(data=first_mock_response, status_code=200)
+            first_response = self.client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": access_token})
+
+            # wait for the response to become stale
+            time.sleep(1.1)
+            mock_get.return_value = MockResponse(data=second_mock_response, status_code=200)
+            stale_response = self.client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": access_token})
+
+            # wait for the background refresh
+            time.sleep(0.2)
+            refreshed_response = self.client.get("/youtube/subscriptions", headers={"X-YouHedge-Token": access_token})
+
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual(first_mock_response, first_response.json)
+        self.assertEqual(first_mock_response, stale_response.json)
+        self.assertEqual(second_mock_response, refreshed_response.json)
+
+    @patch("requests.Session.get")
     def test_get_channel_details(self, mock_get: MagicMock):
         """Should return the ChannelDetailsResponse response after querying the YouTube data v3 endpoint"""
         access_token = "some dummy stuff-1"
@@ -265,16 +298,16 @@ class TestYoutube(TestCase):
         }
         expected_response = ChannelDetails(**mock_response["items"][0]).dict(exclude_unset=True)
         expected_headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
-        expected_url = f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails&id={channel_id}&key=TEST_GOOGLE_API_KEY"
+        expected_url = f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails&id={quote(channel_id, safe='')}&key=TEST_GOOGLE_API_KEY"
 
         mock_get.return_value = MockResponse(data=mock_response, status_code=200)
 
         response = self.client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": access_token})
-        mock_get.assert_called_with(expected_url, headers=expected_headers)
+        mock_get.assert_called_with(expected_url, headers=expected_headers, timeout=_TIMEOUT)
         self.assertEqual(200, response.status_code)
         self.assertEqual(expected_response, response.json)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_cached_get_channel_details(self, mock_get: MagicMock):
         """Should return the cached ChannelDetailsResponse response for the given request if TTL is not yet exceeded."""
         access_token = "some dummy stuff-2"
@@ -380,8 +413,8 @@ class TestYoutube(TestCase):
         expected_headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
         expected_updated_headers = {"Accept": "application/json", "Authorization": f"Bearer {other_access_token}"}
         expected_updated_headers = {"Accept": "application/json", "Authorization": f"Bearer {other_access_token}"}
-        expected_url = f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails&id={channel_id}&key=TEST_GOOGLE_API_KEY"
-        expected_updated_url = f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails&id={other_channel_id}&key=TEST_GOOGLE_API_KEY"
+        expected_url = f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails&id={quote(channel_id, safe='')}&key=TEST_GOOGLE_API_KEY"
+        expected_updated_url = f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails&id={quote(other_channel_id, safe='')}&key=TEST_GOOGLE_API_KEY"
 
         mock_get.return_value = MockResponse(data=first_mock_response, status_code=200)
         self.client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": access_token})
@@ -402,9 +435,9 @@ class TestYoutube(TestCase):
         old_headers_after_sleep_response = self.client.get(f"/youtube/channels/{channel_id}",
                                                            headers={"X-YouHedge-Token": access_token})
         calls = [
-            call(expected_url, headers=expected_headers),
-            call(expected_updated_url, headers=expected_updated_headers),
-            call(expected_url, headers=expected_headers),
+            call(expected_url, headers=expected_headers, timeout=_TIMEOUT),
+            call(expected_updated_url, headers=expected_updated_headers, timeout=_TIMEOUT),
+            call(expected_url, headers=expected_headers, timeout=_TIMEOUT),
         ]
         mock_get.assert_has_calls(calls=calls)
         self.assertEqual(200, old_headers_response.status_code)
@@ -414,7 +447,307 @@ class TestYoutube(TestCase):
         self.assertEqual(expected_old_response, old_headers_response.json)
         self.assertEqual(expected_updated_response, old_headers_after_sleep_response.json)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
+    def test_coalesced_get_channel_details(self, mock_get: MagicMock):
+        """Should call the YouTube data v3 endpoint only once for concurrent requests that miss the cache"""
+        access_token = "some dummy stuff-3"
+        channel_id = "a coalesced channel id"
+        mock_response = {
+            "items": [
+                {
+                    "id": channel_id,
+                    "snippet": {
+                        "title": "Yoooo Mahn",
+                        "description": "",
+                        "thumbnails": {"default": {"url": "https://yt3.ggpht.com/ytc/gha"}},
+                    },
+                    "contentDetails": {"relatedPlaylists": {"uploads": "eyuryejhhrje"}}
+                }
+            ]
+        }
+        expected_response = ChannelDetails(**mock_response["items"][0]).dict(exclude_unset=True)
+        flights = _app.config["SINGLE_FLIGHT"]
+        coalesced_before = flights.coalesced
+
+        def slow_get(*args, **kwargs):
+            time.sleep(0.5)
+            return MockResponse(data=mock_response, status_code=200)
+
+        mock_get.side_effect = slow_get
+
+        def get_channel():
+            return _app.test_client().get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": access_token})
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            responses = list(executor.map(lambda _: get_channel(), range(5)))
+
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(4, flights.coalesced - coalesced_before)
+        for response in responses:
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(expected_response, response.json)
+
+    @patch("requests.Session.get")
+    def test_get_channels_details(self, mock_get: MagicMock):
+        """Should request only the channels that are not yet in the cache, in batches of 50 ids"""
+        access_token = "some dummy stuff-6"
+
+        def channel(channel_id: str):
+            return {
+                "id": channel_id,
+                "snippet": {
+                    "title": f"Channel {channel_id}",
+                    "description": "",
+                    "thumbnails": {"default": {"url": f"https://yt3.ggpht.com/ytc/{channel_id}"}},
+                },
+                "contentDetails": {"relatedPlaylists": {"uploads": f"uploads-{channel_id}"}}
+            }
+
+        first_ids = [f"batch-channel-{i}" for i in range(52)]
+        second_ids = ["batch-channel-51", "batch-channel-52"]
+        url_prefix = "https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails"
+        expected_headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
+        mock_get.side_effect = [
+            MockResponse(data={"items": [channel(i) for i in first_ids[:50]]}, status_code=200),
+            MockResponse(data={"items": [channel(i) for i in first_ids[50:]]}, status_code=200),
+            MockResponse(data={"items": [channel("batch-channel-52")]}, status_code=200),
+        ]
+
+        first_response = self.client.get("/youtube/channels", query_string={"ids": ",".join(first_ids)},
+                                         headers={"X-YouHedge-Token": access_token})
+        second_response = self.client.get("/youtube/channels", query_string={"ids": ",".join(second_ids)},
+                                          headers={"X-YouHedge-Token": access_token})
+
+        mock_get.assert_has_calls([
+            call(f"{url_prefix}&id={'%2C'.join(first_ids[:50])}&maxResults=50&key=TEST_GOOGLE_API_KEY",
+                 headers=expected_headers, timeout=_TIMEOUT),
+            call(f"{url_prefix}&id={'%2C'.join(first_ids[50:])}&maxResults=50&key=TEST_GOOGLE_API_KEY",
+                 headers=expected_headers, timeout=_TIMEOUT),
+            call(f"{url_prefix}&id=batch-channel-52&maxResults=50&key=TEST_GOOGLE_API_KEY",
+                 headers=expected_headers, timeout=_TIMEOUT),
+        ])
+        self.assertEqual(3, mock_get.call_count)
+        self.assertEqual(200, first_response.status_code)
+        self.assertEqual({"items": [channel(i) for i in first_ids]}, first_response.json)
+        self.assertEqual(200, second_response.status_code)
+        self.assertEqual({"items": [channel(i) for i in second_ids]}, second_response.json)
+
+    @patch("requests.Session.get")
+    def test_get_channels_details_limits_and_quotes_ids(self, mock_get: MagicMock):
+        """Should refuse more ids than YOUTUBE_MAX_CHANNEL_IDS and quote each id in the URL sent to YouTube"""
+        access_token = "some dummy stuff-7"
+        max_channel_ids = _app.config["YOUTUBE_MAX_CHANNEL_IDS"]
+        mock_get.return_value = MockResponse(data={"items": []}, status_code=200)
+
+        too_many_response = self.client.get(
+            "/youtube/channels", query_string={"ids": ",".join(f"c-{i}" for i in range(max_channel_ids + 1))},
+            headers={"X-YouHedge-Token": access_token})
+        quoted_response = self.client.get(
+            "/youtube/channels", query_string={"ids": "a&key=other,b c"}, headers={"X-YouHedge-Token": access_token})
+
+        self.assertEqual(400, too_many_response.status_code)
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(200, quoted_response.status_code)
+        self.assertEqual({"items": []}, quoted_response.json)
+        self.assertIn("&id=a%26key%3Dother%2Cb%20c&", mock_get.call_args.args[0])
+
+    @patch("requests.Session.get")
+    def test_ids_and_page_tokens_are_quoted(self, mock_get: MagicMock):
+        """Should quote the channel id, the playlist id and the page token so that they cannot add query parameters"""
+        headers = {"X-YouHedge-Token": "some dummy stuff-8"}
+        mock_get.return_value = MockResponse(data={"items": []}, status_code=200)
+
+        self.client.get("/youtube/channels/x%26key%3Dother", query_string={"pageToken": "t&maxResults=1"},
+                        headers=headers)
+        channel_url = mock_get.call_args.args[0]
+        self.client.get("/youtube/playlist-items/UUx%26key%3Dother", query_string={"pageToken": "t&maxResults=1"},
+                        headers=headers)
+        playlist_url = mock_get.call_args.args[0]
+
+        for url in (channel_url, playlist_url):
+            self.assertIn("x%26key%3Dother&key=TEST_GOOGLE_API_KEY&pageToken=t%26maxResults%3D1", url)
+
+    @patch("requests.Session.get")
+    def test_shared_get_channel_details(self, mock_get: MagicMock):
+        """Should fetch the details of a channel only once for all users until the TTL of channels elapses"""
+        channel_id = "a shared channel id"
+        mock_response = {
+            "items": [
+                {
+                    "id": channel_id,
+                    "snippet": {
+                        "title": "Yoooo Mahn",
+                        "description": "",
+                        "thumbnails": {"default": {"url": "https://yt3.ggpht.com/ytc/gha"}},
+                    },
+                    "contentDetails": {"relatedPlaylists": {"uploads": "eyuryejhhrje"}}
+                }
+            ]
+        }
+        expected_response = ChannelDetails(**mock_response["items"][0]).dict(exclude_unset=True)
+        mock_get.return_value = MockResponse(data=mock_response, status_code=200)
+
+        first_response = self.client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": "user-1"})
+        second_response = self.client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": "user-2"})
+
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(expected_response, first_response.json)
+        self.assertEqual(expected_response, second_response.json)
+
+    @patch("requests.Session.get")
+    def test_revalidated_get_channel_details(self, mock_get: MagicMock):
+        """Should revalidate a stale channel with its ETag and reuse it if YouTube responds with a 304"""
+        channel_id = "a revalidated channel id"
+        mock_response = {
+            "etag": "channel-list-etag",
+            "items": [
+                {
+                    "id": channel_id,
+                    "etag": "channel-etag",
+                    "snippet": {
+                        "title": "Yoooo Mahn",
+                        "description": "",
+                        "thumbnails": {"default": {"url": "https://yt3.ggpht.com/ytc/gha"}},
+                    },
+                    "contentDetails": {"relatedPlaylists": {"uploads": "eyuryejhhrje"}}
+                }
+            ]
+        }
+        expected_response = ChannelDetails(**mock_response["items"][0]).dict(exclude_unset=True)
+        expected_url = f"https://youtube.googleapis.com/youtube/v3/channels?part=snippet%2CcontentDetails&id={quote(channel_id, safe='')}&key=TEST_GOOGLE_API_KEY"
+        expected_headers = {
+            "Accept": "application/json",
+            "Authorization": "Bearer user-2",
+            "If-None-Match": "channel-list-etag",
+        }
+        mock_get.side_effect = [
+            MockResponse(data=mock_response, status_code=200),
+            MockResponse(data={}, status_code=304),
+        ]
+        entity_cache = EntityCache(cache=Cache(ttl=60, stale_ttl=60), ttls={"channel": 1})
+
+        with patch.dict(_app.config, {"ENTITY_CACHE": entity_cache}):
+            first_response = self.client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": "user-1"})
+            time.sleep(1.1)
+            second_response = self.client.get(f"/youtube/channels/{channel_id}",
+                                              headers={"X-YouHedge-Token": "user-2"})
+
+        mock_get.assert_called_with(expected_url, headers=expected_headers, timeout=_TIMEOUT)
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual(expected_response, first_response.json)
+        self.assertEqual(200, second_response.status_code)
+        self.assertEqual(expected_response, second_response.json)
+        # the ETags of YouTube are kept in the cache for revalidation only
+        self.assertNotIn("etag", first_response.json)
+
+    @patch("requests.Session.get")
+    def test_conditional_get_channel_details(self, mock_get: MagicMock):
+        """Should respond with an ETag and a 304 with no body to requests whose If-None-Match matches it"""
+        channel_id = "a conditional channel id"
+        mock_response = {
+            "items": [
+                {
+                    "id": channel_id,
+                    "snippet": {
+                        "title": "Yoooo Mahn",
+                        "description": "",
+                        "thumbnails": {"default": {"url": "https://yt3.ggpht.com/ytc/gha"}},
+                    },
+                    "contentDetails": {"relatedPlaylists": {"uploads": "eyuryejhhrje"}}
+                }
+            ]
+        }
+        mock_get.return_value = MockResponse(data=mock_response, status_code=200)
+        headers = {"X-YouHedge-Token": "user-1"}
+
+        first_response = self.client.get(f"/youtube/channels/{channel_id}", headers=headers)
+        etag = first_response.headers["ETag"]
+        second_response = self.client.get(f"/youtube/channels/{channel_id}", headers={**headers, "If-None-Match": etag})
+        third_response = self.client.get(f"/youtube/channels/{channel_id}",
+                                         headers={**headers, "If-None-Match": '"other"'})
+
+        self.assertEqual(200, first_response.status_code)
+        self.assertIn("private", first_response.headers["Cache-Control"])
+        self.assertEqual(304, second_response.status_code)
+        self.assertEqual(b"", second_response.get_data())
+        self.assertEqual(200, third_response.status_code)
+        self.assertEqual(first_response.get_data(), third_response.get_data())
+
+    @patch("requests.Session.get")
+    def test_max_age_of_cached_channel_details(self, mock_get: MagicMock):
+        """Should let clients keep cached responses only for as long as they stay fresh in the cache"""
+        channel_id = "an aging channel id"
+        mock_response = {
+            "items": [
+                {
+                    "id": channel_id,
+                    "snippet": {
+                        "title": "Yoooo Mahn",
+                        "description": "",
+                        "thumbnails": {"default": {"url": "https://yt3.ggpht.com/ytc/gha"}},
+                    },
+                    "contentDetails": {"relatedPlaylists": {"uploads": "eyuryejhhrje"}}
+                }
+            ]
+        }
+        mock_get.return_value = MockResponse(data=mock_response, status_code=200)
+        headers = {"X-YouHedge-Token": "user-1"}
+        ttl = _app.config["CACHE_TTL_IN_SECONDS"]
+
+        first_response = self.client.get(f"/youtube/channels/{channel_id}", headers=headers)
+        with patch("time.time", return_value=time.time() + ttl / 2):
+            second_response = self.client.get(f"/youtube/channels/{channel_id}", headers=headers)
+
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(ttl, first_response.cache_control.max_age)
+        self.assertEqual(int(ttl / 2), second_response.cache_control.max_age)
+
+    @patch("requests.Session.get")
+    def test_raw_bytes_get_channel_details(self, mock_get: MagicMock):
+        """Should decode the raw bytes from YouTube only once and respond with just the declared fields"""
+        channel_id = "a raw channel id"
+        upstream_response = MagicMock(status_code=200, ok=True, content=(
+            b'{"kind":"youtube#channelListResponse","items":[{"kind":"youtube#channel","id":"a raw channel id",'
+            b'"snippet":{"title":"Caf\xc3\xa9","description":"","customUrl":"@cafe",'
+            b'"thumbnails":{"default":{"url":"https://yt3.ggpht.com/ytc/gha"}}},'
+            b'"contentDetails":{"relatedPlaylists":{"likes":"","uploads":"eyuryejhhrje"}}}]}'))
+        upstream_response.json.side_effect = AssertionError("the body should not be decoded by requests")
+        mock_get.return_value = upstream_response
+
+        response = self.client.get(f"/youtube/channels/{channel_id}", headers={"X-YouHedge-Token": "user-1"})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            b'{"id":"a raw channel id","snippet":{"title":"Caf\xc3\xa9","description":"",'
+            b'"thumbnails":{"default":{"url":"https://yt3.ggpht.com/ytc/gha"}}},'
+            b'"contentDetails":{"relatedPlaylists":{"uploads":"eyuryejhhrje"}}}',
+            response.get_data())
+
+    @patch("requests.Session.get")
+    def test_private_playlist_videos_are_not_shared(self, mock_get: MagicMock):
+        """Should share the items of uploads playlists among users but never those of their private playlists"""
+        def page(title: str):
+            return {"items": [{"id": f"item-{title}", "snippet": {
+                "title": title, "description": "", "thumbnails": {}, "position": 0,
+                "resourceId": {"videoId": f"video-{title}"}}}]}
+
+        mock_get.side_effect = [MockResponse(data=page(title), status_code=200)
+                                for title in ("liked by 1", "liked by 2", "uploads")]
+
+        first_likes_response = self.client.get("/youtube/playlist-items/LL", headers={"X-YouHedge-Token": "user-1"})
+        second_likes_response = self.client.get("/youtube/playlist-items/LL", headers={"X-YouHedge-Token": "user-2"})
+        first_uploads_response = self.client.get(
+            "/youtube/playlist-items/UUshared", headers={"X-YouHedge-Token": "user-1"})
+        second_uploads_response = self.client.get(
+            "/youtube/playlist-items/UUshared", headers={"X-YouHedge-Token": "user-2"})
+
+        self.assertEqual(3, mock_get.call_count)
+        self.assertEqual(page("liked by 1"), first_likes_response.json)
+        self.assertEqual(page("liked by 2"), second_likes_response.json)
+        self.assertEqual(page("uploads"), first_uploads_response.json)
+        self.assertEqual(page("uploads"), second_uploads_response.json)
+
+    @patch("requests.Session.get")
     def test_get_playlist_videos(self, mock_get: MagicMock):
         """Should return the PlaylistItemListResponse response after querying the YouTube data v3 endpoint"""
         access_token = "some dummy stuff-1"
@@ -502,16 +835,16 @@ class TestYoutube(TestCase):
         }
         expected_response = PlaylistItemListResponse(**mock_response).dict(exclude_unset=True)
         expected_headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
-        expected_url = f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&playlistId={playlist_id}&key=TEST_GOOGLE_API_KEY"
+        expected_url = f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&playlistId={quote(playlist_id, safe='')}&key=TEST_GOOGLE_API_KEY"
 
         mock_get.return_value = MockResponse(data=mock_response, status_code=200)
 
         response = self.client.get(f"/youtube/playlist-items/{playlist_id}", headers={"X-YouHedge-Token": access_token})
-        mock_get.assert_called_with(expected_url, headers=expected_headers)
+        mock_get.assert_called_with(expected_url, headers=expected_headers, timeout=_TIMEOUT)
         self.assertEqual(200, response.status_code)
         self.assertEqual(expected_response, response.json)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_cached_get_playlist_videos(self, mock_get: MagicMock):
         """Should return the cached PlaylistItemListResponse response for the given request if TTL is not yet exceeded"""
         access_token = "some dummy stuff-2"
@@ -610,8 +943,8 @@ class TestYoutube(TestCase):
         expected_updated_response = PlaylistItemListResponse(**second_mock_response).dict(exclude_unset=True)
         expected_headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
         expected_updated_headers = {"Accept": "application/json", "Authorization": f"Bearer {other_access_token}"}
-        expected_url = f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&playlistId={playlist_id}&key=TEST_GOOGLE_API_KEY"
-        expected_updated_url = f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&playlistId={other_playlist_id}&key=TEST_GOOGLE_API_KEY"
+        expected_url = f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&playlistId={quote(playlist_id, safe='')}&key=TEST_GOOGLE_API_KEY"
+        expected_updated_url = f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&playlistId={quote(other_playlist_id, safe='')}&key=TEST_GOOGLE_API_KEY"
 
         mock_get.return_value = MockResponse(data=first_mock_response, status_code=200)
         self.client.get(f"/youtube/playlist-items/{playlist_id}", headers={"X-YouHedge-Token": access_token})
@@ -632,9 +965,9 @@ class TestYoutube(TestCase):
         old_headers_after_sleep_response = self.client.get(f"/youtube/playlist-items/{playlist_id}",
                                                            headers={"X-YouHedge-Token": access_token})
         calls = [
-            call(expected_url, headers=expected_headers),
-            call(expected_updated_url, headers=expected_updated_headers),
-            call(expected_url, headers=expected_headers),
+            call(expected_url, headers=expected_headers, timeout=_TIMEOUT),
+            call(expected_updated_url, headers=expected_updated_headers, timeout=_TIMEOUT),
+            call(expected_url, headers=expected_headers, timeout=_TIMEOUT),
         ]
         mock_get.assert_has_calls(calls=calls)
         self.assertEqual(200, old_headers_response.status_code)
@@ -644,6 +977,47 @@ class TestYoutube(TestCase):
         self.assertEqual(expected_old_response, old_headers_response.json)
         self.assertEqual(expected_updated_response, old_headers_after_sleep_response.json)
 
+    @patch("requests.Session.get")
+    def test_stream_playlist_videos(self, mock_get: MagicMock):
+        """Should stream the items of all pages of the playlist as newline-delimited JSON, up to maxItems"""
+        access_token = "some dummy stuff-5"
+        playlist_id = "a streamed playlist id"
+
+        def item(index: int):
+            return {
+                "id": f"item-{index}",
+                "snippet": {
+                    "title": f"Video {index}",
+                    "description": "",
+                    "thumbnails": {"default": {"url": f"https://i.ytimg.com/vi/{index}/default.jpg"}},
+                    "position": index,
+                    "resourceId": {"videoId": f"video-{index}"},
+                },
+            }
+
+        pages = [
+            {"nextPageToken": "page-2", "items": [item(0), item(1)]},
+            {"nextPageToken": "page-3", "items": [item(2), item(3)]},
+            {"items": [item(4)]},
+        ]
+        expected_url = f"https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&playlistId={quote(playlist_id, safe='')}&key=TEST_GOOGLE_API_KEY"
+        expected_headers = {"Accept": "application/json", "Authorization": f"Bearer {access_token}"}
+        mock_get.side_effect = [MockResponse(data=page, status_code=200) for page in pages]
+
+        response = self.client.get(f"/youtube/playlist-items/{playlist_id}",
+                                   query_string={"stream": "", "maxItems": 3},
+                                   headers={"X-YouHedge-Token": access_token})
+        lines = response.get_data().splitlines()
+
+        mock_get.assert_has_calls([
+            call(f"{expected_url}&maxResults=50", headers=expected_headers, timeout=_TIMEOUT),
+            call(f"{expected_url}&maxResults=50&pageToken=page-2", headers=expected_headers, timeout=_TIMEOUT),
+        ])
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/x-ndjson", response.mimetype)
+        self.assertEqual([item(0), item(1), item(2)], [orjson.loads(line) for line in lines])
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,202 @@
+"""
+Module containing the pipeline of static assets i.e. a manifest of fingerprinted copies of the static files,
+with their precompressed variants, that are served with immutable caching headers
+"""
+import mimetypes
+import os
+import sys
+import tempfile
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import orjson
+from flask import Flask, current_app, request, url_for, Response
+from werkzeug.exceptions import NotFound
+from werkzeug.wsgi import wrap_file
+
+from utils.compression import precompress, negotiate, strong_etag, IDENTITY, ENCODINGS
+
+MANIFEST_FILENAME = "manifest.json"
+
+# the suffixes of the files of the precompressed variants of each asset
+_SUFFIXES = {"gzip": ".gz", "br": ".br", "zstd": ".zst"}
+# the types of files that are worth compressing, others like images being compressed already
+_COMPRESSIBLE_TYPES = frozenset(("application/javascript", "application/json", "image/svg+xml", "image/x-icon",
+                                 "image/vnd.microsoft.icon", "text/javascript"))
+# fingerprinted assets never change so they can be cached for as long as browsers allow
+_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class Asset(NamedTuple):
+    """
+    A static file as copied into the build folder under a path fingerprinted with its content, the size of
+    each of its variants by content encoding, the modification time of the source it was built from
+    and the content encodings it was compressed with, if it is worth compressing
+    """
+    path: str
+    etag: str
+    mimetype: str
+    sizes: Dict[str, int]
+    mtime: int
+    encodings: Tuple[str, ...] = ()
+
+
+class AssetManifest:
+    """
+    The fingerprinted assets built from the files in source_path into build_path, by their paths relative
+    to source_path. The manifest is built by `python -m utils.assets <source_path> <build_path>`,
+    or when the app starts if it is missing or any source file has changed since it was built.
+    Assets are served at '/assets/<fingerprinted path>' in the best content encoding the client accepts,
+    by the WSGI server's file wrapper, which is sendfile under uwsgi, and templates get their URLs from `asset_url`
+    """
+
+    def __init__(self, source_path: str, build_path: str):
+        self.source_path = source_path
+        self.build_path = build_path
+        self.assets: Dict[str, Asset] = {}
+        self._by_path: Dict[str, Asset] = {}
+
+    def init_app(self, app: Flask):
+        """Loads or builds the manifest, registers the route of the assets and the asset_url template global"""
+        self.load()
+        if self.is_stale():
+            self.build()
+
+        app.add_url_rule("/assets/<path:filename>", endpoint="assets", view_func=self.send)
+        app.add_template_global(self.url_for, name="asset_url")
+
+    def load(self):
+        """Loads the manifest from the build folder, if it has been built"""
+        try:
+            with open(os.path.join(self.build_path, MANIFEST_FILENAME), "rb") as file:
+                data = orjson.loads(file.read())
+        except FileNotFoundError:
+            data = {}
+
+        self._set_assets({name: Asset(**{**value, "encodings": tuple(value.get("encodings", ()))})
+                          for name, value in data.items()})
+
+    def is_stale(self) -> bool:
+        """
+        Returns whether any file has been added to, modified in or removed from the source folder since the build,
+        or whether the content encodings available have changed since, say when the Brotli package was installed
+        """
+        sources = _list_files(self.source_path)
+        if sources.keys() != self.assets.keys():
+            return True
+
+        return any(asset.mtime != sources[name]
+                   or asset.encodings != (ENCODINGS if _is_compressible(asset.mimetype) else ())
+                   for name, asset in self.assets.items())
+
+    def build(self):
+        """
+        Copies every file in the source folder to the build folder under a path fingerprinted with its content,
+        along with its precompressed variants, and writes the manifest
+        """
+        assets = {}
+        for name, mtime in _list_files(self.source_path).items():
+            with open(os.path.join(self.source_path, name), "rb") as file:
+                body = file.read()
+
+            etag = strong_etag(body)
+            root, ext = os.path.splitext(name)
+            path = f"{root}.{etag[:12]}{ext}"
+            mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            encodings = ENCODINGS if _is_compressible(mimetype) else ()
+            variants = precompress(body, encodings)
+            for encoding, content in variants.items():
+                _write_atomically(os.path.join(self.build_path, path + _SUFFIXES.get(encoding, "")), content)
+
+            sizes = {encoding: len(content) for encoding, content in variants.items()}
+            assets[name] = Asset(
+                path=path, etag=etag, mimetype=mimetype, sizes=sizes, mtime=mtime, encodings=encodings)
+
+        _write_atomically(
+            os.path.join(self.build_path, MANIFEST_FILENAME),
+            orjson.dumps({name: asset._asdict() for name, asset in assets.items()}, option=orjson.OPT_INDENT_2))
+        self._set_assets(assets)
+
+    def url_for(self, filename: str) -> str:
+        """Returns the URL of the fingerprinted asset of the given static file, or of the file itself if it has none"""
+        asset = self.assets.get(filename, None)
+        if asset is None:
+            return url_for("static", filename=filename)
+
+        return url_for("assets", filename=asset.path)
+
+    def send(self, filename: str) -> Response:
+        """Responds with the variant of the given fingerprinted asset in the best content encoding the client accepts"""
+        asset = self._by_path.get(filename, None)
+        if asset is None:
+            raise NotFound()
+
+        encoding = negotiate(request.accept_encodings, [e for e in ENCODINGS if e in asset.sizes])
+        etag = asset.etag if encoding == IDENTITY else f"{asset.etag}-{encoding}"
+
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            file = open(os.path.join(self.build_path, asset.path + _SUFFIXES.get(encoding, "")), "rb")
+            response = current_app.response_class(
+                wrap_file(request.environ, file), mimetype=asset.mimetype, direct_passthrough=True)
+            response.content_length = asset.sizes[encoding]
+            if encoding != IDENTITY:
+                response.headers["Content-Encoding"] = encoding
+
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.max_age = _MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    def _set_assets(self, assets: Dict[str, Asset]):
+        self.assets = assets
+        self._by_path = {asset.path: asset for asset in assets.values()}
+
+
+def _is_compressible(mimetype: str) -> bool:
+    """Returns whether files of the given mimetype are worth compressing"""
+    return mimetype.startswith("text/") or mimetype in _COMPRESSIBLE_TYPES
+
+
+def _list_files(folder: str) -> Dict[str, int]:
+    """Returns the modification times of all files in the folder by their paths relative to it, with '/' separators"""
+    files = {}
+    for root, _dirs, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            files[os.path.relpath(path, folder).replace(os.sep, "/")] = os.stat(path).st_mtime_ns
+
+    return files
+
+
+def _write_atomically(path: str, content: bytes):
+    """Writes the content to a temporary file that is then renamed to the given path, so that no one reads half of it"""
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def main(argv: Optional[list] = None):
+    """Builds the manifest of the assets in the source folder into the build folder, given as arguments"""
+    args = sys.argv[1:] if argv is None else argv
+    if len(args) != 2:
+        print("usage: python -m utils.assets <source_path> <build_path>")
+        sys.exit(1)
+
+    manifest = AssetManifest(source_path=args[0], build_path=args[1])
+    manifest.build()
+    print(f"built {len(manifest.assets)} assets into {args[1]}")
+
+
+if __name__ == "__main__":
+    main()
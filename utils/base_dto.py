@@ -1,30 +1,63 @@
-import orjson
+from typing import Any, Dict, Union
+
 from flask import Flask
-from pydantic import BaseModel
-from pydantic.utils import ROOT_KEY
+from pydantic import BaseModel, ConfigDict
+
+from utils.instrumentation import phase, SERIALIZATION
 
 
-def orjson_dumps(v, *, default):
-    """orjson.dumps returns bytes, to match standard json.dumps we need to decode"""
-    return orjson.dumps(v, default=default).decode()
+def jsonify_bytes(app: Flask, data: bytes):
+    """Wraps the given JSON bytes in a response to be returned in a Flask view"""
+    return app.response_class(data, mimetype=app.config.get("JSONIFY_MIMETYPE") or "application/json")
 
 
 class BaseDto(BaseModel):
-    class Config:
-        json_loads = orjson.loads
-        json_dumps = orjson_dumps
-        arbitrary_types_allowed = True
+    """
+    The base of all DTOs, validated and serialized by pydantic's compiled core.
+    It keeps the pydantic v1 methods that the rest of the code calls i.e. validate, parse_raw and dict
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @classmethod
+    def validate(cls, value: Any) -> "BaseDto":
+        """Validates the given python object, say decoded JSON, into an instance of this DTO"""
+        return cls.model_validate(value)
+
+    @classmethod
+    def parse_raw(cls, data: Union[str, bytes]) -> "BaseDto":
+        """Validates the given JSON string or bytes into an instance of this DTO"""
+        return cls.model_validate_json(data)
+
+    def dict(self, **kwargs) -> Dict[str, Any]:
+        """Returns the fields of this DTO as a dictionary, taking the same options as model_dump"""
+        return self.model_dump(**kwargs)
 
     def jsonify(self, app: Flask):
         """Jsonifies the DTO to be returned in a Flask view"""
-        return app.response_class(self.bjson(), mimetype=app.config["JSONIFY_MIMETYPE"])
+        return jsonify_bytes(app, self.bjson())
 
     def bjson(self) -> bytes:
         """
-        Generate a JSON representation of the model as bytes not as string compared to self.json(),
+        Generate a JSON representation of the model as bytes not as string compared to self.model_dump_json(),
         """
-        data = self.dict(exclude_unset=True)
-        if self.__custom_root_type__:
-            data = data[ROOT_KEY]
+        with phase(SERIALIZATION):
+            return self.__pydantic_serializer__.to_json(self, exclude_unset=True)
+
 
-        return orjson.dumps(data, default=self.__json_encoder__)
+class RawJson:
+    """
+    JSON that is already serialized, say from the cache.
+    It can be returned by clients in place of a BaseDto so that views can jsonify it without re-serializing it
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def jsonify(self, app: Flask):
+        """Jsonifies the JSON to be returned in a Flask view"""
+        return jsonify_bytes(app, self.data)
+
+    def bjson(self) -> bytes:
+        """Returns the JSON as bytes"""
+        return self.data
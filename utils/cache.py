@@ -1,74 +1,241 @@
 """Module containing utilities to cache requests basing on headers, url and data"""
-from datetime import datetime, timedelta
-from io import BytesIO
-from typing import Dict, Any, Tuple, Optional
+import hashlib
+import time
+from typing import Any, Optional, Dict, Iterable, NamedTuple, Tuple, Type, Callable
 
-from flask import request, Request, has_request_context, Response
+from flask import Request, Response
 
+from utils.cache_backends import CacheBackend, CacheEntry, MemoryBackend
 
-def get_req_id(req: Request) -> str:
+_SEPARATOR = b"\0"
+_BODYLESS_METHODS = frozenset(("GET", "HEAD"))
+
+# the headers that identify the user of the request
+DEFAULT_KEY_HEADERS = ("X-YouHedge-Token",)
+# the only response headers that are kept in the cache
+_CACHED_HEADERS = frozenset(("content-type", "content-encoding", "content-language", "cache-control", "etag", "vary"))
+
+
+def get_req_id(
+        req: Request,
+        headers: Iterable[str] = DEFAULT_KEY_HEADERS,
+        query_args: Optional[Iterable[str]] = None) -> str:
     """
-    returns a request id constructed from the url, method, query params, headers and body
+    returns a fixed-size request id hashed from the method, the path, the sorted query args
+    and the given headers. Only the query args named in query_args are considered if it is not None.
+    The body is only read for methods other than GET and HEAD, and it is left unconsumed
     """
-    body = read_request_body_without_consuming_it(req)
-    return f"{req.url}{req.query_string}{req.method}{body}{req.headers}"
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(req.method.encode())
+    hasher.update(_SEPARATOR)
+    hasher.update(req.path.encode("utf-8", "surrogateescape"))
+
+    if query_args is not None:
+        query_args = frozenset(query_args)
+
+    for name, value in sorted(req.args.items(multi=True)):
+        if query_args is None or name in query_args:
+            hasher.update(_SEPARATOR)
+            hasher.update(f"{name}={value}".encode("utf-8", "surrogateescape"))
+
+    for name in headers:
+        hasher.update(_SEPARATOR)
+        hasher.update(req.headers.get(name, "").encode("utf-8", "surrogateescape"))
 
+    if req.method not in _BODYLESS_METHODS:
+        hasher.update(_SEPARATOR)
+        # get_data(cache=True) keeps the body around for the view to read later
+        hasher.update(req.get_data(cache=True))
 
-def read_request_body_without_consuming_it(req: Request) -> bytes:
+    return hasher.hexdigest()
+
+
+class CachedResponse(NamedTuple):
     """
-    Reads the body of a request without consuming it so that future calls to request.data
-    don't get surprised at any empty string
+    An immutable record of a response that is kept in the cache in place of the response itself.
+    It holds the status, the few headers in _CACHED_HEADERS and the body as bytes
+    so it is small, and it can be pickled for backends shared by many processes
     """
-    length = int(req.environ.get('CONTENT_LENGTH') or 0)
-    body = req.environ['wsgi.input'].read(length)
-    req.environ['body_copy'] = body
-    # replace the stream since it was exhausted by read()
-    req.environ['wsgi.input'] = BytesIO(body)
-    return req.environ['body_copy']
+    status: int
+    headers: Tuple[Tuple[str, str], ...]
+    body: bytes
+
+    @classmethod
+    def from_response(cls, response: Response) -> "CachedResponse":
+        """Creates a record from the given response, adding a strong ETag computed from the body if it has none"""
+        body = response.get_data()
+        headers = tuple((k, v) for k, v in response.headers.items() if k.lower() in _CACHED_HEADERS)
+        if "ETag" not in response.headers:
+            headers += (("ETag", f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'),)
+
+        return cls(status=response.status_code, headers=headers, body=body)
+
+    def to_response(self, response_class: Type[Response] = Response) -> Response:
+        """Creates a new response from the record, without copying its body"""
+        return response_class(self.body, status=self.status, headers=self.headers)
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate number of bytes used up by the record"""
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers)
+
+
+class CachedEntity(NamedTuple):
+    """An upstream resource kept in the cache as JSON bytes together with its ETag, if any, for revalidation"""
+    etag: Optional[str]
+    body: bytes
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate number of bytes used up by the entity"""
+        return len(self.body) + len(self.etag or "")
 
 
 class Cache:
-    """The cache is basically a dictionary in memory whose values have time-to-live (TTL)"""
+    """
+    The cache is a store of values that have a time-to-live (TTL).
+    After the ttl, values become stale, and they are kept for stale_ttl more seconds
+    so that they can be served while they are being refreshed.
+    If ttl_factor is given, all TTLs are multiplied by what it returns when values are set, say to keep
+    values longer when the upstream quota is running low.
+    The values are kept in a backend, by default a bounded LRU store in the memory of the current process
+    """
 
-    def __init__(self, ttl: int):
-        self._data: Dict[str, Tuple[Any, datetime]] = {}
-        self._ttl: timedelta = timedelta(seconds=ttl)
+    def __init__(
+            self,
+            ttl: int,
+            stale_ttl: int = 0,
+            backend: Optional[CacheBackend] = None,
+            ttl_factor: Optional[Callable[[], float]] = None):
+        self._ttl = float(ttl)
+        self._ttl_factor = ttl_factor
+        self._stale_ttl = float(stale_ttl)
+        self._backend = backend if backend is not None else MemoryBackend()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    @property
+    def ttl(self) -> float:
+        """The number of seconds after which values become stale"""
+        return self._ttl if self._ttl_factor is None else self._ttl * self._ttl_factor()
 
     def __getitem__(self, item: Any) -> Optional[Any]:
         """
         Returns the value corresponding to the given item or key.
         It is None if it is older that ttl or if it does not exist
         """
-        value: Optional[Tuple[Any, datetime]] = self._data.get(item, None)
-        if value is None:
+        value, is_stale = self.lookup(item)
+        return None if is_stale else value
+
+    def __setitem__(self, key, value):
+        """Sets a given key value in the cache with its new start time"""
+        self.set(key, value)
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None):
+        """Sets a given key value in the cache, to become stale after ttl seconds, if given, instead of the default"""
+        if ttl is None:
+            ttl = self._ttl
+        if self._ttl_factor is not None:
+            ttl *= self._ttl_factor()
+
+        stale_at = time.time() + ttl
+        self._backend.set(key, value, stale_at=stale_at, expires_at=stale_at + self._stale_ttl)
+
+    def lookup(self, key: Any) -> Tuple[Optional[Any], bool]:
+        """
+        Returns the value corresponding to the given key and whether it is stale i.e. older than ttl.
+        The value is None if it is older than ttl + stale_ttl or if it does not exist
+        """
+        entry = self.lookup_entry(key)
+        if entry is None:
+            return None, False
+
+        return entry.value, entry.stale_at <= time.time()
+
+    def lookup_entry(self, key: Any) -> Optional[CacheEntry]:
+        """
+        Returns the entry of the given key, with the times at which it becomes stale and expires.
+        It is None if it is older than ttl + stale_ttl or if it does not exist
+        """
+        entry: Optional[CacheEntry] = self._backend.get(key)
+        if entry is None:
+            self.misses += 1
             return None
 
-        if (datetime.now() - value[1]) > self._ttl:
-            del self._data[item]
+        now = time.time()
+        if entry.expires_at <= now:
+            self._backend.delete(key)
+            self.misses += 1
             return None
 
-        return value[0]
+        if entry.stale_at <= now:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
 
-    def __setitem__(self, key, value):
-        """Sets a given key value in the cache with its new start time"""
-        self._data[key] = (value, datetime.now())
+        return entry
+
+    def __len__(self) -> int:
+        return len(self._backend)
 
-    def get_view(self, view, *args, **kwargs):
-        """Gets the cached response of the view if it exists"""
-        if has_request_context():
-            request_id = get_req_id(request)
-            value = self[request_id]
+    def load(self, view, req_id: str, *args, **kwargs) -> CachedResponse:
+        """
+        Calls the view and returns the record of its response.
+        Only successful responses whose bodies are already in memory are saved in the cache
+        """
+        response: Response = view(*args, **kwargs)
+        record = CachedResponse.from_response(response)
+        if record.status < 400 and not response.is_streamed:
+            self[req_id] = record
 
-            if value is None:
-                value: Response = view(*args, **kwargs)
-                if value.status_code < 400:
-                    # save only successful requests
-                    self[request_id] = value
+        return record
 
-            return value
+    def sweep(self):
+        """Removes all expired entries from the cache"""
+        self._backend.sweep(time.time())
 
-        return view(*args, **kwargs)
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters of the cache for monitoring"""
+        return dict(hits=self.hits, stale_hits=self.stale_hits, misses=self.misses, **self._backend.stats())
 
     def clear(self):
         """Clears all the data in the cache"""
-        self._data.clear()
+        self._backend.clear()
+
+
+class EntityCache:
+    """
+    A cache of upstream resources, say YouTube channels, that are the same for all users.
+    Entries are keyed by the type of the resource and its ids, and each type has its own TTL.
+    Stale entries are kept for the stale_ttl of the underlying cache so that they can be revalidated upstream
+    """
+
+    def __init__(self, cache: Cache, ttls: Dict[str, float]):
+        self._cache = cache
+        self._ttls = ttls
+
+    def get(self, kind: str, *ids: str) -> Optional[Any]:
+        """Returns the resource of the given type and ids if it is in the cache"""
+        return self._cache[self._get_key(kind, ids)]
+
+    def lookup(self, kind: str, *ids: str) -> Tuple[Optional[Any], bool]:
+        """Returns the resource of the given type and ids if it is in the cache, and whether it is stale"""
+        return self._cache.lookup(self._get_key(kind, ids))
+
+    def set(self, kind: str, *ids: str, value: Any):
+        """Saves the resource of the given type and ids in the cache for the TTL of its type"""
+        self._cache.set(self._get_key(kind, ids), value, ttl=self._ttls.get(kind, None))
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters of the cache for monitoring"""
+        return self._cache.stats()
+
+    def clear(self):
+        """Clears all the data in the cache"""
+        self._cache.clear()
+
+    @staticmethod
+    def _get_key(kind: str, ids: Tuple[str, ...]) -> str:
+        """Returns the key of the resource of the given type and ids"""
+        return "\0".join((kind, *ids))
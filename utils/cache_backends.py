@@ -0,0 +1,307 @@
+"""Module containing the storage backends that the Cache can keep its entries in"""
+import os
+import pickle
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional, Dict, Iterable
+
+# rough number of bytes used up by the bookkeeping of each entry i.e. the key, the entry object and the dict slot
+_ENTRY_OVERHEAD_IN_BYTES = 200
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Returns a cheap estimate of the number of bytes the given value occupies in memory.
+    Byte strings are measured by their length, values with an nbytes attribute, say cached responses,
+    by that attribute and anything else by its shallow size
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+
+    return sys.getsizeof(value)
+
+
+class CacheEntry:
+    """
+    A single value in the cache together with its size, the (epoch) time it becomes stale at
+    and the (epoch) time it expires at
+    """
+    __slots__ = ("value", "stale_at", "expires_at", "size")
+
+    def __init__(self, value: Any, stale_at: float, expires_at: float, size: int = 0):
+        self.value = value
+        self.stale_at = stale_at
+        self.expires_at = expires_at
+        self.size = size
+
+
+class CacheBackend(ABC):
+    """The interface of the stores that hold the entries of the Cache"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Returns the entry of the given key, whether expired or not, or None if it does not exist"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, expires_at: float, stale_at: Optional[float] = None):
+        """
+        Saves the value under the given key, to expire at the given epoch time.
+        It becomes stale at stale_at if given or else when it expires
+        """
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Removes the entry of the given key if it exists"""
+
+    @abstractmethod
+    def sweep(self, now: float):
+        """Removes all entries that have expired by the given epoch time"""
+
+    @abstractmethod
+    def clear(self):
+        """Removes all entries"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters of the backend for monitoring"""
+
+
+class MemoryBackend(CacheBackend):
+    """
+    A bounded least-recently-used (LRU) store in the memory of the current process.
+    Once it has more than max_entries entries or more than max_size_in_bytes bytes, the least recently
+    used entries are evicted. Expired entries are removed by a sweep that runs at most once every
+    sweep_interval seconds on writes.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 10000,
+            max_size_in_bytes: int = 64 * 1024 * 1024,
+            sweep_interval: int = 60):
+        self._data: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._max_entries = max_entries
+        self._max_size_in_bytes = max_size_in_bytes
+        self._sweep_interval = float(sweep_interval)
+        self._next_sweep_at = time.time() + self._sweep_interval
+        self._size_in_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._data.get(key, None)
+        if entry is not None:
+            self._data.move_to_end(key)
+
+        return entry
+
+    def set(self, key: str, value: Any, expires_at: float, stale_at: Optional[float] = None):
+        now = time.time()
+        if now >= self._next_sweep_at:
+            self.sweep(now)
+
+        size = estimate_size(value) + _ENTRY_OVERHEAD_IN_BYTES
+        if size > self._max_size_in_bytes:
+            # it would evict everything else and still not fit
+            return
+
+        self.delete(key)
+        self._data[key] = CacheEntry(
+            value=value,
+            stale_at=expires_at if stale_at is None else stale_at,
+            expires_at=expires_at,
+            size=size)
+        self._size_in_bytes += size
+
+        while len(self._data) > self._max_entries or self._size_in_bytes > self._max_size_in_bytes:
+            oldest_key = next(iter(self._data))
+            self.delete(oldest_key)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._size_in_bytes -= entry.size
+
+    def sweep(self, now: float):
+        expired_keys = [key for key, entry in self._data.items() if entry.expires_at <= now]
+        for key in expired_keys:
+            self.delete(key)
+
+        self.expirations += len(expired_keys)
+        self._next_sweep_at = now + self._sweep_interval
+
+    def clear(self):
+        self._data.clear()
+        self._size_in_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            evictions=self.evictions,
+            expirations=self.expirations,
+            entries=len(self._data),
+            size_in_bytes=self._size_in_bytes,
+        )
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SqliteConnection:
+    """
+    The connection to an SQLite file, in WAL mode, opened on first use in each process with the given schema
+    statements, say CREATE TABLE IF NOT EXISTS. Connections are not shared across forks so each worker opens its own
+    """
+
+    def __init__(self, path: str, schema: Iterable[str] = ()):
+        self._path = path
+        self._schema = tuple(schema)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def get(self) -> sqlite3.Connection:
+        """Returns the connection of the current process, opening it if it does not exist"""
+        pid = os.getpid()
+        if self._conn is None or self._pid != pid:
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self._schema:
+                conn.execute(statement)
+            self._conn = conn
+            self._pid = pid
+
+        return self._conn
+
+
+class SqliteBackend(CacheBackend):
+    """
+    A bounded store in a table of an SQLite file that is shared by all processes, say uWSGI workers,
+    that point to the same file and table. Values are pickled. When it has more than max_entries entries or more than max_size_in_bytes bytes,
+    the oldest written entries are evicted. Trimming and sweeping of expired entries are amortized:
+    they run at most once every sweep_interval seconds or once every trim_interval writes
+    """
+
+    def __init__(
+            self,
+            path: str,
+            table: str = "cache",
+            max_entries: int = 10000,
+            max_size_in_bytes: int = 64 * 1024 * 1024,
+            sweep_interval: int = 60,
+            trim_interval: int = 100):
+        self._table = table
+        self._max_entries = max_entries
+        self._max_size_in_bytes = max_size_in_bytes
+        self._sweep_interval = float(sweep_interval)
+        self._trim_interval = trim_interval
+        self._next_sweep_at = time.time() + self._sweep_interval
+        self._writes_since_trim = 0
+        self._db = SqliteConnection(path, schema=(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, stale_at REAL NOT NULL, expires_at REAL NOT NULL, "
+            "written_at REAL NOT NULL, size INTEGER NOT NULL)",
+            f"CREATE INDEX IF NOT EXISTS {table}_written_at ON {table} (written_at)",
+        ))
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection to the SQLite file of this process"""
+        return self._db.get()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        row = self.conn.execute(
+            f"SELECT value, stale_at, expires_at, size FROM {self._table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        return CacheEntry(value=pickle.loads(row[0]), stale_at=row[1], expires_at=row[2], size=row[3])
+
+    def set(self, key: str, value: Any, expires_at: float, stale_at: Optional[float] = None):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(data) + _ENTRY_OVERHEAD_IN_BYTES
+        if size > self._max_size_in_bytes:
+            return
+
+        now = time.time()
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {self._table} (key, value, stale_at, expires_at, written_at, size) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, data, expires_at if stale_at is None else stale_at, expires_at, now, size))
+
+        self._writes_since_trim += 1
+        if now >= self._next_sweep_at:
+            self.sweep(now)
+        elif self._writes_since_trim >= self._trim_interval:
+            self._trim()
+
+    def delete(self, key: str):
+        self.conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+
+    def sweep(self, now: float):
+        cursor = self.conn.execute(f"DELETE FROM {self._table} WHERE expires_at <= ?", (now,))
+        self.expirations += max(cursor.rowcount, 0)
+        self._next_sweep_at = now + self._sweep_interval
+        self._trim()
+
+    def clear(self):
+        self.conn.execute(f"DELETE FROM {self._table}")
+
+    def stats(self) -> Dict[str, int]:
+        entries, size_in_bytes = self.conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self._table}").fetchone()
+        return dict(
+            evictions=self.evictions,
+            expirations=self.expirations,
+            entries=entries,
+            size_in_bytes=size_in_bytes,
+        )
+
+    def __len__(self) -> int:
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    def _trim(self):
+        """Evicts the oldest written entries until the store is within its bounds"""
+        self._writes_since_trim = 0
+        entries, size_in_bytes = self.conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self._table}").fetchone()
+        if entries <= self._max_entries and size_in_bytes <= self._max_size_in_bytes:
+            return
+
+        excess_entries = max(entries - self._max_entries, 0)
+        excess_bytes = max(size_in_bytes - self._max_size_in_bytes, 0)
+        removed_entries = 0
+        removed_bytes = 0
+        keys = []
+        for key, size in self.conn.execute(f"SELECT key, size FROM {self._table} ORDER BY written_at"):
+            if removed_entries >= excess_entries and removed_bytes >= excess_bytes:
+                break
+
+            keys.append((key,))
+            removed_entries += 1
+            removed_bytes += size
+
+        self.conn.executemany(f"DELETE FROM {self._table} WHERE key = ?", keys)
+        self.evictions += len(keys)
+
+
+def create_backend(name: str, **options) -> CacheBackend:
+    """Creates the cache backend of the given name i.e. 'memory' or 'sqlite'"""
+    if name == "memory":
+        options.pop("path", None)
+        options.pop("table", None)
+        return MemoryBackend(**options)
+
+    if name == "sqlite":
+        return SqliteBackend(**options)
+
+    raise ValueError(f"unknown cache backend '{name}'")
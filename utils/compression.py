@@ -0,0 +1,148 @@
+"""Module containing the helpers to compress response bodies and to pick the encoding a client accepts"""
+import gzip
+import hashlib
+from typing import Dict, Iterable, Optional
+
+from flask import Flask, request, Response
+from werkzeug.datastructures import Accept
+
+from utils.cache import Cache
+from utils.instrumentation import phase, SERIALIZATION
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+IDENTITY = "identity"
+GZIP = "gzip"
+BROTLI = "br"
+ZSTD = "zstd"
+
+# the content encodings that can be produced in this environment, in order of preference
+ENCODINGS = tuple(encoding for encoding, module in ((BROTLI, brotli), (ZSTD, zstandard), (GZIP, gzip))
+                  if module is not None)
+
+# the highest levels of compression, for bodies that are compressed once and served many times
+_MAX_LEVELS = {GZIP: 9, BROTLI: 11, ZSTD: 19}
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Compresses the body with the given content encoding, at its highest level if none is given"""
+    if level is None:
+        level = _MAX_LEVELS[encoding]
+
+    if encoding == GZIP:
+        # the mtime is fixed so that the same body is always compressed to the same bytes
+        return gzip.compress(body, compresslevel=level, mtime=0)
+
+    if encoding == BROTLI and brotli is not None:
+        return brotli.compress(body, quality=level)
+
+    if encoding == ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(body)
+
+    raise ValueError(f"unsupported content encoding '{encoding}'")
+
+
+def precompress(body: bytes, encodings: Iterable[str] = ENCODINGS) -> Dict[str, bytes]:
+    """
+    Returns the variants of the body in each of the given content encodings, the identity included.
+    Variants that are no smaller than the body are left out
+    """
+    variants = {IDENTITY: body}
+    for encoding in encodings:
+        compressed = compress(body, encoding)
+        if len(compressed) < len(body):
+            variants[encoding] = compressed
+
+    return variants
+
+
+def negotiate(accept_encodings: Accept, encodings: Iterable[str]) -> str:
+    """
+    Returns the best of the given content encodings that the client accepts, as given by its Accept-Encoding header,
+    or the identity if it accepts none of them
+    """
+    return accept_encodings.best_match(tuple(encodings)) or IDENTITY
+
+
+def strong_etag(body: bytes) -> str:
+    """Returns an entity tag that changes whenever any byte of the body does"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class ResponseCompressor:
+    """
+    Compresses the bodies of responses of the given mimetypes, say application/json, that are at least min_size
+    bytes long, in the best content encoding the client accepts, at the level given for it in levels.
+    Responses with an ETag, say those of cached views, get one ETag per encoding and their compressed bodies
+    are kept in the given cache, apart from the responses themselves, by ETag and encoding so that they are compressed
+    once until they change
+    """
+
+    def __init__(
+            self,
+            min_size: int = 1024,
+            levels: Optional[Dict[str, int]] = None,
+            mimetypes: Iterable[str] = ("application/json",),
+            cache: Optional[Cache] = None,
+            encodings: Iterable[str] = ENCODINGS):
+        self.min_size = min_size
+        self.levels = levels or {}
+        self.mimetypes = frozenset(mimetypes)
+        self.cache = cache
+        self.encodings = tuple(encodings)
+
+    def init_app(self, app: Flask):
+        """Registers the hook that compresses responses on the app"""
+        app.after_request(self.compress_response)
+
+    def compress_response(self, response: Response) -> Response:
+        """Compresses the body of the given response if it is worth it and the client accepts it"""
+        if (response.status_code != 200
+                or response.mimetype not in self.mimetypes
+                or response.is_streamed
+                or response.direct_passthrough
+                or "Content-Encoding" in response.headers):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        if response.content_length is None or response.content_length < self.min_size:
+            return response
+
+        encoding = negotiate(request.accept_encodings, self.encodings)
+        if encoding == IDENTITY:
+            return response
+
+        etag, is_weak = response.get_etag()
+        with phase(SERIALIZATION):
+            body = self._compress(response.get_data(), encoding, etag)
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        if etag is not None:
+            response.set_etag(f"{etag}-{encoding}", weak=is_weak)
+            if request.if_none_match:
+                # a client that has the compressed body gets a 304 as it would for the uncompressed one
+                response.make_conditional(request)
+
+        return response
+
+    def _compress(self, body: bytes, encoding: str, etag: Optional[str]) -> bytes:
+        """Compresses the body, or gets it from the cache if a body of the same ETag was compressed already"""
+        if self.cache is None or etag is None:
+            return compress(body, encoding, self.levels.get(encoding, None))
+
+        key = f"{etag}\0{encoding}"
+        compressed: Optional[bytes] = self.cache[key]
+        if compressed is None:
+            compressed = compress(body, encoding, self.levels.get(encoding, None))
+            self.cache[key] = compressed
+
+        return compressed
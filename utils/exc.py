@@ -20,3 +20,10 @@ class APIException(Exception):
 
     def __str__(self) -> str:
         return f"{self.__class__.__name__} {self.to_dict()}"
+
+
+class UpstreamUnavailable(APIException):
+    """Raised when an upstream API cannot be reached, keeps failing, or is being failed fast by a circuit breaker"""
+
+    def __init__(self, message: str = "upstream service unavailable", payload: Any = None):
+        super().__init__(message=message, status_code=503, payload=payload)
@@ -0,0 +1,223 @@
+"""Module containing the HTTP client shared by all calls to upstream APIs"""
+import logging
+import time
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Any, Optional, List, NamedTuple, Callable, Iterable
+from urllib.parse import urlsplit
+
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.exc import UpstreamUnavailable
+from utils.resilience import RetryPolicy, CircuitBreakers, RETRY_STATUSES
+
+
+class UpstreamCall(NamedTuple):
+    """The record of a call to an upstream API, as passed to the hooks of the HttpClient"""
+    method: str
+    # the host and path of the url, without the query string that may hold keys
+    endpoint: str
+    # None if no response was received, say on a timeout
+    status_code: Optional[int]
+    started_at: float
+    duration: float
+    bytes_sent: int
+    bytes_received: int
+    retries: int
+    # the estimated units of the upstream API's quota spent by the call
+    quota_cost: int
+    error: Optional[Exception] = None
+
+
+UpstreamHook = Callable[[UpstreamCall], None]
+
+
+class HttpClient:
+    """
+    An HTTP client that keeps pools of keep-alive connections to the upstream hosts so that
+    calls after the first do not pay for a new TCP and TLS handshake.
+    Its connection pools are thread-safe, and thus greenlet-safe when gevent monkey-patches the standard library.
+    Every call has a connect timeout and a read timeout.
+    If a retry policy is given, GET calls, being idempotent, are retried on request errors, say connection
+    errors, timeouts or connections reset mid-body, and on the transient statuses of the policy,
+    by default 429 and 5xx.
+    If circuit breakers are given, calls to an endpoint that keeps failing are failed fast.
+    Calls that still fail raise an UpstreamUnavailable.
+    Each hook is called with the UpstreamCall record of every call, say to record metrics or traces.
+    Errors raised by hooks are logged to the given logger and never fail the call
+    """
+
+    def __init__(
+            self,
+            pool_connections: int = 10,
+            pool_maxsize: int = 100,
+            connect_timeout: float = 5,
+            read_timeout: float = 30,
+            hooks: Iterable[UpstreamHook] = (),
+            retry_policy: Optional[RetryPolicy] = None,
+            circuit_breakers: Optional[CircuitBreakers] = None,
+            logger: Optional[logging.Logger] = None):
+        self._timeout = (connect_timeout, read_timeout)
+        self._logger = logger if logger is not None else logging.getLogger(__name__)
+        self._retry_policy = retry_policy
+        # the statuses of failed calls that are likely transient, so are retried and reported as UpstreamUnavailable
+        self._retry_statuses = retry_policy.statuses if retry_policy is not None else RETRY_STATUSES
+        self.circuit_breakers = circuit_breakers
+        self._hooks: List[UpstreamHook] = list(hooks)
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=False)
+        self._session = requests.Session()
+        # the session is shared by all users so no cookie should leak from one call to the next
+        self._session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+    def add_hook(self, hook: UpstreamHook):
+        """Registers a function to be called with the record of every call"""
+        self._hooks.append(hook)
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, quota_cost: int = 0) -> requests.Response:
+        """Sends a GET request to the given url. quota_cost is the estimated cost of the call to the API's quota"""
+        return self._send("GET", url, headers=headers, quota_cost=quota_cost)
+
+    def post(
+            self,
+            url: str,
+            data: Optional[Dict[str, Any]] = None,
+            headers: Optional[Dict[str, str]] = None,
+            quota_cost: int = 0) -> requests.Response:
+        """
+        Sends a POST request with the given form data to the given url.
+        quota_cost is the estimated cost of the call to the API's quota
+        """
+        return self._send("POST", url, data=data, headers=headers, quota_cost=quota_cost)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Returns the metrics of each connection pool i.e. one per upstream host"""
+        pools = self._adapter.poolmanager.pools
+        return [
+            dict(
+                host=pool.host,
+                connections_opened=pool.num_connections,
+                requests=pool.num_requests,
+                # the pool's queue is padded with None for connections not yet opened
+                idle_connections=sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+            )
+            for pool in (pools[key] for key in pools.keys())
+        ]
+
+    def close(self):
+        """Closes all pooled connections"""
+        self._session.close()
+
+    def _send(self, method: str, url: str, quota_cost: int, data: Optional[Dict[str, Any]] = None, **kwargs):
+        """
+        Sends the request with the session, retrying it and failing it fast as configured,
+        and passes the record of the call to the hooks
+        """
+        send = self._session.get if method == "GET" else self._session.post
+        if data is not None:
+            kwargs["data"] = data
+
+        parts = urlsplit(url)
+        endpoint = f"{parts.netloc}{parts.path}"
+        breaker = self.circuit_breakers.get(endpoint) if self.circuit_breakers is not None else None
+        if breaker is not None and not breaker.allow():
+            raise UpstreamUnavailable(payload=dict(endpoint=endpoint, circuit="open"))
+
+        started_at = time.time()
+        start = time.perf_counter()
+        response: Optional[requests.Response] = None
+        error: Optional[Exception] = None
+        attempts = 0
+        responses = 0
+        succeeded = False
+        try:
+            while True:
+                response, error = None, None
+                attempts += 1
+                try:
+                    response = send(url, timeout=self._timeout, **kwargs)
+                    responses += 1
+                except requests.exceptions.RequestException as exp:
+                    error = exp
+
+                if error is None and response.status_code not in self._retry_statuses:
+                    break
+
+                delay = self._get_retry_delay(method, attempts - 1, response)
+                if delay is None:
+                    break
+
+                time.sleep(delay)
+
+            if error is not None:
+                raise UpstreamUnavailable(payload=dict(endpoint=endpoint, error=str(error))) from error
+
+            if response.status_code in self._retry_statuses:
+                raise UpstreamUnavailable(payload=dict(endpoint=endpoint, status_code=response.status_code))
+
+            succeeded = True
+            return response
+        except Exception as exp:
+            error = exp
+            raise
+        finally:
+            # every way out records the outcome, so that a half-open circuit never waits on its trial forever
+            if breaker is not None:
+                if succeeded:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+
+            if self._hooks:
+                call = UpstreamCall(
+                    method=method,
+                    endpoint=endpoint,
+                    status_code=response.status_code if response is not None else None,
+                    started_at=started_at,
+                    duration=time.perf_counter() - start,
+                    bytes_sent=_get_bytes_sent(response),
+                    bytes_received=len(response.content) if response is not None else 0,
+                    retries=attempts - 1 + _get_retries(response),
+                    # every attempt that got a response spent the quota
+                    quota_cost=quota_cost * responses,
+                    error=error,
+                )
+                for hook in self._hooks:
+                    # metrics and accounting are best-effort, say when a shared store is locked
+                    try:
+                        hook(call)
+                    except Exception as exp:
+                        self._logger.error(f"upstream call hook {hook!r} failed: {exp!r}")
+
+    def _get_retry_delay(self, method: str, attempt: int, response: Optional[requests.Response]) -> Optional[float]:
+        """Returns the seconds to wait before retrying the failed attempt, or None if it should not be retried"""
+        if self._retry_policy is None or method != "GET":
+            return None
+
+        retry_after = response.headers.get("Retry-After", None) if response is not None else None
+        return self._retry_policy.get_delay(attempt, retry_after=retry_after)
+
+
+def load_json(response: requests.Response) -> Any:
+    """
+    Decodes the JSON body of the given response straight from its bytes with orjson,
+    skipping the text decoding and encoding detection of response.json()
+    """
+    return orjson.loads(response.content)
+
+
+def _get_bytes_sent(response: Optional[requests.Response]) -> int:
+    """Returns the size of the body of the request of the given response"""
+    body = getattr(getattr(response, "request", None), "body", None)
+    if isinstance(body, str):
+        body = body.encode()
+
+    return len(body) if isinstance(body, bytes) else 0
+
+
+def _get_retries(response: Optional[requests.Response]) -> int:
+    """Returns the number of times the request of the given response was retried by urllib3"""
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    return len(getattr(retries, "history", None) or ())
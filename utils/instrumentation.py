@@ -0,0 +1,175 @@
+"""
+Module containing the per-route instrumentation of the app i.e. the time spent in each phase of a request,
+split by the outcome of the cache, and an optional sampling profiler
+"""
+import contextlib
+import cProfile
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from flask import Flask, g, has_request_context, request, Response
+
+from utils.http import UpstreamCall
+from utils.metrics import MetricsRegistry
+
+# the phases of a request that are timed, besides the total
+REQ_ID = "req_id"
+CACHE_LOOKUP = "cache_lookup"
+UPSTREAM = "upstream"
+VALIDATION = "validation"
+SERIALIZATION = "serialization"
+HANDLER = "handler"
+WRITE = "write"
+PHASES = (REQ_ID, CACHE_LOOKUP, UPSTREAM, VALIDATION, SERIALIZATION, HANDLER, WRITE)
+
+# the outcomes of the cache for a request
+CACHE_HIT = "hit"
+CACHE_STALE = "stale"
+CACHE_MISS = "miss"
+CACHE_BYPASS = "bypass"
+CACHE_NONE = "none"
+CACHE_STATUSES = (CACHE_HIT, CACHE_STALE, CACHE_MISS, CACHE_BYPASS, CACHE_NONE)
+
+# the buckets, in seconds, of the durations of requests and of their phases
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_UNMATCHED = "unmatched"
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """
+    Adds the time spent in the block to the given phase of the current request.
+    It does nothing outside a request or if the request is not instrumented, say in a background refresh
+    """
+    phases = _get_phases()
+    if phases is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def set_cache_status(status: str):
+    """Records the outcome of the cache, one of CACHE_STATUSES, for the current request"""
+    if has_request_context():
+        g._cache_status = status
+
+
+class RequestMetrics:
+    """
+    Records the duration of every request and of its phases per route i.e. view endpoint and per outcome
+    of the cache. Durations are measured with a monotonic clock from before_request until the response
+    has been written, and the histogram buckets of all routes are allocated when it is registered
+    """
+
+    def __init__(self, registry: MetricsRegistry, namespace: str = "youhedge"):
+        self.duration = registry.histogram(
+            f"{namespace}_request_duration_seconds",
+            "Duration of requests from their start until their response is written",
+            ("endpoint", "cache"),
+            buckets=REQUEST_BUCKETS)
+        self.phase_duration = registry.histogram(
+            f"{namespace}_request_phase_duration_seconds",
+            "Duration of each phase of requests",
+            ("endpoint", "phase", "cache"),
+            buckets=REQUEST_BUCKETS)
+
+    def init_app(self, app: Flask):
+        """Registers the hooks on the app. It should be called after all blueprints are registered"""
+        self.prepare(endpoints=[*app.view_functions.keys(), _UNMATCHED])
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def prepare(self, endpoints: Iterable[str]):
+        """Allocates the histogram buckets of the given endpoints so that no request has to"""
+        for endpoint in endpoints:
+            for cache_status in CACHE_STATUSES:
+                self.duration.prepare(endpoint=endpoint, cache=cache_status)
+                for name in PHASES:
+                    self.phase_duration.prepare(endpoint=endpoint, phase=name, cache=cache_status)
+
+    def record_upstream(self, call: UpstreamCall):
+        """A hook of the HttpClient that adds the time spent calling upstream APIs to the current request"""
+        phases = _get_phases()
+        if phases is not None:
+            phases[UPSTREAM] = phases.get(UPSTREAM, 0.0) + call.duration
+
+    @staticmethod
+    def _before_request():
+        g._request_start = time.perf_counter()
+        g._request_phases = {}
+
+    def _after_request(self, response: Response) -> Response:
+        start: Optional[float] = g.get("_request_start", None)
+        if start is None:
+            return response
+
+        handled_at = time.perf_counter()
+        endpoint = request.endpoint or _UNMATCHED
+        cache_status = g.get("_cache_status", CACHE_NONE)
+        phases: Dict[str, float] = g._request_phases
+        phases[HANDLER] = handled_at - start
+
+        def record():
+            now = time.perf_counter()
+            phases[WRITE] = now - handled_at
+            self.duration.observe(now - start, endpoint=endpoint, cache=cache_status)
+            for name, duration in phases.items():
+                self.phase_duration.observe(duration, endpoint=endpoint, phase=name, cache=cache_status)
+
+        response.call_on_close(record)
+        return response
+
+
+class RequestProfiler:
+    """
+    Profiles a random sample of requests with cProfile, at most one at a time per process,
+    and dumps the stats of each to '<endpoint>-<timestamp>.prof' in the given folder, to be read with pstats.
+    Under gevent, the profile of a request also covers any other greenlets that run while it waits on I/O
+    """
+
+    def __init__(self, sample_rate: float, path: str):
+        self.sample_rate = sample_rate
+        self.path = path
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask):
+        """Registers the hooks on the app if the sample rate is above zero"""
+        if self.sample_rate <= 0:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        if random.random() >= self.sample_rate or not self._lock.acquire(blocking=False):
+            return
+
+        profile = cProfile.Profile()
+        g._profile = profile
+        profile.enable()
+
+    def _teardown_request(self, _exc: Optional[BaseException]):
+        profile: Optional[cProfile.Profile] = g.get("_profile", None)
+        if profile is None:
+            return
+
+        profile.disable()
+        g._profile = None
+        self._lock.release()
+        endpoint = request.endpoint or _UNMATCHED
+        profile.dump_stats(os.path.join(self.path, f"{endpoint}-{time.time_ns()}.prof"))
+
+
+def _get_phases() -> Optional[Dict[str, float]]:
+    """Returns the durations of the phases of the current request or None if it is not instrumented"""
+    return g.get("_request_phases", None) if has_request_context() else None
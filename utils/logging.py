@@ -1,15 +1,27 @@
 """Module containing the utility functions for logging"""
 
+import _thread
+import collections
+import contextlib
 import gzip
-import itertools
 import logging
 import os
+import queue
+import re
 import shutil
 import sys
+import threading
+import time
+import traceback
 from logging.handlers import RotatingFileHandler
+from typing import Any, Iterable, Optional, Dict
 
 from flask import has_request_context, request
 
+# the record that tells the writer of a BoundedQueueHandler to stop
+_STOP = logging.makeLogRecord({})
+_EXCEPTION_FORMATTER = logging.Formatter()
+
 
 class RequestFormatter(logging.Formatter):
     """Formatter injects in safe details connected to the request"""
@@ -19,8 +31,9 @@ class RequestFormatter(logging.Formatter):
             record.url = request.url
             record.remote_addr = request.remote_addr
         else:
-            record.url = None
-            record.remote_addr = None
+            # records handed over by a BoundedQueueHandler already have the details of their request
+            record.url = getattr(record, "url", None)
+            record.remote_addr = getattr(record, "remote_addr", None)
 
         return super().format(record)
 
@@ -29,9 +42,32 @@ class RotatingGzipFileHandler(RotatingFileHandler):
     """
     This rotating file handler class compresses past logs and saves them
     in ascending order whereby .1 is the first back up and say .2 is after .1
+    On rollover, the log is atomically renamed to the next back up, '<log>.<n>', which is then compressed
+    to '<log>.<n>.gz' in a background thread so that the request that triggered the rollover does not wait on it.
+    The next back up number is found once, when the handler is created, and back ups left uncompressed,
+    say by a crash, are compressed then. If backupCount is above 0, only that many back ups are kept,
+    and if max_age is given, back ups older than max_age seconds are removed
     Courtesy of https://stackoverflow.com/questions/40150821/in-the-logging-modules-rotatingfilehandler-how-to-set-the-backupcount-to-a-pra#answer-53288524
     """
 
+    def __init__(
+            self,
+            filename: str,
+            mode: str = "a",
+            maxBytes: int = 0,
+            backupCount: int = 0,
+            encoding: Optional[str] = None,
+            delay: bool = False,
+            max_age: Optional[float] = None):
+        super().__init__(filename, mode=mode, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding,
+                         delay=delay)
+        self.max_age = max_age
+        backups = self._list_backups()
+        self._next_backup = max(backups.keys(), default=0) + 1
+        for path in backups.values():
+            if not path.endswith(".gz"):
+                _start_background_thread(self._compress, path)
+
     def doRollover(self):
         """Method to create the next log, and save the last log"""
         if self.stream:
@@ -39,65 +75,349 @@ class RotatingGzipFileHandler(RotatingFileHandler):
             self.stream = None
 
         # start of override
-        for i in itertools.count(1):
-            next_log_name = f"{self.baseFilename}.{i}.gz"
-
-            if not os.path.exists(next_log_name):
-                with open(self.baseFilename, 'rb') as original_log:
-                    # gzip old log with a number at its end
-                    with gzip.open(next_log_name, 'wb') as gzipped_log:
-                        shutil.copyfileobj(original_log, gzipped_log)
+        backup = f"{self.baseFilename}.{self._next_backup}"
+        # other processes logging to the same file may have taken the cached number already
+        while os.path.exists(backup) or os.path.exists(f"{backup}.gz"):
+            self._next_backup += 1
+            backup = f"{self.baseFilename}.{self._next_backup}"
 
-                os.remove(self.baseFilename)
-                break
+        try:
+            os.replace(self.baseFilename, backup)
+        except FileNotFoundError:
+            pass
+        else:
+            self._next_backup += 1
+            _start_background_thread(self._compress, backup)
 
         # end of override
         if not self.delay:
             self.stream = self._open()
 
+    def _compress(self, path: str):
+        """Gzips the given back up, removes it, then removes the back ups that are past the retention limits"""
+        try:
+            with open(path, 'rb') as original_log:
+                # gzip old log with a number at its end, renaming it only once it is complete
+                with gzip.open(f"{path}.gz.tmp", 'wb') as gzipped_log:
+                    shutil.copyfileobj(original_log, gzipped_log)
 
-def setup_rotating_file_logger(
-        logger: logging.Logger,
+            os.replace(f"{path}.gz.tmp", f"{path}.gz")
+            os.remove(path)
+            self._remove_old_backups()
+        except OSError:
+            if logging.raiseExceptions:
+                traceback.print_exc(file=sys.stderr)
+
+    def _remove_old_backups(self):
+        """Removes the compressed back ups beyond the backupCount most recent ones and those older than max_age"""
+        backups = sorted((i, path) for i, path in self._list_backups().items() if path.endswith(".gz"))
+        expired = backups[:-self.backupCount] if self.backupCount > 0 else []
+        if self.max_age is not None:
+            oldest_allowed = time.time() - self.max_age
+            expired.extend((i, path) for i, path in backups if os.path.getmtime(path) < oldest_allowed)
+
+        for _, path in expired:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def _list_backups(self) -> Dict[int, str]:
+        """Returns the paths of the back ups, compressed or not, by their numbers"""
+        folder, name = os.path.split(self.baseFilename)
+        pattern = re.compile(rf"{re.escape(name)}\.(\d+)(\.gz)?")
+        backups = {}
+        for filename in os.listdir(folder):
+            match = pattern.fullmatch(filename)
+            if match is not None:
+                index = int(match.group(1))
+                # a back up that is both compressed and not was being compressed when the process stopped
+                if match.group(2) is None or index not in backups:
+                    backups[index] = os.path.join(folder, filename)
+
+        return backups
+
+
+class BoundedQueueHandler(logging.Handler):
+    """
+    Hands records over to a queue of at most max_size records that a single writer thread drains,
+    in batches of at most batch_size, into the given handlers. The code that logs thus never waits
+    on disk I/O or on the locks of those handlers. Records that find the queue full are dropped and counted.
+    The writer is a native thread even under gevent's monkey patching, so that its writes and rollovers
+    do not hold up the greenlets that serve requests.
+    The writer is started on the first record of each process, so that each forked worker has its own,
+    and it writes out what is left in the queue when the handler is closed, say at exit
+    """
+
+    def __init__(self, handlers: Iterable[logging.Handler], max_size: int = 10000, batch_size: int = 100):
+        super().__init__()
+        self.handlers = list(handlers)
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: Optional[_NativeQueue] = None
+        # held by the writer of the current process until it stops
+        self._writer: Optional[Any] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        """Enqueues the record if it passes the filters, without taking the lock of the handler"""
+        should_handle = self.filter(record)
+        if should_handle:
+            self.emit(record)
+
+        return should_handle
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self._get_queue().put_nowait(self._prepare(record))
+        except queue.Full:
+            with self._start_lock:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of records waiting in the queue and of those dropped for monitoring"""
+        return dict(queued=0 if self._queue is None else self._queue.qsize(), dropped=self.dropped)
+
+    def close(self):
+        """Waits for the writer to write out the records in the queue, then closes the handlers"""
+        with self._start_lock:
+            writer, self._writer = (self._writer, None) if self._pid == os.getpid() else (None, None)
+
+        if writer is not None:
+            self._queue.put(_STOP)
+            if writer.acquire(timeout=5):
+                writer.release()
+
+        for handler in self.handlers:
+            handler.close()
+
+        super().close()
+
+    def _get_queue(self) -> "_NativeQueue":
+        """Returns the queue of the current process, starting its writer if it has not been started"""
+        if self._pid == os.getpid():
+            return self._queue
+
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = _NativeQueue(max_size=self.max_size)
+                self._writer = _allocate_native_lock()
+                self._writer.acquire()
+                _start_background_thread(self._write, self._queue, self._writer)
+                self._pid = os.getpid()
+
+        return self._queue
+
+    def _write(self, records: "_NativeQueue", running: Any):
+        """Writes the records in the queue, in batches, into the handlers until it is told to stop"""
+        try:
+            self._write_batches(records)
+        finally:
+            running.release()
+
+    def _write_batches(self, records: "_NativeQueue"):
+        """Writes the records in the queue, in batches, into the handlers until the stop record comes in"""
+        while True:
+            batch = [records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+
+            should_stop = any(record is _STOP for record in batch)
+            batch = [record for record in batch if record is not _STOP]
+            for handler in self.handlers:
+                # the lock of each handler is taken once per batch rather than once per record
+                handler.acquire()
+                try:
+                    for record in batch:
+                        if record.levelno >= handler.level and handler.filter(record):
+                            handler.emit(record)
+                finally:
+                    handler.release()
+
+            if should_stop:
+                return
+
+    @staticmethod
+    def _prepare(record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Adds the details of the current request to the record and merges its arguments and exception into its message,
+        so that it can be formatted by the writer, outside the request
+        """
+        if has_request_context():
+            record.url = request.url
+            record.remote_addr = request.remote_addr
+
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if record.exc_text is None:
+                record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+def create_rotating_file_handler(
         file_path: str,
         level: int,
-        max_bytes: int = 2000000):
+        max_bytes: int = 2000000,
+        backup_count: int = 0,
+        max_age: Optional[float] = None) -> logging.Handler:
     """
-    Makes the logger to use a file that rotates when a given size is reached.
-    It has a single back up and logs errors and above
+    Creates the handler of a file that rotates when a given size is reached, formatted with the request details.
+    All back ups are kept unless backup_count or max_age, in seconds, is given
     """
-    handler = RotatingGzipFileHandler(file_path, maxBytes=max_bytes)
+    handler = RotatingGzipFileHandler(file_path, maxBytes=max_bytes, backupCount=backup_count, max_age=max_age)
     handler.setLevel(level)
     request_formatter = RequestFormatter(
         '%(asctime)-15s %(remote_addr)s requested %(url)s\n'
         '%(levelname)s:\n%(message)s\n\n'
     )
     handler.setFormatter(request_formatter)
-    logger.addHandler(handler)
-    return logger
+    return handler
 
 
-def setup_stderr_logger(logger: logging.Logger, level: int):
-    """Sets up the given logger to log to standard output"""
+def create_stderr_handler(level: int) -> logging.Handler:
+    """Creates the handler of standard error"""
     handler = logging.StreamHandler(sys.stderr, )
     handler.terminator = '\r'
     handler.setLevel(level)
     log_formatter = logging.Formatter('[%(name)s]%(levelname)s: %(message)s')
     handler.setFormatter(log_formatter)
-    logger.addHandler(handler)
+    return handler
+
+
+def setup_rotating_file_logger(
+        logger: logging.Logger,
+        file_path: str,
+        level: int,
+        max_bytes: int = 2000000):
+    """
+    Makes the logger to use a file that rotates when a given size is reached.
+    It has a single back up and logs errors and above
+    """
+    logger.addHandler(create_rotating_file_handler(file_path=file_path, level=level, max_bytes=max_bytes))
+    return logger
+
+
+def setup_stderr_logger(logger: logging.Logger, level: int):
+    """Sets up the given logger to log to standard output"""
+    logger.addHandler(create_stderr_handler(level=level))
     return logger
 
 
 def initialize_logger(
         name: str,
         should_log_to_file: bool = True,
-        level: int = logging.ERROR) -> logging.Logger:
-    """Initializes the appropriate logger"""
+        level: int = logging.ERROR,
+        queue_size: int = 0,
+        batch_size: int = 100,
+        backup_count: int = 0,
+        max_age: Optional[float] = None) -> logging.Logger:
+    """
+    Initializes the appropriate logger.
+    If queue_size is above 0, records are written by a background writer through a BoundedQueueHandler.
+    Log files keep backup_count back ups, or all if it is 0, none of them older than max_age seconds if it is given
+    """
     logger = logging.getLogger(name)
 
-    if should_log_to_file:
+    if not should_log_to_file:
+        handler = create_stderr_handler(level=level)
+    else:
         logs_folder_path = os.path.join(os.getcwd(), 'logs')
         log_file_path = os.path.join(logs_folder_path, f'{name}.log')
         os.makedirs(logs_folder_path, exist_ok=True)
-        return setup_rotating_file_logger(file_path=log_file_path, logger=logger, level=level)
+        handler = create_rotating_file_handler(
+            file_path=log_file_path, level=level, backup_count=backup_count, max_age=max_age)
+
+    if queue_size > 0:
+        handler = BoundedQueueHandler([handler], max_size=queue_size, batch_size=batch_size)
+        handler.setLevel(level)
+
+    logger.addHandler(handler)
+    return logger
+
+
+class _NativeQueue:
+    """
+    A queue of at most max_size items that greenlets put items in without ever blocking, and that a native thread
+    takes them out of, blocking on a native lock while it is empty. Under gevent's monkey patching, queue.Queue
+    is built on gevent's locks, which a native thread cannot wait on while the greenlets run
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # appending to and popping from a deque are atomic
+        self._items = collections.deque()
+        # released whenever an item is put, so that the consumer waiting on it wakes up
+        self._ready = _allocate_native_lock()
+        self._ready.acquire()
+
+    def put_nowait(self, item: Any):
+        """Puts the item in the queue, raising queue.Full if it is full"""
+        if len(self._items) >= self.max_size:
+            raise queue.Full
+
+        self.put(item)
+
+    def put(self, item: Any):
+        """Puts the item in the queue even if it is full"""
+        self._items.append(item)
+        try:
+            self._ready.release()
+        except RuntimeError:
+            # the consumer has yet to take the items put before
+            pass
+
+    def get(self) -> Any:
+        """Takes the oldest item out of the queue, waiting for one if it is empty"""
+        while True:
+            try:
+                return self._items.popleft()
+            except IndexError:
+                self._ready.acquire()
+
+    def get_nowait(self) -> Any:
+        """Takes the oldest item out of the queue, raising queue.Empty if it is empty"""
+        try:
+            return self._items.popleft()
+        except IndexError:
+            raise queue.Empty
+
+    def qsize(self) -> int:
+        """Returns the number of items in the queue"""
+        return len(self._items)
+
+
+def _allocate_native_lock():
+    """Returns a lock of the operating system, even under gevent's monkey patching, that native threads can wait on"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+
+    if monkey is not None and monkey.is_module_patched("threading"):
+        return monkey.get_original("_thread", "allocate_lock")()
+
+    return _thread.allocate_lock()
+
+
+def _start_background_thread(target, *args):
+    """
+    Runs the target in a daemon thread. Under gevent's monkey patching, it is a native thread rather than a greenlet,
+    so that its blocking work, say compression, does not hold up the greenlets that serve requests
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
 
-    return setup_stderr_logger(logger=logger, level=level)
+    if monkey is not None and monkey.is_module_patched("threading"):
+        monkey.get_original("_thread", "start_new_thread")(target, args)
+    else:
+        threading.Thread(target=target, args=args, daemon=True).start()
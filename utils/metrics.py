@@ -0,0 +1,212 @@
+"""Module containing the metrics of the app, rendered in the Prometheus text format"""
+import bisect
+import math
+import threading
+from typing import Dict, Tuple, List, Iterable, Callable, Optional, Any, Union
+
+from utils.http import UpstreamCall
+
+_Labels = Tuple[str, ...]
+# a collector returns the samples of a metric family i.e. its name, its help text and (labels, value) pairs
+Collector = Callable[[], Iterable[Tuple[str, str, Iterable[Tuple[Dict[str, Any], float]]]]]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class Counter:
+    """A monotonically increasing value per combination of labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[_Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any):
+        """Increments the value of the given labels by the given amount"""
+        key = _get_label_values(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        """Returns the lines of this counter in the Prometheus text format"""
+        with self._lock:
+            values = list(self._values.items())
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values)
+        return lines
+
+
+class Histogram:
+    """The distribution of observed values, say durations, per combination of labels, in cumulative buckets"""
+
+    def __init__(
+            self,
+            name: str,
+            help_text: str,
+            labelnames: Iterable[str] = (),
+            buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # the count of each bucket, the last one being +Inf, followed by the sum of all values
+        self._values: Dict[_Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, **labels: Any):
+        """Allocates the buckets of the given labels ahead of their first observation"""
+        key = _get_label_values(self.labelnames, labels)
+        with self._lock:
+            self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+
+    def observe(self, value: float, **labels: Any):
+        """Records the given value under the given labels"""
+        key = _get_label_values(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key, None)
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 2)
+                self._values[key] = counts
+
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self) -> List[str]:
+        """Returns the lines of this histogram in the Prometheus text format"""
+        with self._lock:
+            # buckets that were allocated but have no observations yet are left out
+            values = [(key, list(counts)) for key, counts in self._values.items() if any(counts[:-1])]
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        labelnames = (*self.labelnames, "le")
+        for key, counts in values:
+            cumulative = 0
+            for upper_bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                labels = _format_labels(labelnames, (*key, _format_value(upper_bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of the current process. Counters and histograms are updated as things happen
+    while collectors are called to read other values, say the stats of the cache, only when the metrics are rendered
+    """
+
+    def __init__(self):
+        self._metrics: List[Union[Counter, Histogram]] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        """Creates and registers a counter"""
+        metric = Counter(name=name, help_text=help_text, labelnames=labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+            self,
+            name: str,
+            help_text: str,
+            labelnames: Iterable[str] = (),
+            buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Creates and registers a histogram"""
+        metric = Histogram(name=name, help_text=help_text, labelnames=labelnames, buckets=buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector):
+        """Registers a function that returns metric families to be read when the metrics are rendered"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text format"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        for collector in self._collectors:
+            for name, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} untyped")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels.keys()), tuple(labels.values()))} "
+                                 f"{_format_value(value)}")
+
+        lines.append("")
+        return "\n".join(lines)
+
+
+class UpstreamMetrics:
+    """
+    A hook of the HttpClient that records the latency, status code, bytes transferred, retries and
+    estimated quota cost of every call to an upstream API, per endpoint
+    """
+
+    def __init__(self, registry: MetricsRegistry, namespace: str = "youhedge"):
+        prefix = f"{namespace}_upstream"
+        self.duration = registry.histogram(
+            f"{prefix}_request_duration_seconds", "Duration of calls to upstream APIs", ("endpoint",))
+        self.requests = registry.counter(
+            f"{prefix}_requests_total", "Calls to upstream APIs by status code", ("endpoint", "method", "status"))
+        self.bytes_sent = registry.counter(
+            f"{prefix}_request_bytes_total", "Bytes of the bodies sent to upstream APIs", ("endpoint",))
+        self.bytes_received = registry.counter(
+            f"{prefix}_response_bytes_total", "Bytes of the bodies received from upstream APIs", ("endpoint",))
+        self.retries = registry.counter(
+            f"{prefix}_retries_total", "Retries of calls to upstream APIs", ("endpoint",))
+        self.quota_cost = registry.counter(
+            f"{prefix}_quota_cost_total", "Estimated quota units spent on upstream APIs", ("endpoint",))
+
+    def __call__(self, call: UpstreamCall):
+        status = "error" if call.status_code is None else str(call.status_code)
+        self.duration.observe(call.duration, endpoint=call.endpoint)
+        self.requests.inc(endpoint=call.endpoint, method=call.method, status=status)
+        self.bytes_sent.inc(call.bytes_sent, endpoint=call.endpoint)
+        self.bytes_received.inc(call.bytes_received, endpoint=call.endpoint)
+        if call.retries:
+            self.retries.inc(call.retries, endpoint=call.endpoint)
+        if call.quota_cost:
+            self.quota_cost.inc(call.quota_cost, endpoint=call.endpoint)
+
+
+def stats_family(name: str, help_text: str, stats: Dict[str, Any], labels: Optional[Dict[str, Any]] = None):
+    """
+    Returns the metric families of the given stats, say of the cache, one per key, named '<name>_<key>'.
+    It is a helper for collectors
+    """
+    labels = labels or {}
+    return [(f"{name}_{key}", f"{help_text}: {key}", [(labels, value)]) for key, value in stats.items()]
+
+
+def _get_label_values(labelnames: _Labels, labels: Dict[str, Any]) -> _Labels:
+    """Returns the values of the given labels in the order of the label names"""
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames: Iterable[str], values: Iterable[Any]) -> str:
+    """Returns the labels as rendered in the Prometheus text format e.g. {endpoint="x",status="200"}"""
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Returns the value as rendered in the Prometheus text format"""
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    """Escapes a label value as required by the Prometheus text format"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,157 @@
+"""
+Module containing utilities to project trusted JSON payloads onto DTOs without building the DTOs.
+
+A projection keeps only the fields declared on the DTO, in the order they are declared, checking the type
+of each value on the way. It gives the same output as Dto.model_validate(data).model_dump(exclude_unset=True)
+but it builds no models. Any payload that does not exactly match the declared types, say one that
+pydantic would have to coerce or reject, is handed over to pydantic instead, so the schema guarantees,
+and the validation errors, stay the same
+"""
+import inspect
+import typing
+from typing import Any, Callable, Dict, Optional, Type, Union
+
+from utils.base_dto import BaseDto
+from utils.instrumentation import phase, VALIDATION
+
+_Projector = Callable[[Any], Any]
+
+_NONE_TYPE = type(None)
+# the types whose values are passed through as is if they are of exactly that type
+_SCALAR_TYPES = (str, int, float, bool)
+
+_projectors: Dict[Type[BaseDto], Optional[_Projector]] = {}
+
+
+class ProjectionError(Exception):
+    """Raised when a payload does not exactly match the types declared on the DTO"""
+
+
+def project(model: Type[BaseDto], data: Any) -> Dict[str, Any]:
+    """
+    Returns only the fields of the data that are declared on the given DTO, with the same output as
+    model.model_validate(data).model_dump(exclude_unset=True). It raises a ValidationError if the data is invalid
+    """
+    with phase(VALIDATION):
+        projector = get_projector(model)
+        if projector is not None:
+            try:
+                return projector(data)
+            except ProjectionError:
+                pass
+
+        return model.model_validate(data).model_dump(exclude_unset=True)
+
+
+def get_projector(model: Type[BaseDto]) -> Optional[_Projector]:
+    """
+    Returns the compiled projector of the given DTO or None if the DTO has fields of types
+    that cannot be projected
+    """
+    try:
+        return _projectors[model]
+    except KeyError:
+        pass
+
+    try:
+        projector = _compile_model(model)
+    except TypeError:
+        projector = None
+
+    _projectors[model] = projector
+    return projector
+
+
+def _compile_model(model: Type[BaseDto]) -> _Projector:
+    """Compiles the projector of the given DTO from its fields"""
+    if any(field.alias is not None and field.alias != name for name, field in model.model_fields.items()):
+        raise TypeError(f"aliases of {model} are not supported")
+
+    fields = tuple(
+        (name, _compile_type(field.annotation), field.is_required())
+        for name, field in model.model_fields.items()
+    )
+
+    def project_model(value: Any) -> Dict[str, Any]:
+        if type(value) is not dict:
+            raise ProjectionError()
+
+        result = {}
+        for name, project_field, is_required in fields:
+            if name in value:
+                result[name] = project_field(value[name])
+            elif is_required:
+                raise ProjectionError()
+
+        return result
+
+    return project_model
+
+
+def _compile_type(type_: Any) -> _Projector:
+    """Compiles the projector of values of the given type"""
+    if type_ is Any:
+        return _project_any
+
+    if type_ in _SCALAR_TYPES:
+        return _compile_scalar(type_)
+
+    origin = typing.get_origin(type_)
+    args = typing.get_args(type_)
+
+    if origin is Union and len(args) == 2 and _NONE_TYPE in args:
+        inner_type = args[0] if args[1] is _NONE_TYPE else args[1]
+        return _compile_optional(_compile_type(inner_type))
+
+    if origin is list and len(args) == 1:
+        return _compile_list(_compile_type(args[0]))
+
+    if inspect.isclass(type_) and issubclass(type_, BaseDto):
+        projector = get_projector(type_)
+        if projector is None:
+            raise TypeError(f"{type_} cannot be projected")
+
+        return projector
+
+    raise TypeError(f"{type_} cannot be projected")
+
+
+def _compile_scalar(type_: type) -> _Projector:
+    """Compiles the projector of values that should be of exactly the given type"""
+
+    def project_scalar(value: Any) -> Any:
+        if type(value) is not type_:
+            raise ProjectionError()
+
+        return value
+
+    return project_scalar
+
+
+def _compile_optional(project_inner: _Projector) -> _Projector:
+    """Compiles the projector of values that are either None or projected by project_inner"""
+
+    def project_optional(value: Any) -> Any:
+        if value is None:
+            return None
+
+        return project_inner(value)
+
+    return project_optional
+
+
+def _compile_list(project_item: _Projector) -> _Projector:
+    """Compiles the projector of lists whose items are projected by project_item"""
+
+    def project_list(value: Any) -> Any:
+        if type(value) is not list:
+            raise ProjectionError()
+
+        return [project_item(item) for item in value]
+
+    return project_list
+
+
+def _project_any(value: Any) -> Any:
+    """Passes through values of fields of type Any"""
+    return value
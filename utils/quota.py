@@ -0,0 +1,193 @@
+"""Module containing the accounting of the daily quota of upstream APIs, say YouTube data v3"""
+import math
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone, timedelta
+from http import HTTPStatus
+from typing import Dict, Optional
+
+from utils.cache_backends import SqliteConnection
+from utils.exc import APIException
+from utils.http import UpstreamCall
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+    # the YouTube quota is reset at midnight Pacific Time
+    _QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+except (ImportError, ZoneInfoNotFoundError):
+    _QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+# the steps of degradation as the remaining quota runs low, each including the ones before it
+NORMAL = 0
+EXTEND_TTL = 1
+SERVE_STALE = 2
+REFUSE_COSTLY = 3
+
+
+class QuotaStore(ABC):
+    """The interface of the stores that hold the units of quota used per day"""
+
+    @abstractmethod
+    def add(self, day: str, units: int):
+        """Adds the given units to those used on the given day"""
+
+    @abstractmethod
+    def get(self, day: str) -> int:
+        """Returns the units used on the given day"""
+
+
+class MemoryQuotaStore(QuotaStore):
+    """A store in the memory of the current process"""
+
+    def __init__(self):
+        self._used: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, day: str, units: int):
+        with self._lock:
+            self._used = {day: self._used.get(day, 0) + units}
+
+    def get(self, day: str) -> int:
+        return self._used.get(day, 0)
+
+
+class SqliteQuotaStore(QuotaStore):
+    """A store in a table of an SQLite file that is shared by all processes, say uWSGI workers, that point to it"""
+
+    def __init__(self, path: str, table: str = "quota"):
+        self._table = table
+        self._db = SqliteConnection(
+            path, schema=(f"CREATE TABLE IF NOT EXISTS {table} (day TEXT PRIMARY KEY, used INTEGER NOT NULL)",))
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection to the SQLite file of this process"""
+        return self._db.get()
+
+    def add(self, day: str, units: int):
+        self.conn.execute(
+            f"INSERT INTO {self._table} (day, used) VALUES (?, ?) "
+            "ON CONFLICT (day) DO UPDATE SET used = used + excluded.used",
+            (day, units))
+
+    def get(self, day: str) -> int:
+        row = self.conn.execute(f"SELECT used FROM {self._table} WHERE day = ?", (day,)).fetchone()
+        return 0 if row is None else row[0]
+
+
+class QuotaAccountant:
+    """
+    Tracks the units of an upstream API's daily quota spent by all workers sharing the store
+    against the daily budget, and degrades in steps as the remaining quota runs low:
+    at extend_ttl_below of the budget left, cached values live ttl_factor times longer;
+    at serve_stale_below, stale values are served as they are instead of being refreshed upstream;
+    at refuse_costly_below, uncached requests that would cost more than max_cost_when_low units are refused.
+    Once the budget is spent, all requests that would cost anything are refused.
+    The units used by other workers are read from the store at most once every sync_interval seconds
+    """
+
+    def __init__(
+            self,
+            daily_budget: int,
+            store: Optional[QuotaStore] = None,
+            extend_ttl_below: float = 0.5,
+            serve_stale_below: float = 0.25,
+            refuse_costly_below: float = 0.1,
+            ttl_factor: float = 4,
+            max_cost_when_low: int = 1,
+            sync_interval: float = 1):
+        self.daily_budget = daily_budget
+        self._store = store if store is not None else MemoryQuotaStore()
+        self._extend_ttl_below = extend_ttl_below
+        self._serve_stale_below = serve_stale_below
+        self._refuse_costly_below = refuse_costly_below
+        self._ttl_factor = float(ttl_factor)
+        self._max_cost_when_low = max_cost_when_low
+        self._sync_interval = float(sync_interval)
+        self._day: Optional[str] = None
+        self._used = 0
+        self._next_sync_at = 0.0
+
+    def record(self, call: UpstreamCall):
+        """A hook of the HttpClient that spends the quota cost of every call that reached the upstream API"""
+        if call.quota_cost and call.status_code is not None:
+            self.spend(call.quota_cost)
+
+    def spend(self, units: int):
+        """Adds the given units to those used today"""
+        day = self._get_day()
+        self._store.add(day, units)
+        if day == self._day:
+            self._used += units
+
+    def used(self) -> int:
+        """Returns the units used today by all workers, as last read from the store"""
+        day = self._get_day()
+        now = time.monotonic()
+        if day != self._day or now >= self._next_sync_at:
+            self._used = self._store.get(day)
+            self._day = day
+            self._next_sync_at = now + self._sync_interval
+
+        return self._used
+
+    def remaining(self) -> int:
+        """Returns the units left in today's budget"""
+        return max(self.daily_budget - self.used(), 0)
+
+    def level(self) -> int:
+        """Returns the current step of degradation i.e. NORMAL, EXTEND_TTL, SERVE_STALE or REFUSE_COSTLY"""
+        fraction_left = self.remaining() / self.daily_budget if self.daily_budget > 0 else 0
+        if fraction_left < self._refuse_costly_below:
+            return REFUSE_COSTLY
+
+        if fraction_left < self._serve_stale_below:
+            return SERVE_STALE
+
+        if fraction_left < self._extend_ttl_below:
+            return EXTEND_TTL
+
+        return NORMAL
+
+    def ttl_factor(self) -> float:
+        """Returns the factor by which TTLs of cached values are multiplied"""
+        return self._ttl_factor if self.level() >= EXTEND_TTL else 1.0
+
+    def should_serve_stale(self) -> bool:
+        """Returns whether stale values should be served as they are instead of being refreshed upstream"""
+        return self.level() >= SERVE_STALE
+
+    def admit(self, cost: float):
+        """
+        Raises an APIException if an uncached request that is estimated to cost the given units
+        cannot be afforded. The cost can be math.inf for requests of unbounded cost
+        """
+        remaining = self.remaining()
+        if cost > remaining or (self.level() >= REFUSE_COSTLY and cost > self._max_cost_when_low):
+            raise APIException(
+                message="YouTube quota is running low, try again later",
+                status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                payload=dict(cost=None if math.isinf(cost) else cost, remaining=remaining))
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the state of the quota for monitoring"""
+        return dict(daily_budget=self.daily_budget, used=self.used(), level=self.level())
+
+    @staticmethod
+    def _get_day() -> str:
+        """Returns the day of the quota, in the timezone it is reset in"""
+        return datetime.now(_QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+
+def create_quota_store(name: str, path: str, table: str = "quota") -> QuotaStore:
+    """Creates the quota store of the given name i.e. 'memory' or 'sqlite', just like the cache backends"""
+    if name == "memory":
+        return MemoryQuotaStore()
+
+    if name == "sqlite":
+        return SqliteQuotaStore(path=path, table=table)
+
+    raise ValueError(f"unknown quota store '{name}'")
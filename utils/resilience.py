@@ -0,0 +1,134 @@
+"""Module containing the policies that keep calls to upstream APIs from piling up while the APIs are degraded"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Iterable
+
+# the statuses of responses that are worth retrying as they are likely transient
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class RetryPolicy:
+    """
+    Retries failed calls at most max_retries times, waiting an exponential backoff with full jitter
+    between attempts i.e. a random time between 0 and min(backoff_max, backoff_base * 2 ** attempt) seconds.
+    If the response has a Retry-After header, its delay is waited instead, unless it is longer
+    than max_retry_after seconds in which case the call is not retried
+    """
+
+    def __init__(
+            self,
+            max_retries: int = 2,
+            backoff_base: float = 0.2,
+            backoff_max: float = 5,
+            max_retry_after: float = 10,
+            statuses: Iterable[int] = RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.statuses = frozenset(statuses)
+
+    def get_delay(self, attempt: int, retry_after: Optional[str] = None) -> Optional[float]:
+        """
+        Returns the number of seconds to wait before the retry after the given attempt, counted from 0,
+        or None if the call should not be retried
+        """
+        if attempt >= self.max_retries:
+            return None
+
+        if retry_after is not None:
+            delay = parse_retry_after(retry_after)
+            if delay is not None:
+                return delay if delay <= self.max_retry_after else None
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Fails calls to an endpoint fast once failure_threshold calls in a row have failed.
+    The circuit then stays open for reset_timeout seconds, after which a single trial call is let through
+    (half-open): if it succeeds the circuit is closed again, otherwise it is opened for another reset_timeout
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently being failed fast"""
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        """Returns whether a call may be made now"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+
+            if self._trial_in_flight or time.monotonic() < self.opened_at + self.reset_timeout:
+                return False
+
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        """Closes the circuit"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Counts a failed call, opening the circuit once there are failure_threshold failures in a row"""
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class CircuitBreakers:
+    """The circuit breakers of all endpoints, each created on the first call to its endpoint"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        """Returns the circuit breaker of the given endpoint"""
+        breaker = self._breakers.get(endpoint, None)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    endpoint, CircuitBreaker(failure_threshold=self.failure_threshold, reset_timeout=self.reset_timeout))
+
+        return breaker
+
+    def stats(self) -> Dict[str, int]:
+        """Returns whether the circuit of each endpoint is open (1) or not (0) for monitoring"""
+        return {endpoint: int(breaker.is_open) for endpoint, breaker in list(self._breakers.items())}
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """
+    Returns the number of seconds to wait as given by a Retry-After header, either in seconds or as an HTTP date,
+    or None if it cannot be parsed
+    """
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
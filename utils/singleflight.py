@@ -0,0 +1,96 @@
+"""Module containing utilities to deduplicate concurrent calls that would do the same work"""
+import threading
+from typing import Any, Dict, Optional
+
+
+class _Call:
+    """A call in flight whose result is shared by all its callers"""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Ensures that only one call runs at a time for any given key.
+    Callers that come in while the call for their key is running wait for it and get its result,
+    or its exception, instead of running their own.
+    It uses threading primitives and threads which gevent's monkey patching turns into greenlet-friendly ones
+    """
+
+    def __init__(self):
+        self._calls: Dict[Any, _Call] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Any, func, *args, **kwargs) -> Any:
+        """Calls func with the given args unless a call for the same key is running, in which case it waits for it"""
+        with self._lock:
+            call = self._calls.get(key, None)
+            is_leader = call is None
+            if is_leader:
+                call = self._start(key)
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        return self._run(key, call, func, *args, **kwargs)
+
+    def spawn(self, key: Any, func, *args, **kwargs) -> bool:
+        """
+        Calls func with the given args in the background unless a call for the same key is running.
+        Callers of do() with the same key meanwhile wait for this call.
+        It returns whether the call was started
+        """
+        with self._lock:
+            if key in self._calls:
+                return False
+
+            call = self._start(key)
+
+        thread = threading.Thread(
+            target=self._run_in_background, args=(key, call, func, *args), kwargs=kwargs, daemon=True)
+        thread.start()
+        return True
+
+    def _start(self, key: Any) -> _Call:
+        """Registers a new call for the given key. It should be called while holding the lock"""
+        call = _Call()
+        self._calls[key] = call
+        self.calls += 1
+        return call
+
+    def _run(self, key: Any, call: _Call, func, *args, **kwargs) -> Any:
+        """Runs the given call, sharing its result or exception with the callers waiting for it"""
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as exp:
+            call.error = exp
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+    def _run_in_background(self, key: Any, call: _Call, func, *args, **kwargs):
+        """Runs the given call, leaving any exception to the callers waiting for it"""
+        try:
+            self._run(key, call, func, *args, **kwargs)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters of the calls for monitoring"""
+        return dict(calls=self.calls, coalesced=self.coalesced, in_flight=len(self._calls))
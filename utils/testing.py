@@ -1,15 +1,26 @@
 """Module for utilities for tests"""
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+import orjson
 
 
 class MockResponse:
-    def __init__(self, data: Dict[str, Any], status_code: int):
+    def __init__(self, data: Dict[str, Any], status_code: int, headers: Optional[Dict[str, str]] = None):
         self._data = data
         self._status_code = status_code
+        self.headers = headers if headers is not None else {}
+
+    @property
+    def status_code(self) -> int:
+        return self._status_code
 
     @property
     def ok(self) -> bool:
         return self._status_code < 400
 
+    @property
+    def content(self) -> bytes:
+        return orjson.dumps(self._data)
+
     def json(self) -> Dict[str, Any]:
         return self._data
@@ -0,0 +1,48 @@
+"""Module containing the cache of the states of access tokens"""
+import hashlib
+import time
+from typing import Optional
+
+from utils.cache import Cache
+
+# the expiry time of tokens that were rejected by Google, whatever their actual expiry time
+_REJECTED = 0.0
+
+
+class TokenStates:
+    """
+    Remembers the access tokens that Google has rejected and the expiry times of the access tokens
+    handed out by this app, so that requests with rejected or expired tokens are refused locally.
+    Tokens are only kept as hashes, in a bounded cache. Tokens that are not known are assumed to be valid.
+    Expired tokens are remembered for retention seconds after they expire, and rejected ones for retention seconds
+    """
+
+    def __init__(self, cache: Cache, retention: float = 3600):
+        self._cache = cache
+        self._retention = retention
+
+    def issue(self, token: str, expires_in: float):
+        """Records that the given token expires in expires_in seconds"""
+        self._cache.set(_hash(token), time.time() + expires_in, ttl=expires_in + self._retention)
+
+    def reject(self, token: str):
+        """Records that the given token was rejected by Google"""
+        self._cache.set(_hash(token), _REJECTED, ttl=self._retention)
+
+    def is_valid(self, token: str) -> bool:
+        """Returns False if the given token is known to have been rejected or to have expired"""
+        expires_at: Optional[float] = self._cache[_hash(token)]
+        return expires_at is None or expires_at > time.time()
+
+    def stats(self):
+        """Returns the counters of the underlying cache for monitoring"""
+        return self._cache.stats()
+
+    def clear(self):
+        """Forgets all tokens"""
+        self._cache.clear()
+
+
+def _hash(token: str) -> str:
+    """Returns the key of the given token in the cache, so that tokens are never stored as they are"""
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
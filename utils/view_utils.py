@@ -1,23 +1,43 @@
 """Module containing utility functions concerned with views app"""
 import functools
-from typing import Type
+import time
+from typing import Type, Iterable, Optional, Callable, Iterator, Union
 
-from flask import request, current_app
+from flask import request, current_app, copy_current_request_context, Request, Response, stream_with_context
 from pydantic import ValidationError
 
-from utils.base_dto import BaseDto
+from utils.base_dto import BaseDto, RawJson
+from utils.cache import get_req_id, DEFAULT_KEY_HEADERS, Cache
 from utils.exc import APIException
+from utils.instrumentation import phase, set_cache_status, REQ_ID, CACHE_LOOKUP, VALIDATION, CACHE_BYPASS, \
+    CACHE_MISS, CACHE_STALE, CACHE_HIT
+from utils.quota import QuotaAccountant
+from utils.singleflight import SingleFlight
+from utils.tokens import TokenStates
 
 
 def auth_token_required(view):
-    """Decorator to ensure the given view has the token passed as a Header X-YouHedge-Token"""
+    """
+    Decorator to ensure the given view has the token passed as a Header X-YouHedge-Token.
+    Tokens known to be rejected or expired are refused without calling the view,
+    and tokens rejected by Google while the view runs are remembered as such
+    """
     @functools.wraps(view)
     def wrapped_view(**kwargs):
         access_token = request.headers.get("X-YouHedge-Token", None)
         if access_token is None:
             raise APIException(message="Missing 'X-YouHedge-Token' header", status_code=401)
 
-        return view(**kwargs, access_token=access_token)
+        token_states: TokenStates = current_app.config["TOKEN_STATES"]
+        if not token_states.is_valid(access_token):
+            raise APIException(message="invalid or expired token", status_code=401)
+
+        try:
+            return view(**kwargs, access_token=access_token)
+        except APIException as exp:
+            if exp.status_code == 401:
+                token_states.reject(access_token)
+            raise
 
     return wrapped_view
 
@@ -28,7 +48,8 @@ def body_required(request_model: Type[BaseDto]):
         @functools.wraps(view)
         def inner_view(**kwargs):
             try:
-                body = request_model.validate(request.json)
+                with phase(VALIDATION):
+                    body = request_model.validate(request.json)
                 return view(**kwargs, body=body)
             except ValidationError:
                 raise APIException(message="malformed body", status_code=400)
@@ -38,12 +59,100 @@ def body_required(request_model: Type[BaseDto]):
     return wrapped_view
 
 
-def cached(view):
-    """Ensures that the wrapped view hits the cache first before it tries the full request"""
+def stream_ndjson(items: Iterator[Union[BaseDto, RawJson]]) -> Response:
+    """
+    Streams the given DTOs as newline-delimited JSON, one DTO per line, as they are yielded.
+    The first DTO is fetched before responding so that errors up to then get the right status code
+    """
+    first_item = next(items, None)
 
-    @functools.wraps(view)
-    def wrapped_view(**kwargs):
-        cache = current_app.config["CACHE"]
-        return cache.get_view(view, **kwargs)
+    def generate():
+        if first_item is None:
+            return
 
-    return wrapped_view
+        yield first_item.bjson() + b"\n"
+        for item in items:
+            yield item.bjson() + b"\n"
+
+    return current_app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def cached(
+        view=None,
+        *,
+        headers: Iterable[str] = DEFAULT_KEY_HEADERS,
+        query_args: Optional[Iterable[str]] = None,
+        unless: Optional[Callable[[Request], bool]] = None):
+    """
+    Ensures that the wrapped view hits the cache first before it tries the full request.
+    Concurrent misses of the same key are coalesced so that only one of them calls the view
+    and the rest share its response. Stale responses are served right away while the view
+    is called in the background to refresh them, unless the upstream quota is running low.
+    Responses have an ETag and a Cache-Control header, and requests whose If-None-Match matches
+    the ETag get a 304 with no body.
+    It can be used as @cached or as @cached(headers=..., query_args=...) to choose the headers
+    and the query args that make up the cache key. By default, all query args and the
+    X-YouHedge-Token header are used.
+    The cache is skipped for requests for which unless(request), if given, is True.
+    """
+    headers = tuple(headers)
+    if query_args is not None:
+        query_args = frozenset(query_args)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped_view(**kwargs):
+            if unless is not None and unless(request):
+                set_cache_status(CACHE_BYPASS)
+                return func(**kwargs)
+
+            cache: Cache = current_app.config["CACHE"]
+            with phase(REQ_ID):
+                req_id = get_req_id(request, headers=headers, query_args=query_args)
+            flights: SingleFlight = current_app.config["SINGLE_FLIGHT"]
+            with phase(CACHE_LOOKUP):
+                entry = cache.lookup_entry(req_id)
+            if entry is None:
+                set_cache_status(CACHE_MISS)
+                record = flights.do(req_id, cache.load, func, req_id, **kwargs)
+                # the response was just cached so it stays fresh for the whole TTL
+                max_age = cache.ttl
+            else:
+                record = entry.value
+                max_age = entry.stale_at - time.time()
+                if max_age <= 0:
+                    set_cache_status(CACHE_STALE)
+                    quota: Optional[QuotaAccountant] = current_app.config.get("QUOTA", None)
+                    # while the quota is running low, stale responses are served as they are
+                    if quota is None or not quota.should_serve_stale():
+                        flights.spawn(req_id, copy_current_request_context(_refresh_view), func, req_id, **kwargs)
+                else:
+                    set_cache_status(CACHE_HIT)
+
+            response = record.to_response(current_app.response_class)
+            response.cache_control.private = True
+            # clients may keep the response only for as long as it stays fresh in the cache
+            response.cache_control.max_age = max(0, int(max_age))
+            # responds with a 304 if the client already has the response of the same ETag
+            return response.make_conditional(request)
+
+        return wrapped_view
+
+    if view is not None:
+        return decorator(view)
+
+    return decorator
+
+
+def _refresh_view(view, req_id: str, **kwargs):
+    """
+    Calls the view to refresh its response in the cache.
+    It is meant to run in the background, in a copy of the request context, so errors are logged
+    before being passed on to any requests waiting for the refresh
+    """
+    cache: Cache = current_app.config["CACHE"]
+    try:
+        return cache.load(view, req_id, **kwargs)
+    except Exception as exp:
+        current_app.config["ERROR_LOGGER"].error(str(exp))
+        raise